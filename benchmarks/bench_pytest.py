@@ -0,0 +1,19 @@
+# Not collected by a plain `pytest` run, run it explicitly:
+#     pytest benchmarks/bench_pytest.py --benchmark-autosave
+#     pytest benchmarks/bench_pytest.py --benchmark-compare --benchmark-compare-fail=mean:10%
+import pytest
+
+from benchmark import CASES
+
+pytest.importorskip('pytest_benchmark')
+
+SIZES = [5, 10, 20, 50, 100, 200]
+P_VALUES = [0.5, 0.9]
+Q_VALUES = [0.5, 0.9]
+
+
+@pytest.mark.parametrize('case, size, p, q', [
+    pytest.param(case, size, p, q, id=f'{case.name}-{size}-{p}-{q}')
+    for case in CASES for size, p, q in case.parameters(SIZES, P_VALUES, Q_VALUES)])
+def test_benchmark(benchmark, case, size, p, q):
+    benchmark(case.prepare(size, p, q))
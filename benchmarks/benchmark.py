@@ -0,0 +1,214 @@
+"""Performance baseline of the routing pipeline.
+
+    python benchmarks/benchmark.py run --sizes 5 10 50 --label my-change
+    python benchmarks/benchmark.py compare --threshold 0.1
+
+`run` appends trials per second and tracemalloc peak memory of every case to a JSON history file, `compare` checks
+the last run against the one before it and exits with status 1 when a case got slower or bigger than the threshold.
+The same cases run under pytest-benchmark through `bench_pytest.py`.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import networkx as nx
+
+from dodag import DodagAsyncNode
+from synchronous import external_phase, internal_phase, approx_mean_path_length_for_2d_lattice, lattice_2d_embedding
+
+DEFAULT_SIZES = [5, 10, 20, 50, 100, 200]
+DEFAULT_HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'history.json')
+
+
+class BenchmarkCase:
+    """A timed operation on an n x n grid. `prepare(size, p, q)` does the untimed set up and returns the trial."""
+
+    def __init__(self, name, prepare, uses_p=False, uses_q=False, max_size=None):
+        self.name = name
+        self.prepare = prepare
+        self.uses_p = uses_p
+        self.uses_q = uses_q
+        self.max_size = max_size
+
+    def parameters(self, sizes, p_values, q_values):
+        for size in sizes:
+            if self.max_size is not None and size > self.max_size:
+                continue
+            for p in p_values if self.uses_p else [None]:
+                for q in q_values if self.uses_q else [None]:
+                    yield size, p, q
+
+
+def _prepare_external_phase(size, p, q):
+    physical_topology = nx.grid_2d_graph(size, size)
+    return lambda: external_phase(physical_topology, p)
+
+
+def _prepare_internal_phase(size, p, q):
+    random.seed(size)
+    physical_topology = nx.grid_2d_graph(size, size)
+    instant_topologies = [external_phase(physical_topology, p) for _ in range(8)]
+    source, target = (0, 0), (size // 2, size // 2)
+    instant_topologies_in_turn = itertools.cycle(instant_topologies)
+    return lambda: internal_phase(next(instant_topologies_in_turn), source, target, q)
+
+
+def _prepare_mean_path_length(size, p, q):
+    graph = nx.grid_2d_graph(size, size)
+    return lambda: approx_mean_path_length_for_2d_lattice(graph, (0, 0), (size - 1, size - 1))
+
+
+def _prepare_lattice_detection(size, p, q):
+    graph = nx.grid_2d_graph(size, size)
+    # the cache would turn every trial after the first into a lookup, time the detection itself
+    return lambda: lattice_2d_embedding(graph, cached=False)
+
+
+def _prepare_construct_dodag(size, p, q):
+    physical_network = nx.grid_2d_graph(size, size)
+    return lambda: DodagAsyncNode.construct_dodag_on_network(physical_network, (0, 0))
+
+
+def _prepare_build_dodag(size, p, q):
+    physical_network = nx.grid_2d_graph(size, size)
+    return lambda: DodagAsyncNode.build_dodag_on_network(physical_network, (0, 0))
+
+
+CASES = [
+    BenchmarkCase('external_phase', _prepare_external_phase, uses_p=True),
+    BenchmarkCase('internal_phase', _prepare_internal_phase, uses_p=True, uses_q=True),
+    # counting paths grows exponentially with the shorter side of the lattice
+    BenchmarkCase('approx_mean_path_length_for_2d_lattice', _prepare_mean_path_length, max_size=7),
+    BenchmarkCase('is_2d_lattice_graph', _prepare_lattice_detection),
+    BenchmarkCase('construct_dodag_on_network', _prepare_construct_dodag),
+    BenchmarkCase('build_dodag_on_network', _prepare_build_dodag),
+]
+
+
+def measure(trial, min_time=0.2):
+    """Returns trials per second over at least `min_time` seconds and the peak memory of one traced trial."""
+    trial()  # warm up
+    calls = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while calls == 0 or elapsed < min_time:
+        trial()
+        calls += 1
+        elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        trial()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return calls / elapsed, peak_memory
+
+
+def run_benchmarks(sizes=None, p_values=(0.5, 0.9), q_values=(0.5, 0.9), case_names=None, min_time=0.2):
+    if sizes is None:
+        sizes = DEFAULT_SIZES
+    records = []
+    for case in CASES:
+        if case_names is not None and case.name not in case_names:
+            continue
+        for size, p, q in case.parameters(sizes, p_values, q_values):
+            trials_per_second, peak_memory = measure(case.prepare(size, p, q), min_time=min_time)
+            records.append({'case': case.name, 'size': size, 'p': p, 'q': q,
+                            'trials_per_second': trials_per_second, 'peak_memory_bytes': peak_memory})
+    return records
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return {'runs': []}
+    with open(path) as history_file:
+        return json.load(history_file)
+
+
+def append_history(path, records, label=None):
+    history = load_history(path)
+    history['runs'].append({
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'label': label,
+        'python': platform.python_version(),
+        'records': records,
+    })
+    with open(path, 'w') as history_file:
+        json.dump(history, history_file, indent=2)
+    return history
+
+
+def compare(baseline_records, current_records, threshold=0.1):
+    """Lists cases of `current_records` slower, or with a higher peak memory, than the baseline by over `threshold`."""
+    baseline = {_record_key(record): record for record in baseline_records}
+    regressions = []
+    for record in current_records:
+        previous = baseline.get(_record_key(record))
+        if previous is None:
+            continue
+        speed_change = record['trials_per_second'] / previous['trials_per_second'] - 1
+        memory_change = (record['peak_memory_bytes'] / previous['peak_memory_bytes'] - 1
+                         if previous['peak_memory_bytes'] else 0.0)
+        if speed_change < -threshold or memory_change > threshold:
+            regressions.append({'case': record['case'], 'size': record['size'], 'p': record['p'], 'q': record['q'],
+                                'speed_change': speed_change, 'memory_change': memory_change})
+    return regressions
+
+
+def _record_key(record):
+    return record['case'], record['size'], record['p'], record['q']
+
+
+def format_records(records):
+    lines = [f"{'case':<40} {'size':>5} {'p':>5} {'q':>5} {'trials/s':>12} {'peak KiB':>10}"]
+    for record in records:
+        p = '-' if record['p'] is None else f"{record['p']:.2f}"
+        q = '-' if record['q'] is None else f"{record['q']:.2f}"
+        lines.append(f"{record['case']:<40} {record['size']:>5} {p:>5} {q:>5} "
+                     f"{record['trials_per_second']:>12.1f} {record['peak_memory_bytes'] / 1024:>10.1f}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--history', default=DEFAULT_HISTORY_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    run_parser.add_argument('--p', type=float, nargs='+', default=[0.5, 0.9])
+    run_parser.add_argument('--q', type=float, nargs='+', default=[0.5, 0.9])
+    run_parser.add_argument('--cases', nargs='+', choices=[case.name for case in CASES])
+    run_parser.add_argument('--min-time', type=float, default=0.2)
+    run_parser.add_argument('--label')
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+    arguments = parser.parse_args(argv)
+
+    if arguments.command == 'run':
+        records = run_benchmarks(arguments.sizes, arguments.p, arguments.q, arguments.cases, arguments.min_time)
+        append_history(arguments.history, records, arguments.label)
+        print(format_records(records))
+        return 0
+
+    runs = load_history(arguments.history)['runs']
+    if len(runs) < 2:
+        print(f"Need two runs in {arguments.history} to compare, found {len(runs)}")
+        return 2
+    regressions = compare(runs[-2]['records'], runs[-1]['records'], arguments.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression['case']} size={regression['size']} p={regression['p']} q={regression['q']}: "
+              f"speed {regression['speed_change']:+.1%}, peak memory {regression['memory_change']:+.1%}")
+    if not regressions:
+        print(f"No regression above {arguments.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from benchmark import CASES, compare, append_history, load_history, run_benchmarks, measure, main
+
+
+def _record(case='external_phase', size=5, trials_per_second=100.0, peak_memory_bytes=1000):
+    return {'case': case, 'size': size, 'p': 0.5, 'q': None, 'trials_per_second': trials_per_second,
+            'peak_memory_bytes': peak_memory_bytes}
+
+
+class TestCompare:
+    def test_should_flag_slowdown_above_threshold(self):
+        regressions = compare([_record(trials_per_second=100.0)], [_record(trials_per_second=80.0)], threshold=0.1)
+        assert len(regressions) == 1
+        assert regressions[0]['case'] == 'external_phase'
+        assert regressions[0]['speed_change'] == pytest.approx(-0.2)
+
+    def test_should_flag_memory_growth_above_threshold(self):
+        regressions = compare([_record(peak_memory_bytes=1000)], [_record(peak_memory_bytes=1200)], threshold=0.1)
+        assert regressions[0]['memory_change'] == pytest.approx(0.2)
+
+    def test_should_not_flag_changes_within_threshold_or_improvements(self):
+        baseline = [_record(size=5), _record(size=10)]
+        current = [_record(size=5, trials_per_second=95.0), _record(size=10, trials_per_second=300.0)]
+        assert compare(baseline, current, threshold=0.1) == []
+
+    def test_should_ignore_cases_missing_from_baseline(self):
+        assert compare([], [_record(trials_per_second=1.0)]) == []
+
+
+class TestHistory:
+    def test_should_append_runs(self, tmp_path):
+        path = str(tmp_path / 'history.json')
+        append_history(path, [_record()], label='first')
+        append_history(path, [_record(trials_per_second=50.0)], label='second')
+        runs = load_history(path)['runs']
+        assert [run['label'] for run in runs] == ['first', 'second']
+        assert runs[1]['records'][0]['trials_per_second'] == 50.0
+
+    def test_compare_command_should_fail_on_regression(self, tmp_path, capsys):
+        path = str(tmp_path / 'history.json')
+        append_history(path, [_record(trials_per_second=100.0)])
+        append_history(path, [_record(trials_per_second=10.0)])
+        assert main(['--history', path, 'compare', '--threshold', '0.1']) == 1
+        assert 'REGRESSION external_phase' in capsys.readouterr().out
+
+    def test_run_command_should_record_every_case(self, tmp_path):
+        path = str(tmp_path / 'history.json')
+        assert main(['--history', path, 'run', '--sizes', '3', '--p', '0.5', '--q', '0.5', '--min-time', '0']) == 0
+        with open(path) as history_file:
+            records = json.load(history_file)['runs'][0]['records']
+        assert {record['case'] for record in records} == {case.name for case in CASES}
+
+
+class TestMeasure:
+    def test_should_report_positive_rate_and_memory(self):
+        trials_per_second, peak_memory = measure(lambda: [0] * 1000, min_time=0.01)
+        assert trials_per_second > 0
+        assert peak_memory >= 1000 * 8
+
+    def test_should_skip_sizes_above_case_limit(self):
+        records = run_benchmarks(sizes=[3, 50], case_names=['approx_mean_path_length_for_2d_lattice'], min_time=0)
+        assert [record['size'] for record in records] == [3]
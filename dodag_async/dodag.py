@@ -1,7 +1,17 @@
+import collections
+import heapq
+import itertools
+
 import networkx as nx
+import numpy as np
+
+from profiling import stage
+from topology import Topology
 
 
 class AsyncSchemeBase:
+    __slots__ = ()
+
     def __init__(self):
         pass
 
@@ -21,18 +31,165 @@ class AsyncSchemeBase:
 DodagAttributeName = 'dodag_details'
 
 
+def _time_zero():
+    return 0
+
+
 class DodagAsyncNode(AsyncSchemeBase):
 
     @classmethod
-    def construct_dodag_on_network(cls, physical_network: nx.Graph, root_node_id):
-        for node in physical_network.nodes:
-            neighbours_ids = list(nx.neighbors(physical_network, node))
-            neighbours_nodes = [physical_network.nodes[neighbour] for neighbour in neighbours_ids]
-            rank = 0 if node == root_node_id else float('inf')
-            node_details = DodagAsyncNode(node_id=node, direct_links=neighbours_nodes, parent=None, rank=rank)
-            nx.set_node_attributes(physical_network, {node: {DodagAttributeName: node_details}})
-
-    def __init__(self, node_id, direct_links=None, parent=None, rank=float('inf')):
+    def construct_dodag_on_network(cls, physical_network: nx.Graph, root_node_id, coherence_time=None, clock=None,
+                                   profiler=None):
+        nodes = physical_network.nodes
+        with stage(profiler, 'dodag.construct'):
+            for node in nodes:
+                neighbours_nodes = [nodes[neighbour] for neighbour in physical_network[node]]
+                rank = 0 if node == root_node_id else float('inf')
+                nodes[node][DodagAttributeName] = DodagAsyncNode(
+                    node_id=node, direct_links=neighbours_nodes, parent=None, rank=rank,
+                    coherence_time=coherence_time, clock=clock, profiler=profiler)
+
+    @classmethod
+    def build_dodag_on_network(cls, physical_network: nx.Graph, root_node_id, coherence_time=None, clock=None,
+                               profiler=None):
+        """Constructs the DODAG and joins every reachable node in one pass, returns the root node.
+
+        Gives the same parents, ranks and instant neighbours as calling `join_network` on every node in BFS order
+        from the root, without the DIO/DAO message cascade.
+        """
+        cls.construct_dodag_on_network(physical_network, root_node_id, coherence_time=coherence_time, clock=clock,
+                                       profiler=profiler)
+        nodes = physical_network.nodes
+        with stage(profiler, 'dodag.build'):
+            ranks, parents, order = dodag_ranks_and_parents(physical_network, root_node_id)
+            for node_id in order[1:]:
+                node = nodes[node_id][DodagAttributeName]
+                parent = nodes[parents[node_id]][DodagAttributeName]
+                node.parent = parent
+                node.rank = ranks[node_id]
+                parent.add_instant_link(node)
+        if profiler is not None:
+            profiler.count('rank_updates', len(order) - 1)
+        return nodes[root_node_id][DodagAttributeName]
+
+    @classmethod
+    def remove_link_on_network(cls, physical_network: nx.Graph, u, v):
+        """Removes the physical link u-v and repairs the DODAG locally, returns the nodes that re-selected a parent.
+
+        Losing a link that is not a parent link changes nothing. Losing a parent link detaches the subtree under it:
+        only the subtree nodes are reset (RPL local repair, poisoning their rank) and re-ranked from their
+        neighbours outside the subtree, so the cost follows the size of the subtree and its neighbourhood.
+        Parents and ranks end up as `build_dodag_on_network` would give them on the new network.
+        """
+        nodes = physical_network.nodes
+        physical_network.remove_edge(u, v)
+        node_u, node_v = nodes[u][DodagAttributeName], nodes[v][DodagAttributeName]
+        node_u.direct_links = [link for link in node_u.direct_links if link is not nodes[v]]
+        node_v.direct_links = [link for link in node_v.direct_links if link is not nodes[u]]
+        if node_v.parent is node_u:
+            detached = node_v
+        elif node_u.parent is node_v:
+            detached = node_u
+        else:
+            return []
+
+        # every subtree node has its parent in the subtree and parent links are physical links
+        subtree = {detached.node_id: detached}
+        queue = [detached]
+        for node in queue:
+            for neighbour_id in physical_network[node.node_id]:
+                neighbour = nodes[neighbour_id][DodagAttributeName]
+                if neighbour_id not in subtree and neighbour.parent is node:
+                    subtree[neighbour_id] = neighbour
+                    queue.append(neighbour)
+
+        reached = []
+        tie_breaker = itertools.count()
+        for node_id in subtree:
+            outside_ranks = [nodes[neighbour_id][DodagAttributeName].rank
+                             for neighbour_id in physical_network[node_id] if neighbour_id not in subtree]
+            rank = min(outside_ranks, default=float('inf')) + 1
+            if rank < float('inf'):
+                heapq.heappush(reached, (rank, next(tie_breaker), node_id))
+        ranks = {}
+        while reached:
+            rank, _, node_id = heapq.heappop(reached)
+            if node_id in ranks:
+                continue
+            ranks[node_id] = rank
+            for neighbour_id in physical_network[node_id]:
+                if neighbour_id in subtree and neighbour_id not in ranks:
+                    heapq.heappush(reached, (rank + 1, next(tie_breaker), neighbour_id))
+        for node_id, node in subtree.items():
+            node.rank = ranks.get(node_id, float('inf'))
+        cls._reselect_parents(physical_network, subtree.values())
+        if detached.profiler is not None:
+            detached.profiler.count('repaired_nodes', len(subtree))
+        return list(subtree.values())
+
+    @classmethod
+    def add_link_on_network(cls, physical_network: nx.Graph, u, v):
+        """Adds the physical link u-v and repairs the DODAG locally, returns the nodes that re-selected a parent.
+
+        The rank decrease spreads from the endpoint that got closer to the root only as far as ranks actually drop,
+        then those nodes and their neighbours re-select a parent.
+        """
+        nodes = physical_network.nodes
+        physical_network.add_edge(u, v)
+        node_u, node_v = nodes[u][DodagAttributeName], nodes[v][DodagAttributeName]
+        node_u.direct_links.append(nodes[v])
+        node_v.direct_links.append(nodes[u])
+        if node_u.rank + 1 < node_v.rank:
+            closer, further = node_u, node_v
+        elif node_v.rank + 1 < node_u.rank:
+            closer, further = node_v, node_u
+        else:
+            # the new link comes last in adjacency order, so it cannot displace a parent of the same rank
+            return []
+
+        further.rank = closer.rank + 1
+        lowered = [further]
+        for node in lowered:  # `lowered` grows while it is walked, a BFS from `further`
+            for neighbour_id in physical_network[node.node_id]:
+                neighbour = nodes[neighbour_id][DodagAttributeName]
+                if neighbour.rank > node.rank + 1:
+                    neighbour.rank = node.rank + 1
+                    lowered.append(neighbour)
+        affected = {node.node_id: node for node in lowered}
+        for node in lowered:
+            for neighbour_id in physical_network[node.node_id]:
+                affected.setdefault(neighbour_id, nodes[neighbour_id][DodagAttributeName])
+        affected.setdefault(closer.node_id, closer)
+        cls._reselect_parents(physical_network, affected.values())
+        if further.profiler is not None:
+            further.profiler.count('repaired_nodes', len(affected))
+        return list(affected.values())
+
+    @staticmethod
+    def _reselect_parents(physical_network, nodes_to_repair):
+        """Gives each node its first neighbour, in adjacency order, one rank closer to the root as parent."""
+        nodes = physical_network.nodes
+        new_parents = []
+        for node in nodes_to_repair:
+            if node.rank == 0:
+                continue
+            parent = None
+            if node.rank < float('inf'):
+                parent = next(nodes[neighbour_id][DodagAttributeName] for neighbour_id in physical_network[node.node_id]
+                              if nodes[neighbour_id][DodagAttributeName].rank == node.rank - 1)
+            if parent is not node.parent:
+                new_parents.append((node, parent))
+        # a child can become the parent of its old parent, drop every old link before making the new ones
+        for node, _ in new_parents:
+            if node.parent is not None:
+                node.drop_instant_link(node.parent)
+        for node, parent in new_parents:
+            node.parent = parent
+            if parent is not None:
+                parent.add_instant_link(node)
+
+    def __init__(self, node_id, direct_links=None, parent=None, rank=float('inf'), coherence_time=None, clock=None,
+                 profiler=None):
         super().__init__()
         if direct_links is None:
             direct_links = []
@@ -41,6 +198,13 @@ class DodagAsyncNode(AsyncSchemeBase):
         self.parent = parent
         self.rank = rank
         self.instant_neighbours = []
+        # Instant links decohere `coherence_time` after they were created, according to `clock`. Expired links are
+        # only dropped when the instant neighbours are read, nothing walks the links as time passes.
+        self.coherence_time = coherence_time
+        self.clock = clock if clock is not None else _time_zero
+        self.instant_link_created_at = {}
+        # counts DIO and DAO messages and rank updates when given
+        self.profiler = profiler
 
     def __eq__(self, other):
         return (self.node_id == other.node_id
@@ -59,8 +223,33 @@ class DodagAsyncNode(AsyncSchemeBase):
         raise NotImplementedError()
 
     def get_instant_neighbours(self):
+        if self.coherence_time is not None and self.instant_neighbours:
+            now = self.clock()
+            expired = [n for n in self.instant_neighbours if self.instant_link_age(n, now) > self.coherence_time]
+            for neighbour in expired:
+                self.drop_instant_link(neighbour)
         return self.instant_neighbours
 
+    def add_instant_link(self, other):
+        """Creates (or regenerates) the instant link between this node and `other`, aged from now."""
+        now = self.clock()
+        if not any(n is other for n in self.instant_neighbours):
+            self.instant_neighbours.append(other)
+            other.instant_neighbours.append(self)
+        self.instant_link_created_at[other.node_id] = now
+        other.instant_link_created_at[self.node_id] = now
+
+    def drop_instant_link(self, other):
+        self.instant_neighbours = [n for n in self.instant_neighbours if n is not other]
+        other.instant_neighbours = [n for n in other.instant_neighbours if n is not self]
+        self.instant_link_created_at.pop(other.node_id, None)
+        other.instant_link_created_at.pop(self.node_id, None)
+
+    def instant_link_age(self, other, now=None):
+        if now is None:
+            now = self.clock()
+        return now - self.instant_link_created_at.get(other.node_id, now)
+
     def is_root(self):
         return self.parent is None
 
@@ -70,16 +259,22 @@ class DodagAsyncNode(AsyncSchemeBase):
             neighbour[DodagAttributeName].receive_dio(self)
 
     def receive_dio(self, potential_parent_node):
+        if self.profiler is not None:
+            self.profiler.count('dio_messages')
         if self.rank is None or self.rank > potential_parent_node.rank + 1:
+            if self.profiler is not None:
+                self.profiler.count('rank_updates')
+            if isinstance(self.parent, DodagAsyncNode):  # leaving the old parent, drop the link to it
+                self.drop_instant_link(self.parent)
             self.parent = potential_parent_node
             self.rank = potential_parent_node.rank + 1
             potential_parent_node.receive_dao(self)
 
     # sending 'dao' is saying: 'Yes, I want to join you'
     def receive_dao(self, calling_child_node):
-        self.instant_neighbours.append(calling_child_node)
-        calling_child_node.instant_neighbours.append(self)
-        pass
+        if self.profiler is not None:
+            self.profiler.count('dao_messages')
+        self.add_instant_link(calling_child_node)
 
     # sending 'dis' are you in dodag?
 
@@ -89,144 +284,230 @@ class DodagAsyncNode(AsyncSchemeBase):
     def __repr__(self):
         return f'Node: {self.node_id}. Parent: {self.parent}. Rank: {self.rank}. Direct links: {self.direct_links}'
 
-################
-
-import random
-import uuid
-#
-# class Node:
-#     def __init__(self, node_id):
-#         self.node_id = node_id
-#         self.parent = None
-#         self.children = set()
-#         self.rank = float('inf')
-#         self.version = 0
-#
-#     def join_dodag(self, parent_node):
-#         """
-#         Called by a child node to join the DODAG by attaching to a parent node.
-#         """
-#         self.parent = parent_node
-#         self.rank = parent_node.rank + 1
-#         self.version = parent_node.version
-#         parent_node.add_child(self)
-#
-#     def add_child(self, child_node):
-#         """
-#         Called by a parent node to add a child node to its set of children.
-#         """
-#         self.children.add(child_node)
-#
-#     def remove_child(self, child_node):
-#         """
-#         Called by a parent node to remove a child node from its set of children.
-#         """
-#         self.children.discard(child_node)
-#
-#     def disconnect(self):
-#         """
-#         Called by a node to disconnect from the DODAG.
-#         Removes the node from its parent's children set and resets its own properties.
-#         """
-#         if self.parent:
-#             self.parent.remove_child(self)
-#         self.parent = None
-#         self.rank = float('inf')
-#         self.version = 0
-#
-#     def is_in_dodag(self):
-#         """
-#         Checks if the node is currently part of the DODAG.
-#         Returns True if the node has a parent, False otherwise.
-#         """
-#         return self.parent is not None
-#
-#     def dao(self):
-#         """
-#         Destination Advertisement Object (DAO) operation.
-#         Called by a child node to send a DAO message to its parent.
-#         The DAO message contains the child node's information.
-#     """
-#     if self.parent:
-#         # Send DAO message to the parent node
-#         self.parent.receive_dao(self)
-#
-# def receive_dao(self, child_node):
-#     """
-#     Called by a parent node to receive a DAO message from a child node.
-#     Updates the parent node's information about the child node.
-#     """
-#     self.add_child(child_node)
-#
-# def dio(self):
-#     """
-#     DODAG Information Object (DIO) operation.
-#     Called by a parent node to send a DIO message to its children.
-#     The DIO message contains the parent node's rank and version.
-#     """
-#     for child in self.children:
-#         # Send DIO message to each child node
-#         child.receive_dio(self.rank, self.version)
-#
-# def receive_dio(self, parent_rank, parent_version):
-#     """
-#     Called by a child node to receive a DIO message from its parent.
-#     Updates the child node's rank and version based on the parent's information.
-#     """
-#     if parent_version > self.version:
-#         self.rank = parent_rank + 1
-#         self.version = parent_version
-#
-# def dis(self):
-#     """
-#     DODAG Information Solicitation (DIS) operation.
-#     Called by a node to request DIO messages from neighboring nodes.
-#     Broadcasts the DIS message to all neighboring nodes.
-#     """
-#     # Broadcast DIS message to neighboring nodes
-#     for neighbor in self.get_neighbors():
-#         neighbor.receive_dis(self)
-#
-# def receive_dis(self, node):
-#     """
-#     Called by a node to receive a DIS message from a neighboring node.
-#     Sends a DIO message back to the requesting node.
-#     """
-#     self.dio()
-#
-# def get_neighbors(self):
-#     """
-#     Returns a set of neighboring nodes.
-#     In this implementation, it returns a random subset of nodes.
-#     In a real scenario, this would be based on network topology.
-#     """
-#     all_nodes = [node for node in nodes if node != self]
-#     num_neighbors = random.randint(1, len(all_nodes))
-#     return random.sample(all_nodes, num_neighbors)
-
-
-# Create a set of nodes
-# nodes = [Node(uuid.uuid4()) for _ in range(10)]
-#
-# # Randomly establish parent-child relationships
-# for node in nodes:
-#     if not node.is_in_dodag() and random.random() < 0.7:
-#         parent = random.choice([n for n in nodes if n.is_in_dodag()])
-#         node.join_dodag(parent)
-#
-# # Perform DODAG operations
-# for node in nodes:
-#     if node.is_in_dodag():
-#         node.dao()  # Child nodes send DAO messages to their parents
-#         node.dio()  # Parent nodes send DIO messages to their children
-#     else:
-#         node.dis()  # Disconnected nodes send DIS messages to request DIO messages
-#
-# # Randomly disconnect some nodes
-# for node in nodes:
-#     if node.is_in_dodag() and random.random() < 0.3:
-#         node.disconnect()
-#
-# # Check if nodes are in the DODAG
-# for node in nodes:
-#     print(f"Node {node.node_id} is in DODAG: {node.is_in_dodag()}")
+
+class DodagStore:
+    """Compact DODAG: parent and rank arrays indexed by a dense node index, instant neighbours in CSR form.
+
+    Instant neighbours of node `i` are `neighbour_indices[neighbour_indptr[i]:neighbour_indptr[i + 1]]`, its parent
+    first and then its children, in the same order `build_dodag_on_network` gives. Nothing is stored on the graph.
+    """
+    NO_PARENT = -1
+    UNREACHABLE = np.iinfo(np.int32).max
+
+    def __init__(self, node_ids, parent, rank, neighbour_indptr, neighbour_indices):
+        self.node_ids = node_ids
+        self.parent = parent
+        self.rank = rank
+        self.neighbour_indptr = neighbour_indptr
+        self.neighbour_indices = neighbour_indices
+        self._node_index = None
+
+    @classmethod
+    def from_network(cls, physical_network, root_node_id):
+        """Builds the DODAG of a graph or of a `Topology`, on the topology's dense ids either way."""
+        topology = Topology.of(physical_network)
+        number_of_nodes = topology.number_of_nodes
+        order, rank_of, parent_of = dodag_ranks_and_parents_on_topology(topology, topology.index_of(root_node_id))
+        reached = np.array(order, dtype=np.int32)
+        rank = np.full(number_of_nodes, cls.UNREACHABLE, dtype=np.int32)
+        rank[reached] = np.array([rank_of[i] for i in order], dtype=np.int32)
+        parent = np.full(number_of_nodes, cls.NO_PARENT, dtype=np.int32)
+        children = reached[1:]
+        parent[children] = np.array([parent_of[i] for i in order[1:]], dtype=np.int32)
+        # every tree edge gives two entries: the parent in the child's list and the child in the parent's list,
+        # sorted so a parent comes first and children follow in BFS order
+        heads = np.concatenate((children, parent[children]))
+        tails = np.concatenate((parent[children], children))
+        sort_keys = np.concatenate((np.full(len(children), -1), np.arange(len(children))))
+        entries = np.lexsort((sort_keys, heads))
+        neighbour_indptr = np.zeros(number_of_nodes + 1, dtype=np.int32)
+        np.cumsum(np.bincount(heads, minlength=number_of_nodes), out=neighbour_indptr[1:])
+        return cls(topology.labels, parent, rank, neighbour_indptr, tails[entries].astype(np.int32))
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def nbytes(self):
+        return self.parent.nbytes + self.rank.nbytes + self.neighbour_indptr.nbytes + self.neighbour_indices.nbytes
+
+    def freeze(self):
+        """Makes the arrays read-only, so the store can be shared, and returns it."""
+        for array in (self.parent, self.rank, self.neighbour_indptr, self.neighbour_indices):
+            array.flags.writeable = False
+        return self
+
+    def index_of(self, node_id):
+        if self._node_index is None:  # only built when nodes are looked up by id
+            self._node_index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        return self._node_index[node_id]
+
+    def node(self, node_id):
+        return DodagNodeView(self, self.index_of(node_id))
+
+    def nodes(self):
+        return [DodagNodeView(self, i) for i in range(len(self.node_ids))]
+
+    def parent_edge_ids(self, topology):
+        """Edge of `topology` joining each node to its parent, -1 for the root and unreachable nodes.
+
+        The store has to be built on `topology` (or on the graph it was built from), its node ids are the same.
+        """
+        heads = np.repeat(np.arange(topology.number_of_nodes), np.diff(topology.indptr))
+        slots = np.flatnonzero(topology.indices == self.parent[heads])
+        parent_edges = np.full(len(self), -1, dtype=np.intp)
+        parent_edges[heads[slots]] = topology.edge_ids[slots]
+        return parent_edges
+
+    def routes_generated(self, topology, edge_masks):
+        """Whether every link of each node's route up to the root is in the instant topology, for all nodes at once.
+
+        `edge_masks` has one row of `topology` edges per instant topology; returns one row of nodes per instant
+        topology. Routes are resolved a rank at a time from the root: a route is there when the parent's is and
+        the link to the parent is.
+        """
+        edge_masks = np.atleast_2d(edge_masks)
+        generated = np.zeros((edge_masks.shape[0], len(self)), dtype=bool)
+        generated[:, self.rank == 0] = True
+        parent_edges = self.parent_edge_ids(topology)
+        by_rank = np.argsort(self.rank, kind='stable')
+        ranks = self.rank[by_rank]
+        reachable_ranks = ranks[ranks != self.UNREACHABLE]
+        for rank in range(1, int(reachable_ranks.max(initial=0)) + 1):
+            nodes = by_rank[np.searchsorted(ranks, rank):np.searchsorted(ranks, rank, side='right')]
+            generated[:, nodes] = generated[:, self.parent[nodes]] & edge_masks[:, parent_edges[nodes]]
+        return generated
+
+
+class DodagCache:
+    """Least recently used DODAGs, as read-only `DodagStore`s keyed by the topology's fingerprint and the root.
+
+    Every caller asking for the same topology and root gets the same frozen store, built once and never written to,
+    and nothing is stored on the graph. The least recently used stores are dropped once there are more than
+    `max_entries` of them or their arrays take more than `max_bytes`; either bound can be None. A graph is converted
+    to a `Topology` on every call, pass the topology itself to skip that too.
+    """
+
+    def __init__(self, max_entries=64, max_bytes=256 * 2 ** 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._stores = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._stores)
+
+    def get(self, physical_network, root_node_id):
+        topology = Topology.of(physical_network)
+        key = (topology.fingerprint(), root_node_id)
+        store = self._stores.get(key)
+        if store is not None:
+            self.hits += 1
+            self._stores.move_to_end(key)
+            return store
+        self.misses += 1
+        store = DodagStore.from_network(topology, root_node_id).freeze()
+        self._stores[key] = store
+        self.nbytes += store.nbytes
+        while self._stores and ((self.max_entries is not None and len(self._stores) > self.max_entries)
+                                or (self.max_bytes is not None and self.nbytes > self.max_bytes)):
+            _, evicted = self._stores.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        return store
+
+    def clear(self):
+        self._stores.clear()
+        self.nbytes = 0
+
+
+class DodagNodeView(AsyncSchemeBase):
+    """`DodagAsyncNode` API over one entry of a `DodagStore`."""
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        super().__init__()
+        self.store = store
+        self.index = index
+
+    @property
+    def node_id(self):
+        return self.store.node_ids[self.index]
+
+    @property
+    def parent(self):
+        parent_index = self.store.parent[self.index]
+        return None if parent_index == DodagStore.NO_PARENT else DodagNodeView(self.store, int(parent_index))
+
+    @property
+    def rank(self):
+        rank = self.store.rank[self.index]
+        return float('inf') if rank == DodagStore.UNREACHABLE else int(rank)
+
+    def __eq__(self, other):
+        return isinstance(other, DodagNodeView) and self.store is other.store and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.store), self.index))
+
+    def navigate(self, previous_node, next_node):
+        return self.parent
+
+    def get_instant_neighbours(self):
+        start, end = self.store.neighbour_indptr[self.index], self.store.neighbour_indptr[self.index + 1]
+        return [DodagNodeView(self.store, int(i)) for i in self.store.neighbour_indices[start:end]]
+
+    def is_root(self):
+        return bool(self.store.parent[self.index] == DodagStore.NO_PARENT)
+
+    def __repr__(self):
+        parent = self.parent
+        parent_id = parent.node_id if parent is not None else None
+        return f'Node: {self.node_id}. Parent: {parent_id}. Rank: {self.rank}'
+
+
+def dodag_ranks_and_parents(physical_network: nx.Graph, root_node_id):
+    """BFS from the root: returns ranks, parents and the BFS order of the reachable nodes.
+
+    Ranks are hop counts to the root. The parent of a node is its first neighbour, in adjacency order, one rank
+    closer to the root, which is the neighbour `join_network` settles on.
+    """
+    ranks = {root_node_id: 0}
+    order = [root_node_id]
+    for node in order:  # `order` grows while it is walked, which makes it the BFS queue
+        next_rank = ranks[node] + 1
+        for neighbour in physical_network[node]:
+            if neighbour not in ranks:
+                ranks[neighbour] = next_rank
+                order.append(neighbour)
+    parents = {}
+    for node in order[1:]:
+        parent_rank = ranks[node] - 1
+        parents[node] = next(neighbour for neighbour in physical_network[node] if ranks.get(neighbour) == parent_rank)
+    return ranks, parents, order
+
+
+def dodag_ranks_and_parents_on_topology(topology, root_index):
+    """`dodag_ranks_and_parents` over the dense ids of a `Topology`: returns the BFS order, ranks and parents.
+
+    Ranks and parents are lists indexed by node id, -1 where the node is not reached (and for the root's parent).
+    """
+    indptr = topology.indptr.tolist()
+    indices = topology.indices.tolist()
+    ranks = [-1] * topology.number_of_nodes
+    ranks[root_index] = 0
+    order = [root_index]
+    for node in order:  # `order` grows while it is walked, which makes it the BFS queue
+        next_rank = ranks[node] + 1
+        for slot in range(indptr[node], indptr[node + 1]):
+            neighbour = indices[slot]
+            if ranks[neighbour] < 0:
+                ranks[neighbour] = next_rank
+                order.append(neighbour)
+    parents = [-1] * topology.number_of_nodes
+    for node in order[1:]:
+        parent_rank = ranks[node] - 1
+        parents[node] = next(indices[slot] for slot in range(indptr[node], indptr[node + 1])
+                             if ranks[indices[slot]] == parent_rank)
+    return order, ranks, parents
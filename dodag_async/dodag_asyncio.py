@@ -0,0 +1,233 @@
+import asyncio
+import collections
+
+import networkx as nx
+import numpy as np
+
+from dodag import DodagAsyncNode, DodagAttributeName
+from profiling import stage
+from topology import Topology
+
+# mailbox key of the messages a node sends itself, to start advertising (the root) or soliciting (any other node)
+_LOCAL = -1
+
+
+class _Pending:
+    """Messages from one sender waiting in a mailbox or on a link, duplicates merged into one."""
+    __slots__ = ('dio_rank', 'dao', 'dis')
+
+    def __init__(self):
+        self.dio_rank = float('inf')  # lowest rank advertised, no DIO when infinite
+        self.dao = False
+        self.dis = False
+
+
+class AsyncioDodag:
+    """DODAG construction where DIO, DAO and DIS are messages queued in per-node mailboxes and handled by a scheduler
+    on an asyncio event loop, instead of method calls made from one node to the next.
+
+    A node whose rank improves advertises it with a DIO to its neighbours; a node picking a parent sends it a DAO and
+    the parent then adds the instant link; a DIS asks neighbours already in the DODAG for a DIO. Of the neighbours
+    one rank closer to the root, a node keeps the first in adjacency order as its parent, so once every message is
+    handled parents and ranks are those of `DodagAsyncNode.build_dodag_on_network`, whatever the latencies, and so
+    are the instant links of every node as a set: they are added as DAOs come in, in an order that depends on the
+    latencies.
+
+    Messages from the same sender are merged while they wait, on the link and in the mailbox: a node has at most one
+    pending entry per neighbour, plus one for itself, so its mailbox never holds more than its degree + 1 entries,
+    checked against `mailbox_capacity` every time an entry is queued, and messages in flight are bounded by twice
+    the number of links, however deep the DODAG. `latency` is the delay of every link in seconds of the event loop
+    clock, or a function of the sender and receiver ids.
+    """
+
+    def __init__(self, physical_network: nx.Graph, root_node_id, latency=0.0, mailbox_capacity=None,
+                 coherence_time=None, clock=None, profiler=None):
+        self.physical_network = physical_network
+        self.root_node_id = root_node_id
+        self.latency = latency
+        self.profiler = profiler
+        topology = Topology.from_graph(physical_network)
+        max_degree = int(np.diff(topology.indptr).max(initial=0))
+        if mailbox_capacity is None:
+            mailbox_capacity = max_degree + 1
+        if mailbox_capacity < max_degree + 1:
+            raise ValueError(f"Mailbox capacity {mailbox_capacity} is below the maximum degree + 1 ({max_degree + 1}),"
+                             f" a node could have more pending senders than its mailbox holds")
+        self.mailbox_capacity = mailbox_capacity
+        self.topology = topology
+        DodagAsyncNode.construct_dodag_on_network(physical_network, root_node_id, coherence_time=coherence_time,
+                                                  clock=clock, profiler=profiler)
+        self.nodes = [physical_network.nodes[label][DodagAttributeName] for label in topology.labels]
+        self._indptr = topology.indptr.tolist()
+        self._indices = topology.indices.tolist()
+        self._reverse_slot = _reverse_slots(topology).tolist()
+        self._parent_slot = [-1] * topology.number_of_nodes
+        self._mailboxes = [None] * topology.number_of_nodes
+        self._ready = collections.deque()
+        self._in_flight = {}  # receiver slot of a link -> messages on it
+        self._wakeup = None
+
+    @property
+    def root(self):
+        return self.nodes[self.topology.index_of(self.root_node_id)]
+
+    # neither coroutine returns a node: `asyncio.run` takes the repr of the result, which walks the whole network
+
+    async def build(self):
+        """Has the root advertise itself and handles messages until none is left."""
+        await self.join(self.root_node_id)
+
+    async def join(self, node_id):
+        """Has `node_id` ask its neighbours for a DIO, or advertise itself if it is in the DODAG already, and handles
+        messages until none is left."""
+        with stage(self.profiler, 'dodag.messages'):
+            self._post(self.topology.index_of(node_id), _LOCAL, 'dis')
+            await self._drain()
+
+    async def _drain(self):
+        self._wakeup = asyncio.Event()
+        handled = 0
+        while True:
+            while self._ready:
+                node = self._ready.popleft()
+                mailbox = self._mailboxes[node]
+                self._mailboxes[node] = None
+                for position, pending in mailbox.items():
+                    self._handle(node, position, pending)
+                handled += 1
+                if handled % 1024 == 0:  # let other tasks of the loop run
+                    await asyncio.sleep(0)
+            if not self._in_flight:
+                return
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    def _handle(self, node, position, pending):
+        if position == _LOCAL:
+            self._start(node)
+            return
+        slot = self._indptr[node] + position
+        if pending.dis:
+            self._count('dis_messages')
+            if self.nodes[node].rank != float('inf'):
+                self._send(node, slot, 'dio')
+        if pending.dio_rank != float('inf'):
+            self._count('dio_messages')
+            self._receive_dio(node, slot, pending.dio_rank)
+        if pending.dao:
+            self._count('dao_messages')
+            child = self.nodes[self._indices[slot]]
+            if child.parent is self.nodes[node]:  # the child may have moved on while its DAO was on the way
+                self.nodes[node].add_instant_link(child)
+
+    def _start(self, node):
+        kind = 'dio' if self.nodes[node].rank != float('inf') else 'dis'
+        for slot in range(self._indptr[node], self._indptr[node + 1]):
+            self._send(node, slot, kind)
+
+    def _receive_dio(self, node, slot, advertised_rank):
+        details = self.nodes[node]
+        rank = advertised_rank + 1
+        if rank > details.rank or (rank == details.rank and slot >= self._parent_slot[node]):
+            return
+        improved = rank < details.rank
+        if details.parent is not None:
+            details.drop_instant_link(details.parent)
+        details.parent = self.nodes[self._indices[slot]]
+        details.rank = rank
+        self._parent_slot[node] = slot
+        self._send(node, slot, 'dao')
+        if improved:
+            self._count('rank_updates')
+            for neighbour_slot in range(self._indptr[node], self._indptr[node + 1]):
+                if neighbour_slot != slot:
+                    self._send(node, neighbour_slot, 'dio')
+
+    def _send(self, sender, slot, kind):
+        # `slot` is the link in the sender's adjacency; messages are kept under the receiver's end of it
+        receiver_slot = self._reverse_slot[slot]
+        latency = self.latency(self.nodes[sender].node_id, self.nodes[self._indices[slot]].node_id) \
+            if callable(self.latency) else self.latency
+        if latency <= 0:
+            receiver = self._indices[slot]
+            self._post(receiver, receiver_slot - self._indptr[receiver], kind, self.nodes[sender].rank)
+            return
+        pending = self._in_flight.get(receiver_slot)
+        if pending is None:
+            pending = self._in_flight[receiver_slot] = _Pending()
+            asyncio.get_running_loop().call_later(latency, self._deliver, receiver_slot)
+        elif kind == 'dio' and pending.dio_rank != float('inf'):
+            self._count('coalesced_messages')
+        self._merge(pending, kind, self.nodes[sender].rank)
+
+    def _deliver(self, receiver_slot):
+        pending = self._in_flight.pop(receiver_slot)
+        receiver = self._indices[self._reverse_slot[receiver_slot]]
+        position = receiver_slot - self._indptr[receiver]
+        mailbox = self._mailbox(receiver)
+        waiting = mailbox.get(position)
+        if waiting is None:
+            self._enqueue(mailbox, position, pending)
+        else:
+            if pending.dio_rank != float('inf') and waiting.dio_rank != float('inf'):
+                self._count('coalesced_messages')
+            waiting.dio_rank = min(waiting.dio_rank, pending.dio_rank)
+            waiting.dao |= pending.dao
+            waiting.dis |= pending.dis
+        self._wakeup.set()
+
+    def _post(self, receiver, position, kind, rank=None):
+        mailbox = self._mailbox(receiver)
+        pending = mailbox.get(position)
+        if pending is None:
+            pending = self._enqueue(mailbox, position, _Pending())
+        elif kind == 'dio' and pending.dio_rank != float('inf'):
+            self._count('coalesced_messages')
+        self._merge(pending, kind, rank)
+
+    def _enqueue(self, mailbox, position, pending):
+        if len(mailbox) >= self.mailbox_capacity:
+            raise RuntimeError(f"Mailbox full ({self.mailbox_capacity} entries), messages from one sender were not"
+                               f" merged")
+        mailbox[position] = pending
+        return pending
+
+    def _mailbox(self, node):
+        mailbox = self._mailboxes[node]
+        if mailbox is None:
+            mailbox = self._mailboxes[node] = {}
+            self._ready.append(node)
+        return mailbox
+
+    @staticmethod
+    def _merge(pending, kind, rank):
+        if kind == 'dio':
+            pending.dio_rank = min(pending.dio_rank, rank)
+        elif kind == 'dao':
+            pending.dao = True
+        else:
+            pending.dis = True
+
+    def _count(self, name):
+        if self.profiler is not None:
+            self.profiler.count(name)
+
+
+def build_dodag_asyncio(physical_network: nx.Graph, root_node_id, latency=0.0, mailbox_capacity=None,
+                        coherence_time=None, clock=None, profiler=None):
+    """Runs `AsyncioDodag.build` on a new event loop, returns the root node."""
+    dodag = AsyncioDodag(physical_network, root_node_id, latency=latency, mailbox_capacity=mailbox_capacity,
+                         coherence_time=coherence_time, clock=clock, profiler=profiler)
+    asyncio.run(dodag.build())
+    return dodag.root
+
+
+def _reverse_slots(topology):
+    # CSR slot of every link seen from its other end: both slots of an edge share its id, a self loop has one slot
+    order = np.argsort(topology.edge_ids, kind='stable')
+    sorted_edge_ids = topology.edge_ids[order]
+    first = np.searchsorted(sorted_edge_ids, sorted_edge_ids, side='left')
+    last = np.searchsorted(sorted_edge_ids, sorted_edge_ids, side='right') - 1
+    reverse = np.empty_like(order)
+    reverse[order] = order[first + last - np.arange(len(order))]
+    return reverse
@@ -0,0 +1,66 @@
+import asyncio
+import random
+
+import networkx as nx
+import pytest
+
+from dodag import DodagAsyncNode, DodagAttributeName
+from dodag_asyncio import AsyncioDodag, build_dodag_asyncio
+from dodag_testing import dodag_summary
+from profiling import Profiler
+
+
+class TestAsyncioDodag:
+    @pytest.mark.parametrize("network_factory, root_node_id", [
+        (lambda: nx.grid_2d_graph(6, 4), (2, 3)), (lambda: nx.gnp_random_graph(60, 0.08, seed=1), 0),
+        (lambda: nx.barabasi_albert_graph(50, 2, seed=2), 7)])
+    @pytest.mark.parametrize("latency", [0.0, 0.001, lambda sender, receiver: random.Random(
+        hash((sender, receiver))).random() * 0.002])
+    def test_should_match_dodag_built_on_network(self, network_factory, root_node_id, latency):
+        expected_network = network_factory()
+        DodagAsyncNode.build_dodag_on_network(expected_network, root_node_id)
+        physical_network = network_factory()
+        root_node = build_dodag_asyncio(physical_network, root_node_id, latency=latency)
+        assert root_node is physical_network.nodes[root_node_id][DodagAttributeName]
+        assert dodag_summary(physical_network) == dodag_summary(expected_network)
+
+    def test_should_build_deep_dodag_without_recursion(self):
+        physical_network = nx.path_graph(20_000)
+        build_dodag_asyncio(physical_network, 0)
+        assert physical_network.nodes[19_999][DodagAttributeName].rank == 19_999
+
+    def test_should_reject_mailbox_smaller_than_max_degree_plus_one(self):
+        with pytest.raises(ValueError):
+            AsyncioDodag(nx.star_graph(5), 0, mailbox_capacity=5)
+        assert AsyncioDodag(nx.star_graph(5), 0).mailbox_capacity == 6
+
+    def test_should_check_mailbox_capacity_when_queueing(self):
+        dodag = AsyncioDodag(nx.star_graph(5), 0)
+        dodag.mailbox_capacity = 2
+        with pytest.raises(RuntimeError):
+            asyncio.run(dodag.build())
+
+    def test_should_coalesce_duplicate_dios(self):
+        profiler = Profiler()
+        build_dodag_asyncio(nx.grid_2d_graph(8, 8), (0, 0), latency=lambda sender, receiver: 0.001 * (
+            1 + (hash((sender, receiver)) % 3)), profiler=profiler)
+        assert profiler.counts['coalesced_messages'] > 0
+        assert profiler.counts['rank_updates'] >= 63
+
+    def test_dis_should_bring_node_back_into_dodag(self):
+        physical_network = nx.grid_2d_graph(3, 3)
+        dodag = AsyncioDodag(physical_network, (0, 0))
+        asyncio.run(dodag.build())
+        expected = dodag_summary(physical_network)
+        node = physical_network.nodes[(2, 2)][DodagAttributeName]
+        node.drop_instant_link(node.parent)
+        node.parent, node.rank = None, float('inf')
+        asyncio.run(dodag.join((2, 2)))
+        assert dodag_summary(physical_network) == expected
+
+    def test_should_count_messages(self):
+        profiler = Profiler()
+        build_dodag_asyncio(nx.path_graph(3), 0, profiler=profiler)
+        # 0 advertises to 1, 1 joins it and advertises to 2, which joins 1; nobody advertises back to its parent
+        assert profiler.counts == {'dio_messages': 2, 'dao_messages': 2, 'rank_updates': 2}
+        assert profiler.stage_calls['dodag.messages'] == 1
@@ -1,7 +1,16 @@
+import gc
+import random
+import tracemalloc
+
 import networkx as nx
+import numpy as np
 import pytest
 
-from dodag import AsyncSchemeBase, DodagAsyncNode, DodagAttributeName
+from dodag import AsyncSchemeBase, DodagAsyncNode, DodagAttributeName, dodag_ranks_and_parents, DodagStore, \
+    DodagNodeView, DodagCache
+from dodag_testing import dodag_summary
+from profiling import Profiler
+from topology import Topology
 
 
 class TestAsyncSchemeBase:
@@ -145,6 +154,337 @@ class TestDodagAsyncScheme:
         assert one_below_node_dodag_2.get_instant_neighbours() == [one_below_node_dodag]
         assert root_node_dodag.get_instant_neighbours() == [one_below_node_dodag]
 
+    def test_receive_dio_should_drop_link_to_old_parent(self):
+        old_parent_node = DodagAsyncNode(node_id="old_parent", rank=6)
+        new_parent_node = DodagAsyncNode(node_id="new_parent", rank=4)
+        node_under_test = DodagAsyncNode(node_id="node_under_test")
+        node_under_test.receive_dio(old_parent_node)
+        node_under_test.receive_dio(new_parent_node)
+        assert node_under_test.get_instant_neighbours() == [new_parent_node]
+        assert old_parent_node.get_instant_neighbours() == []
+        assert new_parent_node.get_instant_neighbours() == [node_under_test]
+
+
+class TestBuildDodag:
+    @staticmethod
+    def _join_in_bfs_order(physical_network, root_node_id):
+        DodagAsyncNode.construct_dodag_on_network(physical_network, root_node_id=root_node_id)
+        _, _, order = dodag_ranks_and_parents(physical_network, root_node_id)
+        for node_id in order[1:]:
+            physical_network.nodes[node_id][DodagAttributeName].join_network()
+
+    @pytest.mark.parametrize("network_factory, root_node_id", [
+        (lambda: nx.grid_2d_graph(3, 3), (1, 1)), (lambda: nx.grid_2d_graph(5, 7), (0, 0)),
+        (lambda: nx.grid_2d_graph(6, 4), (2, 3)), (lambda: nx.gnp_random_graph(40, 0.1, seed=1), 0),
+        (lambda: nx.barabasi_albert_graph(50, 2, seed=2), 7)])
+    def test_should_match_message_driven_construction(self, network_factory, root_node_id):
+        expected_network = network_factory()
+        self._join_in_bfs_order(expected_network, root_node_id)
+        physical_network = network_factory()
+        DodagAsyncNode.build_dodag_on_network(physical_network, root_node_id)
+        assert dodag_summary(physical_network, links_in_order=True) == dodag_summary(expected_network,
+                                                                                     links_in_order=True)
+
+    def test_should_return_root_node(self):
+        physical_network = nx.grid_2d_graph(3, 3)
+        root_node = DodagAsyncNode.build_dodag_on_network(physical_network, (1, 1))
+        assert root_node is physical_network.nodes[(1, 1)][DodagAttributeName]
+        assert root_node.is_root()
+        assert root_node.rank == 0
+
+    def test_should_set_ranks_to_hop_count_to_root(self):
+        physical_network = nx.grid_2d_graph(4, 5)
+        DodagAsyncNode.build_dodag_on_network(physical_network, (0, 0))
+        for (x, y), details in physical_network.nodes(data=DodagAttributeName):
+            assert details.rank == x + y
+            if details.parent is not None:
+                assert details.parent.rank == details.rank - 1
+                assert physical_network.has_edge((x, y), details.parent.node_id)
+
+    def test_should_leave_unreachable_nodes_out(self):
+        physical_network = nx.path_graph(3)
+        physical_network.add_node(3)
+        DodagAsyncNode.build_dodag_on_network(physical_network, 0)
+        unreachable = physical_network.nodes[3][DodagAttributeName]
+        assert unreachable.rank == float('inf')
+        assert unreachable.get_instant_neighbours() == []
+
+
+class TestDodagRepair:
+    @pytest.mark.parametrize("network_factory, root_node_id", [
+        (lambda: nx.grid_2d_graph(6, 6), (0, 0)), (lambda: nx.grid_2d_graph(5, 8), (2, 3)),
+        (lambda: nx.gnp_random_graph(40, 0.1, seed=1), 0), (lambda: nx.barabasi_albert_graph(50, 2, seed=2), 7)])
+    def test_should_match_full_rebuild_after_every_change(self, network_factory, root_node_id):
+        random_generator = random.Random(5)
+        physical_network = network_factory()
+        DodagAsyncNode.build_dodag_on_network(physical_network, root_node_id)
+        expected_network = network_factory()
+        removed_edges = []
+        for _ in range(60):
+            if removed_edges and random_generator.random() < 0.4:
+                u, v = removed_edges.pop(random_generator.randrange(len(removed_edges)))
+                DodagAsyncNode.add_link_on_network(physical_network, u, v)
+                expected_network.add_edge(u, v)
+            else:
+                u, v = random_generator.choice(list(physical_network.edges))
+                removed_edges.append((u, v))
+                DodagAsyncNode.remove_link_on_network(physical_network, u, v)
+                expected_network.remove_edge(u, v)
+            DodagAsyncNode.build_dodag_on_network(expected_network, root_node_id)
+            assert dodag_summary(physical_network, direct_links=True) == dodag_summary(expected_network,
+                                                                                       direct_links=True)
+
+    def test_losing_link_outside_dodag_should_change_nothing(self):
+        physical_network = nx.grid_2d_graph(3, 3)
+        DodagAsyncNode.build_dodag_on_network(physical_network, (0, 0))
+        assert physical_network.nodes[(1, 1)][DodagAttributeName].parent.node_id == (0, 1)
+        assert DodagAsyncNode.remove_link_on_network(physical_network, (1, 1), (1, 0)) == []
+
+    def test_should_only_repair_detached_subtree(self):
+        physical_network = nx.grid_2d_graph(30, 30)
+        DodagAsyncNode.build_dodag_on_network(physical_network, (0, 0))
+        leaf = physical_network.nodes[(29, 29)][DodagAttributeName]
+        repaired = DodagAsyncNode.remove_link_on_network(physical_network, (29, 29), leaf.parent.node_id)
+        assert repaired == [leaf]
+        assert leaf.rank == 58
+        assert leaf.parent.node_id == (29, 28)
+
+    def test_should_detach_nodes_cut_off_from_root(self):
+        physical_network = nx.path_graph(4)
+        DodagAsyncNode.build_dodag_on_network(physical_network, 0)
+        repaired = DodagAsyncNode.remove_link_on_network(physical_network, 1, 2)
+        assert sorted(node.node_id for node in repaired) == [2, 3]
+        for node_id in (2, 3):
+            details = physical_network.nodes[node_id][DodagAttributeName]
+            assert details.rank == float('inf')
+            assert details.parent is None
+        assert physical_network.nodes[2][DodagAttributeName].get_instant_neighbours() == []
+        assert physical_network.nodes[1][DodagAttributeName].get_instant_neighbours() == [
+            physical_network.nodes[0][DodagAttributeName]]
+
+    def test_new_link_should_reattach_detached_nodes(self):
+        physical_network = nx.path_graph(4)
+        DodagAsyncNode.build_dodag_on_network(physical_network, 0)
+        DodagAsyncNode.remove_link_on_network(physical_network, 1, 2)
+        DodagAsyncNode.add_link_on_network(physical_network, 0, 3)
+        assert [physical_network.nodes[node_id][DodagAttributeName].rank for node_id in range(4)] == [0, 1, 2, 1]
+        assert physical_network.nodes[2][DodagAttributeName].parent.node_id == 3
+
+
+class TestDodagProfiling:
+    def test_should_count_dio_dao_messages_and_rank_updates(self):
+        physical_network = nx.path_graph(3)
+        profiler = Profiler()
+        DodagAsyncNode.construct_dodag_on_network(physical_network, 0, profiler=profiler)
+        for node_id in (1, 2):
+            physical_network.nodes[node_id][DodagAttributeName].join_network()
+        # node 1 hears from 0 and 2, node 2 from 1; both join once
+        assert profiler.counts == {'dio_messages': 3, 'dao_messages': 2, 'rank_updates': 2}
+
+    def test_should_count_repaired_nodes(self):
+        physical_network = nx.path_graph(4)
+        profiler = Profiler()
+        DodagAsyncNode.build_dodag_on_network(physical_network, 0, profiler=profiler)
+        DodagAsyncNode.remove_link_on_network(physical_network, 1, 2)
+        assert profiler.counts['repaired_nodes'] == 2
+        assert profiler.counts['rank_updates'] == 3
+
+
+class TestInstantLinkCoherence:
+    @staticmethod
+    def _linked_nodes(coherence_time, clock):
+        parent = DodagAsyncNode(node_id="parent", rank=0, coherence_time=coherence_time, clock=clock)
+        child = DodagAsyncNode(node_id="child", coherence_time=coherence_time, clock=clock)
+        child.receive_dio(parent)
+        return parent, child
+
+    def test_links_should_not_expire_without_coherence_time(self):
+        now = [0]
+        parent, child = self._linked_nodes(None, lambda: now[0])
+        now[0] = 10 ** 6
+        assert child.get_instant_neighbours() == [parent]
+
+    def test_should_drop_link_older_than_coherence_time_when_read(self):
+        now = [0]
+        parent, child = self._linked_nodes(5, lambda: now[0])
+        now[0] = 5
+        assert child.get_instant_neighbours() == [parent]
+        assert child.instant_link_age(parent) == 5
+        now[0] = 6
+        assert child.get_instant_neighbours() == []
+        assert parent.get_instant_neighbours() == []
+        assert child.parent is parent
+
+    def test_should_keep_expired_link_until_read(self):
+        now = [0]
+        parent, child = self._linked_nodes(5, lambda: now[0])
+        now[0] = 100
+        assert child.instant_neighbours == [parent]
+
+    def test_regenerating_link_should_reset_its_age(self):
+        now = [0]
+        parent, child = self._linked_nodes(5, lambda: now[0])
+        now[0] = 4
+        parent.add_instant_link(child)
+        now[0] = 9
+        assert child.get_instant_neighbours() == [parent]
+        assert parent.get_instant_neighbours() == [child]
+
+    def test_build_should_pass_coherence_to_every_node(self):
+        now = [0]
+        physical_network = nx.path_graph(3)
+        DodagAsyncNode.build_dodag_on_network(physical_network, 0, coherence_time=1, clock=lambda: now[0])
+        middle = physical_network.nodes[1][DodagAttributeName]
+        assert len(middle.get_instant_neighbours()) == 2
+        now[0] = 2
+        assert middle.get_instant_neighbours() == []
+
+
+class TestDodagStore:
+    @pytest.mark.parametrize("network_factory, root_node_id", [
+        (lambda: nx.grid_2d_graph(3, 3), (1, 1)), (lambda: nx.grid_2d_graph(6, 4), (2, 3)),
+        (lambda: nx.gnp_random_graph(40, 0.1, seed=1), 0)])
+    def test_should_match_dodag_built_on_network(self, network_factory, root_node_id):
+        physical_network = network_factory()
+        store = DodagStore.from_network(physical_network, root_node_id)
+        DodagAsyncNode.build_dodag_on_network(physical_network, root_node_id)
+        for node_id, details in physical_network.nodes(data=DodagAttributeName):
+            view = store.node(node_id)
+            assert view.node_id == node_id
+            assert view.rank == details.rank
+            expected_parent_id = details.parent.node_id if details.parent is not None else None
+            assert (view.parent.node_id if view.parent is not None else None) == expected_parent_id
+            assert ([n.node_id for n in view.get_instant_neighbours()]
+                    == [n.node_id for n in details.get_instant_neighbours()])
+
+    def test_should_build_the_same_store_from_topology(self):
+        physical_network = nx.gnp_random_graph(60, 0.08, seed=3)
+        expected = DodagStore.from_network(physical_network, 5)
+        store = DodagStore.from_network(Topology.from_graph(physical_network), 5)
+        assert store.node_ids == expected.node_ids
+        for actual_array, expected_array in [(store.parent, expected.parent), (store.rank, expected.rank),
+                                             (store.neighbour_indptr, expected.neighbour_indptr),
+                                             (store.neighbour_indices, expected.neighbour_indices)]:
+            assert actual_array.tolist() == expected_array.tolist()
+
+    def test_parent_edges_should_join_nodes_to_their_parents(self):
+        physical_network = nx.gnp_random_graph(40, 0.1, seed=1)
+        topology = Topology.from_graph(physical_network)
+        store = DodagStore.from_network(topology, 0)
+        parent_edges = store.parent_edge_ids(topology)
+        for i in range(len(store)):
+            if store.parent[i] == DodagStore.NO_PARENT:
+                assert parent_edges[i] == -1
+            else:
+                assert sorted(topology.edges[parent_edges[i]]) == sorted((i, store.parent[i]))
+
+    def test_routes_generated_should_need_every_link_up_to_the_root(self):
+        physical_network = nx.grid_2d_graph(6, 5)
+        physical_network.add_node('cut off')
+        topology = Topology.from_graph(physical_network)
+        store = DodagStore.from_network(topology, (2, 2))
+        edge_masks = np.random.default_rng(6).random((20, topology.number_of_edges)) < 0.8
+        routes_generated = store.routes_generated(topology, edge_masks)
+        parent_edges = store.parent_edge_ids(topology)
+        for trial, edge_mask in enumerate(edge_masks):
+            for i in range(len(store)):
+                expected = store.rank[i] != DodagStore.UNREACHABLE
+                node = i
+                while expected and store.parent[node] != DodagStore.NO_PARENT:
+                    expected = bool(edge_mask[parent_edges[node]])
+                    node = store.parent[node]
+                assert routes_generated[trial, i] == expected
+
+    def test_view_should_follow_dodag_async_node_api(self):
+        store = DodagStore.from_network(nx.path_graph(3), 0)
+        root, middle, leaf = store.node(0), store.node(1), store.node(2)
+        assert root.is_root() is True
+        assert leaf.is_root() is False
+        assert leaf.navigate(None, None) == middle
+        assert middle.navigate(leaf, None) == root
+        assert root.navigate(middle, None) is None
+        assert middle.get_instant_neighbours() == [root, leaf]
+        assert [v.node_id for v in store.nodes()] == [0, 1, 2]
+
+    def test_view_should_not_have_instance_dict(self):
+        view = DodagStore.from_network(nx.path_graph(2), 0).node(1)
+        assert isinstance(view, AsyncSchemeBase)
+        assert not hasattr(view, '__dict__')
+
+    def test_should_mark_unreachable_nodes(self):
+        physical_network = nx.path_graph(2)
+        physical_network.add_node(2)
+        store = DodagStore.from_network(physical_network, 0)
+        assert store.node(2).rank == float('inf')
+        assert store.node(2).get_instant_neighbours() == []
+
+    def test_should_take_an_order_of_magnitude_less_memory_than_node_objects(self):
+        physical_network = nx.grid_2d_graph(50, 50)
+        gc.collect()
+        tracemalloc.start()
+        store = DodagStore.from_network(physical_network, (0, 0))
+        gc.collect()
+        store_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        tracemalloc.start()
+        DodagAsyncNode.build_dodag_on_network(physical_network, (0, 0))
+        gc.collect()
+        objects_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert len(store) == 2500
+        assert store_memory * 10 < objects_memory
+
+
+class TestDodagCache:
+    def test_should_build_dodag_once_per_topology_and_root(self):
+        cache = DodagCache()
+        store = cache.get(nx.grid_2d_graph(4, 4), (0, 0))
+        assert cache.get(Topology.from_graph(nx.grid_2d_graph(4, 4)), (0, 0)) is store
+        assert cache.get(nx.grid_2d_graph(4, 4), (1, 1)) is not store
+        assert (cache.hits, cache.misses) == (1, 2)
+
+    def test_should_tell_topologies_apart(self):
+        cache = DodagCache()
+        other_network = nx.grid_2d_graph(4, 4)
+        other_network.remove_edge((0, 0), (0, 1))
+        assert cache.get(other_network, (0, 0)).node((0, 1)).rank == 3
+        assert cache.get(nx.grid_2d_graph(4, 4), (0, 0)).node((0, 1)).rank == 1
+
+    def test_should_tell_apart_topologies_differing_only_in_neighbour_order(self):
+        cache = DodagCache()
+        first, second = nx.Graph([(0, 1), (0, 2), (1, 3), (2, 3)]), nx.Graph([(0, 1), (0, 2), (2, 3), (1, 3)])
+        assert cache.get(first, 0).node(3).parent.node_id == 1
+        assert cache.get(second, 0).node(3).parent.node_id == 2
+
+    def test_should_return_read_only_stores_and_leave_graph_untouched(self):
+        physical_network = nx.grid_2d_graph(3, 3)
+        store = DodagCache().get(physical_network, (0, 0))
+        with pytest.raises(ValueError):
+            store.rank[0] = 5
+        assert all(DodagAttributeName not in data for _, data in physical_network.nodes(data=True))
+
+    def test_should_evict_least_recently_used_beyond_max_entries(self):
+        topology = Topology.from_graph(nx.grid_2d_graph(3, 3))
+        cache = DodagCache(max_entries=2)
+        first = cache.get(topology, (0, 0))
+        cache.get(topology, (1, 1))
+        assert cache.get(topology, (0, 0)) is first
+        cache.get(topology, (2, 2))
+        assert len(cache) == 2
+        assert cache.get(topology, (0, 0)) is first
+        assert cache.misses == 3
+        cache.get(topology, (1, 1))  # the least recently used when (2, 2) came in
+        assert cache.misses == 4
+
+    def test_should_keep_arrays_within_max_bytes(self):
+        topology = Topology.from_graph(nx.grid_2d_graph(10, 10))
+        store_bytes = DodagStore.from_network(topology, (0, 0)).nbytes
+        cache = DodagCache(max_entries=None, max_bytes=3 * store_bytes)
+        for root in [(0, 0), (1, 1), (2, 2), (3, 3), (4, 4)]:
+            cache.get(topology, root)
+        assert len(cache) == 3
+        assert cache.nbytes == 3 * store_bytes
+
 
 class _DodagAsyncNodeTest(DodagAsyncNode):
     def __init__(self, node_id, direct_links=None, parent=None, rank=float('inf')):
@@ -0,0 +1,23 @@
+from dodag import DodagAttributeName
+
+
+def dodag_summary(physical_network, links_in_order=False, direct_links=False):
+    """Parent, rank and instant links of every node of `physical_network`, for tests comparing two DODAGs.
+
+    Instant links are sorted unless `links_in_order`. With `direct_links`, also whether the direct links of every
+    node are still its neighbours in `physical_network`, in adjacency order.
+
+    The networks compared should be built twice by the same factory rather than copied: `Graph.copy` does not keep
+    the order of adjacency, which decides the parents.
+    """
+    summary = {}
+    for node_id, details in physical_network.nodes(data=DodagAttributeName):
+        parent_id = details.parent.node_id if details.parent is not None else None
+        instant_links = [n.node_id for n in details.get_instant_neighbours()]
+        summary[node_id] = (parent_id, details.rank,
+                            instant_links if links_in_order else sorted(str(n) for n in instant_links))
+        if direct_links:
+            neighbours_linked = [physical_network.nodes[n] is link for n, link in zip(physical_network[node_id],
+                                                                                       details.direct_links)]
+            summary[node_id] += (all(neighbours_linked), len(neighbours_linked) == len(details.direct_links))
+    return summary
@@ -0,0 +1,63 @@
+import collections
+import contextlib
+import time
+
+import pandas as pd
+
+
+class Profiler:
+    """Counters and stage timers of the routing pipeline, filled only when passed as `profiler=`.
+
+    Instrumented code does nothing but an `if profiler is not None` test when no profiler is given. Counters are
+    named events (swaps, neighbour list rebuilds, DIO and DAO messages, rank updates...), stages are timed blocks.
+    Profilers of worker processes are merged into the one of the sweep.
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.stage_calls = collections.Counter()
+        self.stage_seconds = collections.defaultdict(float)
+
+    def count(self, name, amount=1):
+        self.counts[name] += amount
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[name] += time.perf_counter() - start
+            self.stage_calls[name] += 1
+
+    def merge(self, other):
+        self.counts.update(other.counts)
+        self.stage_calls.update(other.stage_calls)
+        for name, seconds in other.stage_seconds.items():
+            self.stage_seconds[name] += seconds
+        return self
+
+    def to_frame(self):
+        """One row per stage (calls, total and mean seconds) and per counter (its total in `calls`)."""
+        rows = [{'name': name, 'kind': 'stage', 'calls': calls, 'seconds': self.stage_seconds[name],
+                 'mean_seconds': self.stage_seconds[name] / calls} for name, calls in sorted(self.stage_calls.items())]
+        rows += [{'name': name, 'kind': 'counter', 'calls': total, 'seconds': None, 'mean_seconds': None}
+                 for name, total in sorted(self.counts.items())]
+        return pd.DataFrame(rows, columns=['name', 'kind', 'calls', 'seconds', 'mean_seconds'])
+
+    def format_table(self):
+        lines = [f"{'stage / counter':<36} {'calls':>12} {'seconds':>10} {'mean ms':>10}"]
+        for name, calls in sorted(self.stage_calls.items(), key=lambda item: -self.stage_seconds[item[0]]):
+            seconds = self.stage_seconds[name]
+            lines.append(f"{name:<36} {calls:>12} {seconds:>10.3f} {seconds / calls * 1000:>10.4f}")
+        for name, total in sorted(self.counts.items()):
+            lines.append(f"{name:<36} {total:>12}")
+        return '\n'.join(lines)
+
+
+_NO_STAGE = contextlib.nullcontext()
+
+
+def stage(profiler, name):
+    """`profiler.stage(name)`, or a block that does nothing without a profiler."""
+    return _NO_STAGE if profiler is None else profiler.stage(name)
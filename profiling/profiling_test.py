@@ -0,0 +1,63 @@
+import time
+
+from profiling import Profiler, stage
+
+
+class TestProfiler:
+    def test_should_count_events(self):
+        profiler = Profiler()
+        profiler.count('swaps')
+        profiler.count('swaps', 2)
+        assert profiler.counts == {'swaps': 3}
+
+    def test_should_time_stages(self):
+        profiler = Profiler()
+        for _ in range(2):
+            with profiler.stage('sleep'):
+                time.sleep(0.01)
+        assert profiler.stage_calls['sleep'] == 2
+        assert profiler.stage_seconds['sleep'] >= 0.02
+
+    def test_should_time_stage_left_by_exception(self):
+        profiler = Profiler()
+        try:
+            with profiler.stage('failing'):
+                raise ValueError()
+        except ValueError:
+            pass
+        assert profiler.stage_calls['failing'] == 1
+
+    def test_should_merge_totals(self):
+        first, second = Profiler(), Profiler()
+        first.count('swaps', 2)
+        second.count('swaps', 3)
+        second.count('dio_messages')
+        with second.stage('copy'):
+            pass
+        first.merge(second)
+        assert first.counts == {'swaps': 5, 'dio_messages': 1}
+        assert first.stage_calls == {'copy': 1}
+
+    def test_should_export_table(self):
+        profiler = Profiler()
+        profiler.count('swaps', 4)
+        with profiler.stage('copy'):
+            pass
+        frame = profiler.to_frame()
+        assert list(frame['name']) == ['copy', 'swaps']
+        assert list(frame['kind']) == ['stage', 'counter']
+        assert list(frame['calls']) == [1, 4]
+        table = profiler.format_table()
+        assert 'copy' in table and 'swaps' in table
+
+
+class TestStage:
+    def test_should_do_nothing_without_profiler(self):
+        with stage(None, 'anything'):
+            pass
+
+    def test_should_time_stage_of_profiler(self):
+        profiler = Profiler()
+        with stage(profiler, 'copy'):
+            pass
+        assert profiler.stage_calls == {'copy': 1}
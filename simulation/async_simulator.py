@@ -0,0 +1,169 @@
+import heapq
+
+import numpy as np
+
+
+class AsyncRoutingResult:
+    def __init__(self, delivery_times, slots, events, link_attempts):
+        self.delivery_times = delivery_times
+        self.slots = slots
+        self.events = events
+        self.link_attempts = link_attempts
+
+    @property
+    def deliveries(self):
+        return len(self.delivery_times)
+
+    @property
+    def rate(self):
+        return self.deliveries / self.slots if self.slots else 0.0
+
+    def __repr__(self):
+        return (f'AsyncRoutingResult(deliveries={self.deliveries}, slots={self.slots}, events={self.events}, '
+                f'link_attempts={self.link_attempts})')
+
+
+class AsyncRoutingSimulator:
+    """Discrete-event simulation of asynchronous entanglement routing from a source node to the DODAG root.
+
+    The route is found by following `navigate()` from the source until `is_root()`. Every time slot, each link of
+    the route that is not covered by an entangled segment attempts generation with success probability `p`; all
+    those attempts are one event drawn with a single RNG call. A node holding a segment on both sides swaps them
+    `swap_delay` later, with success probability `q`; a failed swap loses both segments. Once a segment joins the
+    source and the root it is delivered and the route starts over.
+
+    With a `coherence_time`, a segment is lost once it is older than that; a segment made by a swap is as old as the
+    older of its two parts. Expiry is evaluated lazily from the creation time whenever a segment is read (by a swap,
+    or by link generation looking for idle links), never by sweeping live segments: link generation only pops the
+    segments due from a heap ordered by expiry time, with one entry for all links generated in the same slot.
+
+    A segment is kept as pointers between its two end nodes (positions along the route): `right_end[i]` is the far
+    end of the segment leaving node `i` towards the root, `left_end[i]` the far end of the one arriving at `i`.
+    """
+    _GENERATE = 0
+    _SWAP = 1
+
+    def __init__(self, source_node, p, q, rng=None, swap_delay=0.0, coherence_time=None):
+        if rng is None:
+            rng = np.random.default_rng()
+        if source_node.rank == float('inf'):
+            raise ValueError(f"Node {source_node.node_id} is not connected to the DODAG")
+        if source_node.is_root():
+            raise ValueError("Source node is the DODAG root")
+        route = [source_node]
+        previous_node = None
+        while not route[-1].is_root():
+            next_node = route[-1].navigate(previous_node, None)
+            previous_node = route[-1]
+            route.append(next_node)
+        self.route = route
+        self.p = p
+        self.q = q
+        self.rng = rng
+        self.swap_delay = swap_delay
+        self.coherence_time = float('inf') if coherence_time is None else coherence_time
+        self.number_of_links = len(route) - 1
+        self._right_end = [-1] * len(route)
+        self._left_end = [-1] * len(route)
+        self._swap_pending = [False] * len(route)
+        self._covered = np.zeros(self.number_of_links, dtype=bool)
+        # time after which the segment covering a link is lost, the same for all links of a segment
+        self._expires_at = np.full(self.number_of_links, np.inf)
+        # (expiry time, sequence, left end or ends) of the segments made by a swap or a slot, lost ones are skipped
+        self._expiries = []
+        self._events = []
+        self._sequence = 0
+        self._schedule(0.0, self._GENERATE, None)
+
+    def run(self, until):
+        """Processes every event before time `until` and returns the deliveries made meanwhile."""
+        delivery_times = []
+        events = 0
+        link_attempts = 0
+        slots = 0
+        while self._events and self._events[0][0] < until:
+            time, _, kind, node = heapq.heappop(self._events)
+            events += 1
+            if kind == self._GENERATE:
+                slots += 1
+                link_attempts += self._generate_links(time, delivery_times)
+                self._schedule(time + 1, self._GENERATE, None)
+            else:
+                self._swap(time, node, delivery_times)
+        return AsyncRoutingResult(np.array(delivery_times), slots, events, link_attempts)
+
+    def _schedule(self, time, kind, node):
+        heapq.heappush(self._events, (time, self._sequence, kind, node))
+        self._sequence += 1
+
+    def _generate_links(self, time, delivery_times):
+        while self._expiries and self._expiries[0][0] < time:
+            _, _, lefts = heapq.heappop(self._expiries)
+            if isinstance(lefts, int):  # a segment made by a swap
+                lefts = [lefts]
+            else:  # the links generated in a slot, most of them swapped or lost since
+                lefts = lefts[self._covered[lefts] & (self._expires_at[lefts] < time)].tolist()
+            # the segments now leaving `lefts` may be newer ones, only their own expiry counts
+            for left in lefts:
+                if self._right_end[left] >= 0 and self._expires_at[left] < time:
+                    self._discard(left, self._right_end[left])
+        idle_links = np.flatnonzero(~self._covered)
+        generated_links = idle_links[self.rng.random(len(idle_links)) < self.p]
+        self._covered[generated_links] = True
+        self._expires_at[generated_links] = time + self.coherence_time
+        self._track_expiry(time + self.coherence_time, generated_links)
+        for link in generated_links.tolist():
+            self._right_end[link] = link + 1
+            self._left_end[link + 1] = link
+            self._on_segment(time, link, link + 1, delivery_times)
+        return len(idle_links)
+
+    def _swap(self, time, node, delivery_times):
+        self._swap_pending[node] = False
+        left, right = self._left_end[node], self._right_end[node]
+        if left < 0 or right < 0:  # a segment was lost after the swap got scheduled
+            return
+        left_expired = self._expires_at[left] < time
+        right_expired = self._expires_at[node] < time
+        if left_expired or right_expired:
+            if left_expired:
+                self._discard(left, node)
+            if right_expired:
+                self._discard(node, right)
+            return
+        entanglement_swap_failure = self.rng.random() >= self.q
+        if entanglement_swap_failure:
+            self._discard(left, node)
+            self._discard(node, right)
+            return
+        self._left_end[node] = self._right_end[node] = -1
+        self._right_end[left] = right
+        self._left_end[right] = left
+        if self._expires_at[node] < self._expires_at[left]:
+            # otherwise the entry that made the left part, with `left` and the same expiry, stays right
+            self._expires_at[left:right] = self._expires_at[node]
+            self._track_expiry(self._expires_at[left], left)
+        else:
+            self._expires_at[node:right] = self._expires_at[left]
+        self._on_segment(time, left, right, delivery_times)
+
+    def _track_expiry(self, expires_at, lefts):
+        if expires_at != float('inf') and (isinstance(lefts, int) or len(lefts)):
+            heapq.heappush(self._expiries, (float(expires_at), self._sequence, lefts))
+            self._sequence += 1
+
+    def _discard(self, left, right):
+        self._right_end[left] = self._left_end[right] = -1
+        self._covered[left:right] = False
+
+    def _on_segment(self, time, left, right, delivery_times):
+        if left == 0 and right == self.number_of_links:
+            delivery_times.append(time)
+            self._right_end[left] = self._left_end[right] = -1
+            self._covered[:] = False
+            return
+        for node in (left, right):
+            if (0 < node < self.number_of_links and not self._swap_pending[node]
+                    and self._left_end[node] >= 0 and self._right_end[node] >= 0):
+                self._swap_pending[node] = True
+                self._schedule(time + self.swap_delay, self._SWAP, node)
@@ -0,0 +1,109 @@
+import math
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from async_simulator import AsyncRoutingSimulator
+from dodag import DodagAsyncNode, DodagAttributeName, DodagStore
+
+
+def _dodag_node(physical_network, root_node_id, node_id):
+    DodagAsyncNode.build_dodag_on_network(physical_network, root_node_id)
+    return physical_network.nodes[node_id][DodagAttributeName]
+
+
+class TestAsyncRoutingSimulator:
+    def test_should_follow_navigate_to_root(self):
+        simulator = AsyncRoutingSimulator(_dodag_node(nx.grid_2d_graph(3, 3), (0, 0), (2, 2)), p=1, q=1)
+        assert len(simulator.route) == 5
+        assert simulator.route[0].node_id == (2, 2)
+        assert simulator.route[-1].node_id == (0, 0)
+        assert [node.rank for node in simulator.route] == [4, 3, 2, 1, 0]
+
+    def test_should_deliver_every_slot_when_p_and_q_are_1(self):
+        simulator = AsyncRoutingSimulator(_dodag_node(nx.path_graph(6), 0, 5), p=1, q=1)
+        result = simulator.run(until=10)
+        assert result.slots == 10
+        assert result.deliveries == 10
+        assert list(result.delivery_times) == list(range(10))
+
+    def test_should_never_deliver_when_p_is_0(self):
+        simulator = AsyncRoutingSimulator(_dodag_node(nx.path_graph(3), 0, 2), p=0, q=1)
+        assert simulator.run(until=100).deliveries == 0
+
+    def test_should_never_deliver_when_swaps_always_fail(self):
+        simulator = AsyncRoutingSimulator(_dodag_node(nx.path_graph(3), 0, 2), p=1, q=0,
+                                          rng=np.random.default_rng(1))
+        assert simulator.run(until=100).deliveries == 0
+
+    def test_should_deliver_single_link_at_rate_p(self):
+        simulator = AsyncRoutingSimulator(_dodag_node(nx.path_graph(2), 0, 1), p=0.3, q=1,
+                                          rng=np.random.default_rng(2))
+        result = simulator.run(until=20000)
+        assert math.isclose(result.rate, 0.3, abs_tol=0.015)
+
+    def test_should_keep_links_until_the_whole_route_is_ready(self):
+        # with infinite memory every link waits for the slowest one, so a delivery takes the maximum of
+        # geometric waiting times over the links
+        p = 0.5
+        number_of_links = 3
+        simulator = AsyncRoutingSimulator(_dodag_node(nx.path_graph(number_of_links + 1), 0, number_of_links), p=p,
+                                          q=1, rng=np.random.default_rng(3))
+        result = simulator.run(until=50000)
+        expected_slots_per_delivery = sum(
+            math.comb(number_of_links, k) * (-1) ** (k + 1) / (1 - (1 - p) ** k) for k in range(1, number_of_links + 1))
+        assert math.isclose(1 / result.rate, expected_slots_per_delivery, rel_tol=0.03)
+
+    def test_should_delay_deliveries_by_swap_delay(self):
+        simulator = AsyncRoutingSimulator(_dodag_node(nx.path_graph(3), 0, 2), p=1, q=1, swap_delay=0.5)
+        result = simulator.run(until=3)
+        assert list(result.delivery_times) == [0.5, 1.5, 2.5]
+
+    def test_should_deliver_only_links_generated_together_when_coherence_time_is_0(self):
+        p = 0.5
+        simulator = AsyncRoutingSimulator(_dodag_node(nx.path_graph(3), 0, 2), p=p, q=1, coherence_time=0,
+                                          rng=np.random.default_rng(4))
+        result = simulator.run(until=20000)
+        assert math.isclose(result.rate, p ** 2, abs_tol=0.015)
+
+    def test_should_deliver_less_with_shorter_coherence_time(self):
+        rates = []
+        for coherence_time in [0, 2, None]:
+            simulator = AsyncRoutingSimulator(_dodag_node(nx.path_graph(4), 0, 3), p=0.3, q=0.9,
+                                              coherence_time=coherence_time, rng=np.random.default_rng(5))
+            rates.append(simulator.run(until=20000).rate)
+        assert rates[0] < rates[1] < rates[2]
+
+    def test_swap_delay_longer_than_coherence_time_should_prevent_deliveries(self):
+        simulator = AsyncRoutingSimulator(_dodag_node(nx.path_graph(3), 0, 2), p=1, q=1, swap_delay=2,
+                                          coherence_time=1)
+        assert simulator.run(until=50).deliveries == 0
+
+    def test_should_only_keep_expiries_not_due_yet(self):
+        simulator = AsyncRoutingSimulator(_dodag_node(nx.path_graph(30), 0, 29), p=0.4, q=0.8, swap_delay=0.5,
+                                          coherence_time=3, rng=np.random.default_rng(6))
+        simulator.run(until=500.5)  # the last slot generated links at time 500
+        assert all(expires_at >= 500 for expires_at, _, _ in simulator._expiries)
+        assert len(simulator._expiries) <= 4 + 30
+
+    def test_should_work_on_dodag_store_views(self):
+        store = DodagStore.from_network(nx.grid_2d_graph(4, 4), (0, 0))
+        simulator = AsyncRoutingSimulator(store.node((3, 3)), p=1, q=1)
+        assert [node.node_id for node in simulator.route][::6] == [(3, 3), (0, 0)]
+        assert simulator.run(until=5).deliveries == 5
+
+    def test_should_count_link_attempts_per_slot(self):
+        simulator = AsyncRoutingSimulator(_dodag_node(nx.path_graph(5), 0, 4), p=0, q=1)
+        result = simulator.run(until=10)
+        assert result.link_attempts == 40
+        assert result.events == 10
+
+    def test_should_reject_root_and_unreachable_sources(self):
+        physical_network = nx.path_graph(3)
+        physical_network.add_node(3)
+        DodagAsyncNode.build_dodag_on_network(physical_network, 0)
+        with pytest.raises(ValueError):
+            AsyncRoutingSimulator(physical_network.nodes[0][DodagAttributeName], p=1, q=1)
+        with pytest.raises(ValueError):
+            AsyncRoutingSimulator(physical_network.nodes[3][DodagAttributeName], p=1, q=1)
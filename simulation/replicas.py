@@ -0,0 +1,118 @@
+import numpy as np
+
+from profiling import stage
+from topology import Topology
+
+_UNDRAWN = -1  # link state of a replica in `ReplicaEngine.run` before the replica first looks at the link
+
+
+class ReplicaEngine:
+    """`InternalPhaseEngine` for many replicas of a network at once, advanced together one time slot at a time.
+
+    Replica `r` is row `r` of an `InstantTopologyBatch`: its alive links are `masks[r]` and `removed[r]` marks the
+    nodes whose links are gone (the source and every node swapped through). Every slot, each replica still running
+    picks a next hop among the alive links of the node holding its link to the source and swaps with it, with NumPy
+    operations over all replicas instead of a Python loop per replica. The candidates of a node are taken in
+    adjacency order and picked with the same uniform draw as the engine, so a replica ends like an engine trial on
+    the same instant topology would, in distribution.
+    """
+
+    def __init__(self, topology):
+        topology = Topology.of(topology)
+        self.topology = topology
+        degrees = np.diff(topology.indptr)
+        width = int(degrees.max(initial=0))
+        # neighbours and their edges as padded rows, -1 past the degree of the node
+        rows = np.repeat(np.arange(topology.number_of_nodes), degrees)
+        columns = np.arange(len(topology.indices)) - np.repeat(topology.indptr[:-1], degrees)
+        self._neighbours = np.full((topology.number_of_nodes, width), -1, dtype=np.intp)
+        self._neighbours[rows, columns] = topology.indices
+        self._edge_ids = np.zeros((topology.number_of_nodes, width), dtype=np.intp)
+        self._edge_ids[rows, columns] = topology.edge_ids
+
+    def run(self, p, q, source, target, replicas, rng=None, coherence_time=None, profiler=None):
+        """`external_phase` then `internal_phase` on `replicas` independent replicas, whether each succeeded.
+
+        A link is drawn the first time a replica looks at it instead of all links up front: each is still alive with
+        probability `p` independently of the others, but a replica only draws the links around its walk.
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        links = np.full((replicas, self.topology.number_of_edges), _UNDRAWN, dtype=np.int8)
+        return self._route(links, p, source, target, q, rng, coherence_time, profiler)
+
+    def run_batch(self, batch, source, target, q, rng=None, coherence_time=None, profiler=None):
+        """Routes every replica of `batch` from `source` to `target`, returns whether each succeeded."""
+        if rng is None:
+            rng = np.random.default_rng()
+        return self._route(batch.masks, None, source, target, q, rng, coherence_time, profiler)
+
+    def _route(self, links, p, source, target, q, rng, coherence_time, profiler):
+        # `links` are the alive masks of the replicas, or with `p` their links drawn so far, `_UNDRAWN` for the others
+        number_of_replicas = len(links)
+        if source == target or self.topology.number_of_nodes == 0:
+            return np.full(number_of_replicas, None)
+        successes = np.zeros(number_of_replicas, dtype=bool)
+        if coherence_time is None:
+            coherence_time = float('inf')
+        source, target = self.topology.index_of(source), self.topology.index_of(target)
+        if self._neighbours.shape[1] == 0:  # no links at all, every replica is stuck at the source
+            if profiler is not None:
+                profiler.count('engine.trials', number_of_replicas)
+            return successes
+        removed = np.zeros((number_of_replicas, self.topology.number_of_nodes), dtype=bool)
+        removed[:, source] = True
+        with stage(profiler, 'replicas.run_batch'):
+            # first hop: the link to the target may already be there, no swap needed
+            running = np.arange(number_of_replicas)
+            candidates, valid, counts = self._candidates(links, p, removed, running, np.full(len(running), source),
+                                                         rng, profiler)
+            reached = (valid & (candidates == target)).any(axis=1)
+            successes[running[reached]] = True
+            keep = ~reached & (counts > 0)
+            running = running[keep]
+            current = self._pick(candidates[keep], valid[keep], counts[keep], rng)
+            swaps = 0
+            while len(running):
+                removed[running, current] = True
+                candidates, valid, counts = self._candidates(links, p, removed, running, current, rng, profiler)
+                keep = counts > 0  # a node left with only its link to the source fails
+                next_hop = self._pick(candidates[keep], valid[keep], counts[keep], rng)
+                running = running[keep]
+                swapped = rng.random(len(running)) < q
+                running, next_hop = running[swapped], next_hop[swapped]
+                swaps += 1
+                if profiler is not None:
+                    profiler.count('replica_slots')
+                    profiler.count('swaps', len(swapped))
+                if swaps > coherence_time:  # every link left is `swaps` old, in every replica
+                    break
+                reached = next_hop == target
+                successes[running[reached]] = True
+                running, current = running[~reached], next_hop[~reached]
+        if profiler is not None:
+            profiler.count('engine.trials', number_of_replicas)
+        return successes
+
+    def _candidates(self, links, p, removed, running, current, rng, profiler):
+        # alive links from `current` to nodes not removed yet, one row per running replica
+        candidates = self._neighbours[current]
+        edge_ids = self._edge_ids[current]
+        edges_alive = links[running[:, None], edge_ids]
+        if p is not None:
+            rows, columns = np.nonzero((edges_alive == _UNDRAWN) & (candidates >= 0))
+            drawn = (rng.random(len(rows)) < p).astype(np.int8)
+            edges_alive[rows, columns] = drawn
+            links[running[rows], edge_ids[rows, columns]] = drawn
+            edges_alive = edges_alive == 1
+            if profiler is not None:
+                profiler.count('rng_draws', len(rows))
+        valid = (candidates >= 0) & edges_alive & ~removed[running[:, None], candidates]
+        return candidates, valid, valid.sum(axis=1)
+
+    @staticmethod
+    def _pick(candidates, valid, counts, rng):
+        # the k-th valid candidate of each row, k uniform in [0, count), as `InternalPhaseEngine` picks it
+        k = (rng.random(len(counts)) * counts).astype(np.intp)
+        position = (np.cumsum(valid, axis=1) > k[:, None]).argmax(axis=1)
+        return candidates[np.arange(len(counts)), position]
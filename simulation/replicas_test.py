@@ -0,0 +1,62 @@
+import math
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from exact import exact_success_probability
+from profiling import Profiler
+from replicas import ReplicaEngine
+from synchronous import external_phase_batch, InternalPhaseEngine, InstantTopologyBatch
+from topology import Topology
+
+
+class TestReplicaEngine:
+    @pytest.mark.parametrize("p, q", [(0.5, 0.9), (0.8, 0.8), (1.0, 1.0)])
+    def test_should_succeed_with_exact_probability(self, p, q):
+        physical_topology = nx.grid_2d_graph(3, 4)
+        successes = ReplicaEngine(physical_topology).run(p, q, (0, 0), (2, 3), 100_000, rng=np.random.default_rng(7))
+        expected = exact_success_probability(physical_topology, (0, 0), (2, 3), p, q)
+        assert abs(successes.mean() - expected) <= 4 * math.sqrt(expected * (1 - expected) / 100_000)
+
+    def test_single_replica_should_end_like_the_engine_with_the_same_draws(self):
+        # both pick the k-th alive candidate in adjacency order and draw in the same order for a single replica
+        topology = Topology.from_graph(nx.grid_2d_graph(5, 5))
+        batch = external_phase_batch(topology, 0.7, trials=200, rng=np.random.default_rng(1))
+        engine, replicas = InternalPhaseEngine(topology), ReplicaEngine(topology)
+        for trial, edge_mask in enumerate(batch.masks):
+            expected = engine.run((0, 0), (4, 4), 0.9, edge_mask=edge_mask, rng=np.random.default_rng(trial))
+            replica = InstantTopologyBatch(topology, edge_mask[None, :])
+            assert replicas.run_batch(replica, (0, 0), (4, 4), 0.9, rng=np.random.default_rng(trial))[0] == expected
+
+    def test_should_succeed_on_first_hop_without_swap(self):
+        assert ReplicaEngine(nx.path_graph(2)).run(1.0, 0.0, 0, 1, 10).all()
+
+    def test_should_fail_when_swaps_outlive_coherence_time(self):
+        engine = ReplicaEngine(nx.path_graph(4))
+        assert engine.run(1.0, 1.0, 0, 3, 10, coherence_time=2).all()
+        assert not engine.run(1.0, 1.0, 0, 3, 10, coherence_time=1).any()
+
+    def test_should_fail_without_path(self):
+        physical_topology = nx.path_graph(3)
+        physical_topology.add_node(3)
+        assert not ReplicaEngine(physical_topology).run(1.0, 1.0, 0, 3, 10).any()
+
+    def test_should_fail_on_topology_without_links(self):
+        assert ReplicaEngine(nx.empty_graph(3)).run(1.0, 1.0, 0, 2, 5).tolist() == [False] * 5
+        batch = external_phase_batch(Topology.from_graph(nx.empty_graph(3)), 1.0, trials=5)
+        assert not ReplicaEngine(nx.empty_graph(3)).run_batch(batch, 0, 2, 1.0).any()
+
+    def test_should_only_draw_links_replicas_look_at(self):
+        profiler = Profiler()
+        ReplicaEngine(nx.path_graph(10)).run(1.0, 1.0, 0, 2, 4, profiler=profiler)
+        assert profiler.counts['rng_draws'] == 4 * 2  # links 0-1 and 1-2, the walk stops at the target
+
+    def test_should_return_none_when_source_is_target(self):
+        assert ReplicaEngine(nx.path_graph(3)).run(1.0, 1.0, 1, 1, 4).tolist() == [None] * 4
+
+    def test_should_count_slots_and_trials(self):
+        profiler = Profiler()
+        ReplicaEngine(nx.path_graph(4)).run(1.0, 1.0, 0, 3, 10, profiler=profiler)
+        assert profiler.counts['replica_slots'] == 2
+        assert profiler.counts['engine.trials'] == 10
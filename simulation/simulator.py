@@ -0,0 +1,362 @@
+import collections
+import gc
+import itertools
+import math
+import multiprocessing.util
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from statistics import NormalDist
+
+import numpy as np
+from scipy.stats import beta
+
+from dodag import DodagCache
+from profiling import Profiler, stage
+from replicas import ReplicaEngine
+from synchronous import external_phase_batch, InternalPhaseEngine
+from topology import Topology, SharedTopology, SharedTopologyHandle, attach_topology, detach_topology
+
+
+@dataclass(frozen=True)
+class CellResult:
+    p: float
+    q: float
+    source: object
+    target: object
+    trials: int
+    successes: int
+    ci_low: float
+    ci_high: float
+
+    @property
+    def rate(self):
+        return self.successes / self.trials if self.trials else 0.0
+
+
+def wilson_interval(successes, trials, confidence=0.95):
+    if trials == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    rate = successes / trials
+    denominator = 1 + z * z / trials
+    centre = (rate + z * z / (2 * trials)) / denominator
+    half_width = z * math.sqrt(rate * (1 - rate) / trials + z * z / (4 * trials * trials)) / denominator
+    # the bounds are exactly 0 and 1 at the extremes, avoid rounding leaving them slightly inside
+    low = 0.0 if successes == 0 else max(0.0, centre - half_width)
+    high = 1.0 if successes == trials else min(1.0, centre + half_width)
+    return low, high
+
+
+def clopper_pearson_interval(successes, trials, confidence=0.95):
+    """Exact binomial interval, wider than Wilson's but never below the nominal coverage."""
+    if trials == 0:
+        return 0.0, 1.0
+    alpha = 1 - confidence
+    low = 0.0 if successes == 0 else float(beta.ppf(alpha / 2, successes, trials - successes + 1))
+    high = 1.0 if successes == trials else float(beta.ppf(1 - alpha / 2, successes + 1, trials - successes))
+    return low, high
+
+
+INTERVALS = {'wilson': wilson_interval, 'clopper-pearson': clopper_pearson_interval}
+
+
+class SynchronousTrials:
+    """`external_phase` then `internal_phase` between the pair, on the array engine."""
+
+    def __init__(self, topology):
+        self.topology = topology
+        self.engine = InternalPhaseEngine(topology)
+
+    def __call__(self, p, q, source, target, trials, rng, profiler=None):
+        batch = external_phase_batch(self.topology, p, trials, rng=rng, profiler=profiler)
+        return int(self.engine.run_batch(batch, source, target, q, rng=rng, profiler=profiler).sum())
+
+    def run_pairs(self, p, q, pairs, trials, rng):
+        """Successes of every pair, all pairs routed on the same `trials` instant topologies."""
+        batch = external_phase_batch(self.topology, p, trials, rng=rng)
+        return self.engine.run_batch_many(batch, pairs, q, rng=rng).sum(axis=0)
+
+
+class ReplicaTrials:
+    """`SynchronousTrials` on the `ReplicaEngine`: all trials of a chunk are routed together, slot by slot."""
+
+    def __init__(self, topology):
+        self.topology = topology
+        self.engine = ReplicaEngine(topology)
+
+    def __call__(self, p, q, source, target, trials, rng, profiler=None):
+        return int(self.engine.run(p, q, source, target, trials, rng=rng, profiler=profiler).sum())
+
+
+class DodagTrials:
+    """Routing from the source along the DODAG rooted at the target: every link of the route has to be generated
+    and every node along it has to swap. Only the links of the route are drawn, the others cannot matter."""
+
+    def __init__(self, topology, cache=None):
+        self.topology = topology
+        self.cache = cache if cache is not None else dodag_cache
+
+    def store(self, root):
+        return self.cache.get(self.topology, root)
+
+    def hops(self, source, root):
+        rank = self.store(root).node(source).rank
+        return None if rank == float('inf') else rank
+
+    def all_to_root(self, p, q, root, trials, rng):
+        """Successes of every node routing to `root`, all nodes routed on the same `trials` instant topologies.
+
+        Returns one count per node, in `topology.labels` order; the root itself never counts.
+        """
+        store = self.store(root)
+        batch = external_phase_batch(self.topology, p, trials, rng=rng)
+        routes_generated = store.routes_generated(self.topology, batch.masks)
+        swaps = np.maximum(store.rank.astype(float) - 1, 0)
+        swaps_succeeded = rng.random(routes_generated.shape) < q ** swaps
+        successes = (routes_generated & swaps_succeeded).sum(axis=0)
+        successes[store.rank == 0] = 0
+        return successes
+
+    def __call__(self, p, q, source, target, trials, rng, profiler=None):
+        with stage(profiler, 'dodag.route'):
+            hops = self.hops(source, target)
+        if hops is None:
+            return 0
+        with stage(profiler, 'dodag.trials'):
+            links_generated = (rng.random((trials, hops)) < p).all(axis=1)
+            swaps_succeeded = (rng.random((trials, hops - 1)) < q).all(axis=1)
+        if profiler is not None:
+            profiler.count('swaps', trials * (hops - 1))
+            profiler.count('rng_draws', trials * (2 * hops - 1))
+        return int((links_generated & swaps_succeeded).sum())
+
+
+SCHEMES = {'synchronous': SynchronousTrials, 'replicas': ReplicaTrials, 'dodag': DodagTrials}
+
+# DODAGs shared by every `DodagTrials` of this process, so sweeps on the same topology and roots build each once
+dodag_cache = DodagCache()
+
+
+def run_synchronous_sweep(physical_topology, pairs, p_values, q_values, trials, seed=None, workers=None,
+                          chunk_size=1000, confidence=0.95, scheme='synchronous', store=None, profiler=None):
+    """Estimate the success rate of `external_phase` + `internal_phase` for every (p, q, pair) cell.
+
+    Trials of a cell are split into chunks of `chunk_size`, and every chunk gets its own child of
+    `SeedSequence(seed)`, so results depend on `seed` and `chunk_size` only, not on `workers` or scheduling.
+    With `scheme='replicas'` the same protocol runs on the `ReplicaEngine`, all trials of a chunk at once, and with
+    `scheme='dodag'` the trials route along the DODAG rooted at each pair's target instead.
+    With a `SweepStore`, cells it holds for the same parameters are not run again and every other cell is recorded
+    as soon as its last chunk is in. A `Profiler` gets the counters and stage times of every chunk, whichever
+    process ran it.
+    """
+    topology = Topology.of(physical_topology)
+    cells = _cells(pairs, p_values, q_values)
+    tasks = []
+    for cell_index, (p, q, (source, target)) in enumerate(cells):
+        for start in range(0, trials, chunk_size):
+            tasks.append((cell_index, p, q, source, target, min(chunk_size, trials - start)))
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(tasks))
+    run = {'scheme': scheme, 'method': 'fixed', 'seed': seed, 'trials': trials, 'chunk_size': chunk_size,
+           'confidence': confidence, 'interval': 'wilson'}
+    fingerprint = topology.fingerprint() if store is not None else None
+    results = _recorded_results(store, fingerprint, cells, run)
+
+    pending = [i for i, task in enumerate(tasks) if results[task[0]] is None]
+    chunks_left = collections.Counter(tasks[i][0] for i in pending)
+    successes = [0] * len(cells)
+    with _ChunkRunner(topology, scheme, workers, profiler) as runner:
+        chunk_successes = runner.map([tasks[i][1:] for i in pending], [seed_sequences[i] for i in pending])
+        for i, chunk_success in zip(pending, chunk_successes):
+            cell_index = tasks[i][0]
+            successes[cell_index] += chunk_success
+            chunks_left[cell_index] -= 1
+            if chunks_left[cell_index] == 0:
+                results[cell_index] = _cell_result(cells[cell_index], trials, successes[cell_index], wilson_interval,
+                                                   confidence)
+                if store is not None:
+                    store.add(fingerprint, cells[cell_index], run, results[cell_index])
+    return [result if result is not None else _cell_result(cell, 0, 0, wilson_interval, confidence)
+            for cell, result in zip(cells, results)]
+
+
+def run_adaptive_sweep(physical_topology, pairs, p_values, q_values, target_width=0.02, budget=None,
+                       batch_size=1000, max_trials_per_cell=None, seed=None, workers=None, chunk_size=1000,
+                       confidence=0.95, interval='wilson', scheme='synchronous', store=None, profiler=None):
+    """`run_synchronous_sweep` that stops each cell once its confidence interval is narrower than `target_width`.
+
+    Every cell starts with `batch_size` trials. Each round then gives every cell still too wide the trials its
+    current rate says it needs to reach the target width (at least `batch_size`), scaled down to fit what is left of
+    `budget` (total trials over all cells, unlimited by default). Cells close to 0 or 1 stop early and the rest of
+    the budget goes to the uncertain ones. Every cell draws its chunks from its own child of `SeedSequence(seed)`,
+    in order, so results do not depend on `workers`. With a `SweepStore`, a cell is recorded once it needs no more
+    trials; cells left short by the budget are not, and start over when the sweep is run again.
+    """
+    interval_of = INTERVALS[interval]
+    topology = Topology.of(physical_topology)
+    cells = _cells(pairs, p_values, q_values)
+    run = {'scheme': scheme, 'method': 'adaptive', 'seed': seed, 'target_width': target_width,
+           'batch_size': batch_size, 'max_trials_per_cell': max_trials_per_cell, 'chunk_size': chunk_size,
+           'confidence': confidence, 'interval': interval}
+    fingerprint = topology.fingerprint() if store is not None else None
+    results = _recorded_results(store, fingerprint, cells, run)
+    cell_seed_sequences = np.random.SeedSequence(seed).spawn(len(cells))
+    trials = [0] * len(cells)
+    successes = [0] * len(cells)
+    remaining_budget = float('inf') if budget is None else budget
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+
+    with _ChunkRunner(topology, scheme, workers, profiler) as runner:
+        allocations = [0 if result is not None else batch_size for result in results]
+        while True:
+            if sum(allocations) > remaining_budget:
+                scale = remaining_budget / sum(allocations)
+                allocations = [int(allocation * scale) for allocation in allocations]
+            if not any(allocations):
+                break
+            remaining_budget -= sum(allocations)
+            tasks, seed_sequences = [], []
+            for cell_index, ((p, q, (source, target)), allocation) in enumerate(zip(cells, allocations)):
+                for start in range(0, allocation, chunk_size):
+                    tasks.append((cell_index, p, q, source, target, min(chunk_size, allocation - start)))
+                    seed_sequences.extend(cell_seed_sequences[cell_index].spawn(1))
+            for task, chunk_success in zip(tasks, runner.map([task[1:] for task in tasks], seed_sequences)):
+                trials[task[0]] += task[-1]
+                successes[task[0]] += chunk_success
+
+            allocations = [0] * len(cells)
+            for cell_index in range(len(cells)):
+                if results[cell_index] is not None:
+                    continue
+                low, high = interval_of(successes[cell_index], trials[cell_index], confidence)
+                if high - low <= target_width:
+                    results[cell_index] = _finished_cell(store, fingerprint, cells[cell_index], run, trials[cell_index],
+                                                         successes[cell_index], interval_of, confidence)
+                    continue
+                # trials for a normal interval of the target width at the current rate, shrunk towards 1/2 so a
+                # cell with no failure (or no success) yet does not look already done
+                rate = (successes[cell_index] + 2) / (trials[cell_index] + 4)
+                needed = math.ceil(z * z * rate * (1 - rate) / (target_width / 2) ** 2) - trials[cell_index]
+                allocation = max(needed, batch_size)
+                if max_trials_per_cell is not None:
+                    allocation = min(allocation, max_trials_per_cell - trials[cell_index])
+                if allocation <= 0:
+                    results[cell_index] = _finished_cell(store, fingerprint, cells[cell_index], run, trials[cell_index],
+                                                         successes[cell_index], interval_of, confidence)
+                    continue
+                allocations[cell_index] = allocation
+
+    return [result if result is not None else _cell_result(cell, cell_trials, cell_successes, interval_of, confidence)
+            for cell, result, cell_trials, cell_successes in zip(cells, results, trials, successes)]
+
+
+def _cells(pairs, p_values, q_values):
+    pairs = list(pairs)
+    for source, target in pairs:
+        if source == target:
+            raise ValueError(f"Source and target must differ, got {source} twice")
+    return list(itertools.product(p_values, q_values, pairs))
+
+
+def _recorded_results(store, fingerprint, cells, run):
+    if store is None:
+        return [None] * len(cells)
+    return [store.find(fingerprint, cell, run) for cell in cells]
+
+
+def _finished_cell(store, fingerprint, cell, run, trials, successes, interval_of, confidence):
+    result = _cell_result(cell, trials, successes, interval_of, confidence)
+    if store is not None:
+        store.add(fingerprint, cell, run, result)
+    return result
+
+
+def _cell_result(cell, trials, successes, interval_of, confidence):
+    p, q, (source, target) = cell
+    ci_low, ci_high = interval_of(successes, trials, confidence)
+    return CellResult(p=p, q=q, source=source, target=target, trials=trials, successes=successes,
+                      ci_low=ci_low, ci_high=ci_high)
+
+
+class _ChunkRunner:
+    """Runs chunks of trials in this process (`workers=1`) or in a pool that keeps the topology between calls.
+
+    The pool gets the topology through shared memory: workers attach to the arrays published once by this process,
+    so neither starting them nor sending them tasks copies the topology. Workers do not load the labels either,
+    sources and targets are sent to them as node indices. Each worker still keeps its own scratch buffers and
+    whatever its scheme derives from the topology (DODAGs, padded neighbour tables).
+    """
+
+    def __init__(self, physical_topology, scheme, workers, profiler=None):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.physical_topology = physical_topology
+        self.scheme = scheme
+        self.workers = workers
+        self.profiler = profiler
+        self._executor = None
+        self._shared_topology = None
+        self._topology = None
+
+    def __enter__(self):
+        if self.workers == 1:
+            _init_worker(self.physical_topology, self.scheme)
+        else:
+            self._topology = Topology.of(self.physical_topology)
+            self._shared_topology = SharedTopology(self._topology)
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                 initargs=(self._shared_topology.handle, self.scheme))
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._executor is not None:
+            self._executor.shutdown()
+        if self._shared_topology is not None:
+            self._shared_topology.close()
+
+    def map(self, chunks, seed_sequences):
+        """Successes of every chunk, in order, yielded as they come in."""
+        if not chunks:
+            return iter(())
+        profile = [self.profiler is not None] * len(chunks)
+        if self._executor is None:
+            outcomes = (_run_chunk(*chunk, seed_sequence, chunk_profile)
+                        for chunk, seed_sequence, chunk_profile in zip(chunks, seed_sequences, profile))
+        else:
+            index_of = self._topology.index_of
+            chunks = [(p, q, index_of(source), index_of(target), trials) for p, q, source, target, trials in chunks]
+            outcomes = self._executor.map(_run_chunk, *zip(*chunks), seed_sequences, profile)
+        return outcomes if self.profiler is None else self._merge_profiles(outcomes)
+
+    def _merge_profiles(self, outcomes):
+        for successes, chunk_profiler in outcomes:
+            self.profiler.merge(chunk_profiler)
+            yield successes
+
+
+# state of a worker process, set once by the pool initializer so the topology is not sent with every task
+_worker_trials = None
+
+
+def _init_worker(physical_topology, scheme='synchronous'):
+    global _worker_trials
+    if isinstance(physical_topology, SharedTopologyHandle):
+        # the pool only lives for one sweep: unmap the block when the worker exits, once nothing reads it any more
+        multiprocessing.util.Finalize(None, _release_worker, args=(physical_topology,), exitpriority=10)
+        physical_topology = attach_topology(physical_topology, labels=False)
+    _worker_trials = SCHEMES[scheme](Topology.of(physical_topology))
+
+
+def _release_worker(handle):
+    global _worker_trials
+    _worker_trials = None
+    gc.collect()  # views of the block may sit in reference cycles
+    detach_topology(handle)
+
+
+def _run_chunk(p, q, source, target, trials, seed_sequence, profile=False):
+    profiler = Profiler() if profile else None
+    with stage(profiler, 'chunk'):
+        successes = _worker_trials(p, q, source, target, trials, np.random.default_rng(seed_sequence),
+                                   profiler=profiler)
+    return successes if profiler is None else (successes, profiler)
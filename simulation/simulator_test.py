@@ -0,0 +1,197 @@
+import math
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from simulator import run_synchronous_sweep, wilson_interval, clopper_pearson_interval, run_adaptive_sweep, \
+    DodagTrials, SynchronousTrials
+from exact import exact_success_probability
+from profiling import Profiler
+from topology import Topology
+
+
+class TestWilsonInterval:
+    def test_should_return_whole_range_without_trials(self):
+        assert wilson_interval(0, 0) == (0.0, 1.0)
+
+    def test_should_contain_observed_rate(self):
+        low, high = wilson_interval(30, 100)
+        assert low < 0.3 < high
+        assert math.isclose(low, 0.2189, abs_tol=1e-4)
+        assert math.isclose(high, 0.3958, abs_tol=1e-4)
+
+    def test_should_stay_in_unit_interval(self):
+        assert wilson_interval(0, 10)[0] == 0.0
+        assert wilson_interval(10, 10)[1] == 1.0
+
+    def test_should_narrow_with_more_trials(self):
+        low_small, high_small = wilson_interval(5, 10)
+        low_big, high_big = wilson_interval(500, 1000)
+        assert high_big - low_big < high_small - low_small
+
+
+class TestClopperPearsonInterval:
+    def test_should_return_whole_range_without_trials(self):
+        assert clopper_pearson_interval(0, 0) == (0.0, 1.0)
+
+    def test_should_match_exact_binomial_bounds(self):
+        low, high = clopper_pearson_interval(30, 100)
+        assert math.isclose(low, 0.2124, abs_tol=1e-4)
+        assert math.isclose(high, 0.3998, abs_tol=1e-4)
+        assert clopper_pearson_interval(0, 10) == (0.0, pytest.approx(0.3085, abs=1e-4))
+
+    def test_should_be_wider_than_wilson(self):
+        low, high = clopper_pearson_interval(30, 100)
+        wilson_low, wilson_high = wilson_interval(30, 100)
+        assert low < wilson_low and wilson_high < high
+
+
+class TestRunSynchronousSweep:
+    physical_topology = nx.grid_2d_graph(4, 4)
+    pairs = [((0, 0), (2, 3)), ((1, 1), (2, 2))]
+
+    def test_should_return_one_result_per_cell(self):
+        results = run_synchronous_sweep(self.physical_topology, self.pairs, p_values=[0.5, 1.0], q_values=[0.9],
+                                        trials=50, seed=1, workers=1)
+        assert [(r.p, r.q, r.source, r.target) for r in results] == [
+            (0.5, 0.9, (0, 0), (2, 3)), (0.5, 0.9, (1, 1), (2, 2)),
+            (1.0, 0.9, (0, 0), (2, 3)), (1.0, 0.9, (1, 1), (2, 2))]
+        for result in results:
+            assert result.trials == 50
+            assert result.ci_low <= result.rate <= result.ci_high
+
+    def test_should_always_succeed_on_path_when_p_and_q_are_1(self):
+        [result] = run_synchronous_sweep(nx.path_graph(5), [(0, 4)], p_values=[1.0], q_values=[1.0], trials=20,
+                                         seed=1, workers=1)
+        assert result.successes == 20
+
+    def test_should_never_succeed_when_p_is_0(self):
+        [result] = run_synchronous_sweep(self.physical_topology, [((0, 0), (1, 1))], p_values=[0.0], q_values=[1.0],
+                                         trials=20, seed=1, workers=1)
+        assert result.successes == 0
+
+    def test_should_be_reproducible_regardless_of_number_of_workers(self):
+        kwargs = dict(pairs=self.pairs, p_values=[0.8], q_values=[0.8, 1.0], trials=300, seed=42, chunk_size=100)
+        serial = run_synchronous_sweep(self.physical_topology, workers=1, **kwargs)
+        parallel = run_synchronous_sweep(self.physical_topology, workers=2, **kwargs)
+        assert serial == parallel
+
+    def test_should_differ_between_seeds(self):
+        kwargs = dict(pairs=self.pairs, p_values=[0.8], q_values=[0.8], trials=300, workers=1)
+        first = run_synchronous_sweep(self.physical_topology, seed=1, **kwargs)
+        second = run_synchronous_sweep(self.physical_topology, seed=2, **kwargs)
+        assert first != second
+
+    def test_should_reject_pair_with_same_source_and_target(self):
+        with pytest.raises(ValueError):
+            run_synchronous_sweep(self.physical_topology, [((0, 0), (0, 0))], p_values=[1.0], q_values=[1.0],
+                                  trials=1, workers=1)
+
+    def test_should_aggregate_profiles_of_every_worker(self):
+        kwargs = dict(pairs=self.pairs, p_values=[0.8], q_values=[0.9], trials=300, seed=4, chunk_size=100)
+        serial_profiler, parallel_profiler = Profiler(), Profiler()
+        run_synchronous_sweep(self.physical_topology, workers=1, profiler=serial_profiler, **kwargs)
+        run_synchronous_sweep(self.physical_topology, workers=2, profiler=parallel_profiler, **kwargs)
+        assert serial_profiler.counts['engine.trials'] == 600
+        assert serial_profiler.counts['swaps'] > 0
+        assert parallel_profiler.counts == serial_profiler.counts
+        assert parallel_profiler.stage_calls['chunk'] == 6
+
+    def test_replicas_scheme_should_agree_with_synchronous_scheme(self):
+        kwargs = dict(pairs=[((0, 0), (2, 2))], p_values=[0.8], q_values=[0.9], trials=20_000, seed=5, workers=1)
+        [synchronous] = run_synchronous_sweep(nx.grid_2d_graph(3, 3), **kwargs)
+        [replicas] = run_synchronous_sweep(nx.grid_2d_graph(3, 3), scheme='replicas', **kwargs)
+        # both estimate the same probability, from independent draws
+        expected = exact_success_probability(nx.grid_2d_graph(3, 3), (0, 0), (2, 2), 0.8, 0.9)
+        assert synchronous.ci_low < expected < synchronous.ci_high
+        assert replicas.ci_low < expected < replicas.ci_high
+
+    def test_dodag_scheme_should_route_to_target_as_root(self):
+        [result] = run_synchronous_sweep(nx.path_graph(4), [(3, 0)], p_values=[1.0], q_values=[1.0], trials=20,
+                                         seed=1, workers=1, scheme='dodag')
+        assert result.successes == 20
+
+
+class TestDodagTrials:
+    def test_should_succeed_with_probability_of_route_links_and_swaps(self):
+        trials = DodagTrials(Topology.from_graph(nx.grid_2d_graph(4, 4)))
+        assert trials.hops((2, 3), (0, 0)) == 5
+        successes = trials(0.9, 0.8, (2, 3), (0, 0), 40_000, np.random.default_rng(3))
+        expected = 0.9 ** 5 * 0.8 ** 4
+        assert abs(successes / 40_000 - expected) <= 4 * math.sqrt(expected * (1 - expected) / 40_000)
+
+    def test_all_to_root_should_succeed_with_probability_of_each_route(self):
+        trials = DodagTrials(Topology.from_graph(nx.grid_2d_graph(4, 4)))
+        successes = trials.all_to_root(0.9, 0.8, (0, 0), 20_000, np.random.default_rng(4))
+        for label, node_successes in zip(trials.topology.labels, successes):
+            hops = label[0] + label[1]
+            if hops == 0:
+                assert node_successes == 0
+                continue
+            expected = 0.9 ** hops * 0.8 ** (hops - 1)
+            assert abs(node_successes / 20_000 - expected) <= 4 * math.sqrt(expected * (1 - expected) / 20_000)
+
+    def test_should_share_dodags_between_trials_on_the_same_topology(self):
+        first = DodagTrials(Topology.from_graph(nx.grid_2d_graph(4, 4)))
+        second = DodagTrials(Topology.from_graph(nx.grid_2d_graph(4, 4)))
+        assert first.store((0, 0)) is second.store((0, 0))
+
+    def test_should_never_succeed_when_source_is_cut_off_from_root(self):
+        physical_topology = nx.path_graph(3)
+        physical_topology.add_node(3)
+        assert DodagTrials(Topology.from_graph(physical_topology))(1.0, 1.0, 3, 0, 10, np.random.default_rng()) == 0
+
+
+class TestSynchronousTrials:
+    def test_run_pairs_should_count_successes_of_every_pair(self):
+        trials = SynchronousTrials(Topology.from_graph(nx.path_graph(4)))
+        assert trials.run_pairs(1.0, 1.0, [(0, 3), (2, 1)], 30, np.random.default_rng(1)).tolist() == [30, 30]
+        assert trials.run_pairs(0.0, 1.0, [(0, 3), (2, 1)], 30, np.random.default_rng(1)).tolist() == [0, 0]
+
+
+class TestRunAdaptiveSweep:
+    physical_topology = nx.grid_2d_graph(5, 5)
+    pairs = [((0, 0), (4, 4)), ((0, 0), (1, 1))]
+
+    def test_should_stop_every_cell_at_target_width(self):
+        results = run_adaptive_sweep(self.physical_topology, self.pairs, p_values=[0.5, 0.9], q_values=[0.9],
+                                     target_width=0.05, seed=1, workers=1)
+        for result in results:
+            assert result.ci_high - result.ci_low <= 0.05
+
+    def test_should_spend_less_than_fixed_trials_of_same_precision(self):
+        results = run_adaptive_sweep(self.physical_topology, self.pairs, p_values=[0.1, 0.5, 1.0], q_values=[0.5, 1.0],
+                                     target_width=0.05, batch_size=200, seed=1, workers=1)
+        # a fixed count has to cover the widest case, a rate of 1/2
+        fixed_trials = math.ceil(1.96 ** 2 * 0.25 / 0.025 ** 2)
+        assert sum(result.trials for result in results) * 2 < fixed_trials * len(results)
+        # cells that never succeed are settled by their first batch
+        assert all(result.trials == 200 for result in results if result.p == 0.1 and result.q == 0.5)
+
+    def test_should_respect_budget(self):
+        results = run_adaptive_sweep(self.physical_topology, self.pairs, p_values=[0.7], q_values=[0.8],
+                                     target_width=0.001, budget=5000, batch_size=500, seed=1, workers=1)
+        assert sum(result.trials for result in results) <= 5000
+
+    def test_should_cap_trials_per_cell(self):
+        results = run_adaptive_sweep(self.physical_topology, self.pairs, p_values=[0.7], q_values=[0.8],
+                                     target_width=0.001, max_trials_per_cell=3000, batch_size=500, seed=1, workers=1)
+        assert [result.trials for result in results] == [3000, 3000]
+
+    def test_should_be_reproducible_regardless_of_number_of_workers(self):
+        kwargs = dict(pairs=self.pairs, p_values=[0.8], q_values=[0.8], target_width=0.1, batch_size=100,
+                      chunk_size=50, seed=7)
+        assert (run_adaptive_sweep(self.physical_topology, workers=1, **kwargs)
+                == run_adaptive_sweep(self.physical_topology, workers=2, **kwargs))
+
+    def test_should_use_clopper_pearson_interval(self):
+        [result] = run_adaptive_sweep(self.physical_topology, self.pairs[:1], p_values=[0.8], q_values=[0.9],
+                                      target_width=0.1, seed=1, workers=1, interval='clopper-pearson')
+        assert (result.ci_low, result.ci_high) == clopper_pearson_interval(result.successes, result.trials)
+        assert result.ci_high - result.ci_low <= 0.1
+
+    def test_should_run_dodag_trials(self):
+        [result] = run_adaptive_sweep(nx.path_graph(4), [(3, 0)], p_values=[0.9], q_values=[0.9],
+                                      target_width=0.05, seed=1, workers=1, scheme='dodag')
+        assert result.ci_low < 0.9 ** 3 * 0.9 ** 2 < result.ci_high
@@ -0,0 +1,79 @@
+import datetime
+import json
+import sqlite3
+
+import pandas as pd
+
+from simulator import CellResult
+
+_COLUMNS = ['topology', 'scheme', 'method', 'p', 'q', 'source', 'target', 'seed', 'trials', 'successes', 'ci_low',
+            'ci_high', 'confidence', 'interval', 'chunk_size', 'target_width', 'batch_size', 'recorded_at']
+
+
+class SweepStore:
+    """Append-only SQLite file of finished sweep cells, each with the parameters and seed it was run with.
+
+    A sweep given a store looks every cell up before running it and records it as soon as it is finished, so a sweep
+    restarted after a crash only runs the cells it had not finished. Node labels are kept as JSON.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(f"""CREATE TABLE IF NOT EXISTS cells (
+            cell_key TEXT NOT NULL, {', '.join(_COLUMNS)})""")
+        self._connection.execute("CREATE INDEX IF NOT EXISTS cells_by_key ON cells (cell_key)")
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def find(self, topology, cell, run):
+        """Returns the recorded `CellResult` of `cell` = (p, q, (source, target)) for the same topology and run
+        parameters, None when it was not run yet."""
+        row = self._connection.execute(
+            "SELECT p, q, source, target, trials, successes, ci_low, ci_high FROM cells WHERE cell_key = ? LIMIT 1",
+            (_cell_key(topology, cell, run),)).fetchone()
+        if row is None:
+            return None
+        p, q, source, target, trials, successes, ci_low, ci_high = row
+        return CellResult(p=p, q=q, source=_label(source), target=_label(target), trials=trials,
+                          successes=successes, ci_low=ci_low, ci_high=ci_high)
+
+    def add(self, topology, cell, run, result):
+        row = {**run, 'topology': topology, 'p': result.p, 'q': result.q, 'source': json.dumps(result.source),
+               'target': json.dumps(result.target), 'trials': result.trials, 'successes': result.successes,
+               'ci_low': result.ci_low, 'ci_high': result.ci_high,
+               'recorded_at': datetime.datetime.now(datetime.timezone.utc).isoformat()}
+        self._connection.execute(
+            f"INSERT INTO cells (cell_key, {', '.join(_COLUMNS)}) VALUES ({', '.join('?' * (len(_COLUMNS) + 1))})",
+            [_cell_key(topology, cell, run)] + [row.get(column) for column in _COLUMNS])
+        self._connection.commit()
+
+
+def load_results(path):
+    """Every cell recorded in the store at `path` as a DataFrame, one row per cell with its rate and parameters."""
+    with sqlite3.connect(path) as connection:
+        results = pd.read_sql_query(f"SELECT {', '.join(_COLUMNS)} FROM cells ORDER BY rowid", connection)
+    results['source'] = results['source'].map(_label)
+    results['target'] = results['target'].map(_label)
+    results.insert(results.columns.get_loc('successes') + 1, 'rate', results['successes'] / results['trials'])
+    return results
+
+
+def _cell_key(topology, cell, run):
+    p, q, (source, target) = cell
+    return json.dumps([topology, p, q, source, target, sorted(run.items())])
+
+
+def _label(encoded):
+    # JSON turns tuple labels, like the (x, y) of grid nodes, into lists
+    def to_tuple(value):
+        return tuple(to_tuple(item) for item in value) if isinstance(value, list) else value
+    return to_tuple(json.loads(encoded))
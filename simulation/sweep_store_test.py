@@ -0,0 +1,91 @@
+import networkx as nx
+import pytest
+
+import simulator
+from simulator import run_synchronous_sweep, run_adaptive_sweep
+from sweep_store import SweepStore, load_results
+
+_run_chunk = simulator._run_chunk
+
+
+class _Crash(Exception):
+    pass
+
+
+class TestSweepStore:
+    physical_topology = nx.grid_2d_graph(4, 4)
+    sweep = dict(pairs=[((0, 0), (2, 3)), ((1, 1), (3, 3))], p_values=[0.6, 0.9], q_values=[0.8, 1.0], trials=200,
+                 chunk_size=100, seed=5, workers=1)
+
+    @staticmethod
+    def _counting_chunks(monkeypatch, fail_after=None):
+        calls = []
+
+        def counting_run_chunk(*args):
+            if fail_after is not None and len(calls) == fail_after:
+                raise _Crash()
+            calls.append(args)
+            return _run_chunk(*args)
+        monkeypatch.setattr(simulator, '_run_chunk', counting_run_chunk)
+        return calls
+
+    def test_should_not_change_results(self, tmp_path):
+        with SweepStore(tmp_path / 'sweep.sqlite') as store:
+            assert (run_synchronous_sweep(self.physical_topology, store=store, **self.sweep)
+                    == run_synchronous_sweep(self.physical_topology, **self.sweep))
+
+    def test_should_skip_recorded_cells(self, tmp_path, monkeypatch):
+        with SweepStore(tmp_path / 'sweep.sqlite') as store:
+            first = run_synchronous_sweep(self.physical_topology, store=store, **self.sweep)
+            calls = self._counting_chunks(monkeypatch)
+            assert run_synchronous_sweep(self.physical_topology, store=store, **self.sweep) == first
+        assert calls == []
+        assert len(load_results(tmp_path / 'sweep.sqlite')) == len(first)
+
+    def test_should_resume_after_crash(self, tmp_path, monkeypatch):
+        expected = run_synchronous_sweep(self.physical_topology, **self.sweep)
+        with SweepStore(tmp_path / 'sweep.sqlite') as store:
+            self._counting_chunks(monkeypatch, fail_after=5)
+            with pytest.raises(_Crash):
+                run_synchronous_sweep(self.physical_topology, store=store, **self.sweep)
+        assert len(load_results(tmp_path / 'sweep.sqlite')) == 2  # two chunks per cell
+        with SweepStore(tmp_path / 'sweep.sqlite') as store:
+            calls = self._counting_chunks(monkeypatch)
+            assert run_synchronous_sweep(self.physical_topology, store=store, **self.sweep) == expected
+        assert len(calls) == 2 * (len(expected) - 2)
+
+    def test_should_run_again_when_parameters_change(self, tmp_path, monkeypatch):
+        with SweepStore(tmp_path / 'sweep.sqlite') as store:
+            run_synchronous_sweep(self.physical_topology, store=store, **self.sweep)
+            calls = self._counting_chunks(monkeypatch)
+            run_synchronous_sweep(self.physical_topology, store=store, **{**self.sweep, 'seed': 6})
+            run_synchronous_sweep(nx.grid_2d_graph(5, 5), store=store, **self.sweep)
+        assert len(calls) == 2 * 2 * 8
+
+    def test_should_record_adaptive_cells_once_finished(self, tmp_path, monkeypatch):
+        adaptive_sweep = dict(pairs=[((0, 0), (2, 3))], p_values=[0.6, 0.9], q_values=[0.9], target_width=0.1,
+                              batch_size=100, chunk_size=100, seed=5, workers=1)
+        with SweepStore(tmp_path / 'sweep.sqlite') as store:
+            first = run_adaptive_sweep(self.physical_topology, store=store, **adaptive_sweep)
+            calls = self._counting_chunks(monkeypatch)
+            assert run_adaptive_sweep(self.physical_topology, store=store, **adaptive_sweep) == first
+        assert calls == []
+        results = load_results(tmp_path / 'sweep.sqlite')
+        assert list(results['method']) == ['adaptive', 'adaptive']
+        assert list(results['target_width']) == [0.1, 0.1]
+
+
+class TestLoadResults:
+    def test_should_load_cells_with_parameters_and_rates(self, tmp_path):
+        with SweepStore(tmp_path / 'sweep.sqlite') as store:
+            cells = run_synchronous_sweep(nx.grid_2d_graph(3, 3), [((0, 0), (2, 2))], p_values=[0.5, 1.0],
+                                          q_values=[0.9], trials=100, seed=3, workers=1, store=store)
+        results = load_results(tmp_path / 'sweep.sqlite')
+        assert list(results['p']) == [0.5, 1.0]
+        assert list(results['source']) == [(0, 0), (0, 0)]
+        assert list(results['target']) == [(2, 2), (2, 2)]
+        assert list(results['seed']) == [3, 3]
+        assert list(results['scheme']) == ['synchronous', 'synchronous']
+        assert list(results['successes']) == [cell.successes for cell in cells]
+        assert list(results['rate']) == [cell.rate for cell in cells]
+        assert list(results['ci_low']) == [cell.ci_low for cell in cells]
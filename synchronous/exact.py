@@ -0,0 +1,181 @@
+import math
+
+import numpy as np
+
+from synchronous import external_phase_batch, InternalPhaseEngine
+from topology import Topology
+
+# number of nodes up to which `success_probability` computes the exact probability instead of sampling it
+DEFAULT_MAX_EXACT_NODES = 20
+# states `success_probability` computes before it gives up on the exact probability, a few seconds worth: dense
+# networks have far more states than sparse ones with the same number of nodes
+DEFAULT_MAX_EXACT_STATES = 100_000
+
+
+class _TooManyStates(Exception):
+    pass
+
+
+class SuccessPolynomial:
+    """Polynomial in p and q: `coefficients[i, j]` is the coefficient of p**i * q**j."""
+
+    def __init__(self, coefficients):
+        self.coefficients = coefficients
+
+    @classmethod
+    def constant(cls, value):
+        return cls(np.array([[value]], dtype=float))
+
+    def __add__(self, other):
+        if not isinstance(other, SuccessPolynomial):
+            other = SuccessPolynomial.constant(other)
+        shape = np.maximum(self.coefficients.shape, other.coefficients.shape)
+        coefficients = np.zeros(shape)
+        coefficients[:self.coefficients.shape[0], :self.coefficients.shape[1]] += self.coefficients
+        coefficients[:other.coefficients.shape[0], :other.coefficients.shape[1]] += other.coefficients
+        return SuccessPolynomial(coefficients)
+
+    __radd__ = __add__
+
+    def __neg__(self):
+        return SuccessPolynomial(-self.coefficients)
+
+    def __sub__(self, other):
+        return self + -other
+
+    def __rsub__(self, other):
+        return -self + other
+
+    def __mul__(self, other):
+        if not isinstance(other, SuccessPolynomial):
+            return SuccessPolynomial(self.coefficients * other)
+        rows, cols = self.coefficients.shape
+        coefficients = np.zeros((rows + other.coefficients.shape[0] - 1, cols + other.coefficients.shape[1] - 1))
+        for (i, j), coefficient in np.ndenumerate(other.coefficients):
+            if coefficient:
+                coefficients[i:i + rows, j:j + cols] += coefficient * self.coefficients
+        return SuccessPolynomial(coefficients)
+
+    __rmul__ = __mul__
+
+    def __call__(self, p, q):
+        return float(np.polynomial.polynomial.polyval2d(p, q, self.coefficients))
+
+    def __repr__(self):
+        terms = [f'{coefficient:g}*p^{i}*q^{j}' for (i, j), coefficient in np.ndenumerate(self.coefficients)
+                 if coefficient]
+        return f"SuccessPolynomial({' + '.join(terms) or '0'})"
+
+
+def exact_success_probability(physical_topology, source, target, p, q):
+    """Probability that `internal_phase` on `external_phase(physical_topology, p)` succeeds, without sampling.
+
+    The greedy protocol never looks at a link twice: from the node holding the link to the source it only reads
+    links to nodes it has not swapped through yet, which nobody read before. So the outcome from a state only
+    depends on the holder and on the part of the network still reachable from it, and the probability is summed over
+    those states, each computed once. The number of states grows exponentially with the network, keep it small.
+    """
+    return _ExactEvaluator(Topology.of(physical_topology), _float_algebra(p, q)).success(source, target)
+
+
+def success_probability_polynomial(physical_topology, source, target):
+    """`exact_success_probability` as a `SuccessPolynomial` in p and q, to evaluate at many (p, q) at once."""
+    return _ExactEvaluator(Topology.of(physical_topology), _polynomial_algebra()).success(source, target)
+
+
+def success_probability(physical_topology, source, target, p, q, max_exact_nodes=DEFAULT_MAX_EXACT_NODES,
+                        trials=100_000, rng=None, max_exact_states=DEFAULT_MAX_EXACT_STATES):
+    """Exact success probability on networks of up to `max_exact_nodes` nodes, Monte Carlo estimate above that.
+
+    The exact computation is also dropped for the estimate once it has gone through `max_exact_states` states
+    (None for no limit), as on dense networks below the node threshold.
+    """
+    topology = Topology.of(physical_topology)
+    if topology.number_of_nodes <= max_exact_nodes:
+        try:
+            return _ExactEvaluator(topology, _float_algebra(p, q), max_states=max_exact_states).success(source, target)
+        except _TooManyStates:
+            pass
+    if source == target:
+        return None
+    if rng is None:
+        rng = np.random.default_rng()
+    batch = external_phase_batch(topology, p, trials, rng=rng)
+    return float(InternalPhaseEngine(topology).run_batch(batch, source, target, q, rng=rng).mean())
+
+
+def _float_algebra(p, q):
+    def choice_probability(candidates):
+        # each of `candidates` links is alive with probability p and an alive one is picked uniformly at random:
+        # a given candidate is picked with probability p * E[1 / (1 + Binomial(candidates - 1, p))]
+        return (1 - (1 - p) ** candidates) / candidates
+    return p, q, choice_probability
+
+
+def _polynomial_algebra():
+    p = SuccessPolynomial(np.array([[0.0], [1.0]]))
+    q = SuccessPolynomial(np.array([[0.0, 1.0]]))
+
+    def choice_probability(candidates):
+        # (1 - (1 - p) ** candidates) / candidates, expanded in powers of p
+        coefficients = np.zeros((candidates + 1, 1))
+        for k in range(1, candidates + 1):
+            coefficients[k, 0] = (-1) ** (k + 1) * math.comb(candidates, k) / candidates
+        return SuccessPolynomial(coefficients)
+    return p, q, choice_probability
+
+
+class _ExactEvaluator:
+    def __init__(self, topology, algebra, max_states=None):
+        self.topology = topology
+        self.max_states = max_states
+        self.p, self.q, self.choice_probability = algebra
+        self.neighbours = [topology.neighbours(i).tolist() for i in range(topology.number_of_nodes)]
+        self._memo = {}
+        self._target = None
+
+    def success(self, source, target):
+        if source == target or self.topology.number_of_nodes == 0:
+            return None
+        source, target = self.topology.index_of(source), self.topology.index_of(target)
+        self._target = target
+        self._memo = {}
+        removed = 1 << source
+        candidates = [n for n in self.neighbours[source] if n != target and n != source]
+        reached = 0
+        if candidates:
+            reached = self.choice_probability(len(candidates)) * sum(self._from(n, removed) for n in candidates)
+        if target in self.neighbours[source]:
+            # target is checked among the first hop links before any swap
+            return self.p + (1 - self.p) * reached
+        return reached
+
+    def _from(self, node, removed):
+        # probability of success once `node` holds the link to the source and every node in `removed` is swapped
+        # through; depends on `removed` only through the nodes still reachable from `node`
+        component = self._component(node, removed)
+        if not component >> self._target & 1:
+            return 0
+        key = (node, component)
+        if key not in self._memo:
+            if self.max_states is not None and len(self._memo) >= self.max_states:
+                raise _TooManyStates()
+            removed |= 1 << node
+            candidates = [n for n in self.neighbours[node] if not removed >> n & 1]
+            value = 0
+            if candidates:
+                reached = sum(1 if n == self._target else self._from(n, removed) for n in candidates)
+                value = self.choice_probability(len(candidates)) * self.q * reached
+            self._memo[key] = value
+        return self._memo[key]
+
+    def _component(self, node, removed):
+        component = 1 << node
+        stack = [node]
+        while stack:
+            for neighbour in self.neighbours[stack.pop()]:
+                bit = 1 << neighbour
+                if not (component | removed) & bit:
+                    component |= bit
+                    stack.append(neighbour)
+        return component
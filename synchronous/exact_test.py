@@ -0,0 +1,101 @@
+import math
+import time
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from exact import exact_success_probability, success_probability_polynomial, success_probability, SuccessPolynomial
+from synchronous import external_phase_batch, InternalPhaseEngine
+from topology import Topology
+
+
+class TestExactSuccessProbability:
+    def test_should_match_closed_form_on_path(self):
+        # both links alive and the middle swap succeeds
+        assert math.isclose(exact_success_probability(nx.path_graph(3), 0, 2, 0.7, 0.6), 0.7 ** 2 * 0.6)
+
+    def test_should_match_closed_form_on_triangle(self):
+        # direct link, or else the two hop route through the third node
+        expected = 0.7 + 0.3 * 0.7 ** 2 * 0.6
+        assert math.isclose(exact_success_probability(nx.complete_graph(3), 0, 2, 0.7, 0.6), expected)
+
+    def test_should_be_0_when_target_is_unreachable(self):
+        physical_topology = nx.path_graph(3)
+        physical_topology.add_node(3)
+        assert exact_success_probability(physical_topology, 0, 3, 0.9, 0.9) == 0
+
+    def test_should_be_none_when_source_is_target(self):
+        assert exact_success_probability(nx.path_graph(3), 1, 1, 0.9, 0.9) is None
+
+    def test_should_be_1_when_p_and_q_are_1_on_a_path(self):
+        assert exact_success_probability(nx.path_graph(6), 0, 5, 1, 1) == 1
+
+    @pytest.mark.parametrize("physical_topology, source, target, p, q", [
+        (nx.grid_2d_graph(4, 4), (0, 0), (2, 3), 0.8, 0.8),
+        (nx.grid_2d_graph(3, 5), (1, 1), (2, 4), 0.6, 1.0),
+        (nx.gnp_random_graph(12, 0.35, seed=3), 0, 7, 0.9, 0.7)])
+    def test_should_agree_with_sampling(self, physical_topology, source, target, p, q):
+        number_of_runs = 40_000
+        rng = np.random.default_rng(11)
+        batch = external_phase_batch(physical_topology, p, trials=number_of_runs, rng=rng)
+        sampled_rate = InternalPhaseEngine.from_batch(batch).run_batch(batch, source, target, q, rng=rng).mean()
+        exact = exact_success_probability(physical_topology, source, target, p, q)
+        assert abs(sampled_rate - exact) <= 4 * math.sqrt(exact * (1 - exact) / number_of_runs)
+
+    def test_should_accept_topology(self):
+        physical_topology = nx.grid_2d_graph(3, 3)
+        assert (exact_success_probability(Topology.from_graph(physical_topology), (0, 0), (2, 2), 0.8, 0.9)
+                == exact_success_probability(physical_topology, (0, 0), (2, 2), 0.8, 0.9))
+
+
+class TestSuccessProbabilityPolynomial:
+    def test_should_have_coefficients_of_path(self):
+        polynomial = success_probability_polynomial(nx.path_graph(3), 0, 2)
+        expected = np.zeros((3, 2))
+        expected[2, 1] = 1  # p^2 q
+        np.testing.assert_allclose(polynomial.coefficients, expected)
+
+    @pytest.mark.parametrize("p, q", [(0.3, 0.4), (0.8, 0.9), (1.0, 0.5)])
+    @pytest.mark.parametrize("source, target", [((0, 0), (2, 3)), ((1, 1), (1, 2))])
+    def test_should_evaluate_to_exact_probability(self, p, q, source, target):
+        physical_topology = nx.grid_2d_graph(3, 4)
+        polynomial = success_probability_polynomial(physical_topology, source, target)
+        assert math.isclose(polynomial(p, q), exact_success_probability(physical_topology, source, target, p, q))
+
+    def test_should_add_and_multiply_as_polynomials(self):
+        p = SuccessPolynomial(np.array([[0.0], [1.0]]))
+        q = SuccessPolynomial(np.array([[0.0, 1.0]]))
+        polynomial = (1 - p) * q + 2 * p * p
+        assert math.isclose(polynomial(0.5, 0.2), 0.5 * 0.2 + 2 * 0.25)
+
+
+class TestSuccessProbability:
+    def test_should_be_exact_up_to_size_threshold(self):
+        physical_topology = nx.grid_2d_graph(3, 3)
+        assert (success_probability(physical_topology, (0, 0), (2, 2), 0.8, 0.9, max_exact_nodes=9)
+                == exact_success_probability(physical_topology, (0, 0), (2, 2), 0.8, 0.9))
+
+    def test_should_sample_above_size_threshold(self):
+        physical_topology = nx.grid_2d_graph(3, 3)
+        exact = exact_success_probability(physical_topology, (0, 0), (2, 2), 0.8, 0.9)
+        sampled = success_probability(physical_topology, (0, 0), (2, 2), 0.8, 0.9, max_exact_nodes=8,
+                                      trials=20_000, rng=np.random.default_rng(4))
+        assert sampled != exact
+        assert abs(sampled - exact) <= 4 * math.sqrt(exact * (1 - exact) / 20_000)
+
+    def test_should_sample_dense_network_below_size_threshold(self):
+        physical_topology = nx.gnp_random_graph(20, 0.5, seed=1)
+        start = time.monotonic()
+        sampled = success_probability(physical_topology, 0, 19, 0.8, 0.9, trials=2_000, rng=np.random.default_rng(5))
+        assert time.monotonic() - start < 20
+        assert 0 < sampled < 1
+
+    def test_should_sample_once_state_limit_is_reached(self):
+        physical_topology = nx.grid_2d_graph(3, 3)
+        exact = exact_success_probability(physical_topology, (0, 0), (2, 2), 0.8, 0.9)
+        assert success_probability(physical_topology, (0, 0), (2, 2), 0.8, 0.9, max_exact_states=None) == exact
+        sampled = success_probability(physical_topology, (0, 0), (2, 2), 0.8, 0.9, max_exact_states=5,
+                                      trials=20_000, rng=np.random.default_rng(6))
+        assert sampled != exact
+        assert abs(sampled - exact) <= 4 * math.sqrt(exact * (1 - exact) / 20_000)
@@ -1,119 +1,851 @@
 import random
+import time
+import weakref
 
 import networkx as nx
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import shortest_path
+
+from profiling import stage
+from topology import Topology, csr_from_edges
+
+
+# Time at which a link of an instant topology was generated, links without it were generated at time 0.
+# Only read when a coherence time is given.
+CreatedAtAttributeName = 'created_at'
+
+# widest frontier `count_simple_paths_by_length` takes on by default: sweeping a 9 x 9 lattice takes about ten
+# seconds, each extra column multiplies that by about 6
+DEFAULT_MAX_FRONTIER_WIDTH = 10
 
 
 # external phase
-def external_phase(physical_topology, p):
-    if p == 0 or nx.utils.graphs_equal(physical_topology, nx.empty_graph()):
+def external_phase(physical_topology, p, created_at=None, profiler=None, rng=random, components=None):
+    """Samples an instant topology: every link of `physical_topology` is kept with probability `p`.
+
+    `rng` is anything with a `random()` method, the `random` module by default. A `numpy.random.Generator` draws
+    all links at once. A `Topology`, as built by `generators`, is sampled on its edge arrays and only the links kept
+    are turned into a graph. `components`, an `InstantComponents`, is cleared and labelled with the components of
+    the instant topology as links are kept, for `internal_phase` to prune with.
+    """
+    if components is not None:
+        components.clear()
+    if isinstance(physical_topology, Topology):
+        return _external_phase_on_topology(physical_topology, p, created_at, profiler, rng, components)
+    if p == 0 or _is_empty_graph(physical_topology):
+        return nx.empty_graph()
+    with stage(profiler, 'external_phase.copy'):
+        instant_topology = physical_topology.copy()
+    if p != 1:
+        with stage(profiler, 'external_phase.sampling'):
+            edges = list(physical_topology.edges())
+            if isinstance(rng, np.random.Generator):
+                failures = (rng.random(len(edges)) >= p).tolist()
+            else:
+                failures = [rng.random() >= p for _ in edges]
+            for edge, entanglement_generation_failure in zip(edges, failures):
+                if entanglement_generation_failure:
+                    instant_topology.remove_edge(edge[0], edge[1])
+                elif components is not None:
+                    components.union(edge[0], edge[1])
+        if profiler is not None:
+            profiler.count('rng_draws', physical_topology.number_of_edges())
+    elif components is not None:
+        for u, v in physical_topology.edges():
+            components.union(u, v)
+    if created_at is not None:
+        nx.set_edge_attributes(instant_topology, created_at, CreatedAtAttributeName)
+    return instant_topology
+
+
+def _external_phase_on_topology(topology, p, created_at, profiler, rng, components):
+    if p == 0 or topology.number_of_nodes == 0:
         return nx.empty_graph()
-    if p == 1:
-        return physical_topology.copy()
-    instant_topology = physical_topology.copy()
-    for edge in physical_topology.edges():
-        entanglement_generation_failure = random.random() >= p
-        if entanglement_generation_failure:
-            instant_topology.remove_edge(edge[0], edge[1])
+    with stage(profiler, 'external_phase.sampling'):
+        if isinstance(rng, np.random.Generator):
+            edge_mask = rng.random(topology.number_of_edges) < p
+        else:
+            edge_mask = np.array([rng.random() < p for _ in range(topology.number_of_edges)], dtype=bool)
+        if components is not None:
+            labels = topology.labels
+            for u, v in topology.edges[edge_mask].tolist():
+                components.union(labels[u], labels[v])
+    if profiler is not None:
+        profiler.count('rng_draws', topology.number_of_edges)
+    with stage(profiler, 'external_phase.copy'):
+        instant_topology = topology.to_graph(edge_mask)
+    if created_at is not None:
+        nx.set_edge_attributes(instant_topology, created_at, CreatedAtAttributeName)
     return instant_topology
 
 
+class TrialStreams:
+    """Counter-based random streams keyed by (seed, trial index), one per phase of each trial.
+
+    A trial draws the same numbers whichever batch, worker or order runs it, so any trial can be replayed on its own.
+    The streams are Philox counters starting at (0, 0, trial, phase) under a key derived from `seed`: `at` moves one
+    shared generator to the start of a stream instead of building a generator per trial.
+    """
+    EXTERNAL_PHASE = 0
+    INTERNAL_PHASE = 1
+
+    def __init__(self, seed):
+        self.seed = seed
+        self._bit_generator = np.random.Philox(key=np.random.SeedSequence(seed).generate_state(2, np.uint64))
+        self._key = self._bit_generator.state['state']['key']
+        self._generator = np.random.Generator(self._bit_generator)
+
+    def at(self, trial, phase):
+        """The generator, positioned at the start of the stream of `phase` of trial number `trial`."""
+        self._bit_generator.state = {
+            'bit_generator': 'Philox',
+            'state': {'counter': np.array([0, 0, trial, phase], dtype=np.uint64), 'key': self._key},
+            'buffer': np.zeros(4, dtype=np.uint64), 'buffer_pos': 4, 'has_uint32': 0, 'uinteger': 0}
+        return self._generator
+
+
+class InstantComponents:
+    """Connected components of an instant topology, labelled with a union-find by `external_phase` as it keeps links.
+
+    Nodes never joined to another are components of their own. The labels are those of the links as sampled, they
+    do not follow later changes to the instant topology.
+    """
+
+    def __init__(self):
+        self._parent = {}
+
+    def clear(self):
+        self._parent.clear()
+
+    def union(self, u, v):
+        root_u, root_v = self.find(u), self.find(v)
+        if root_u != root_v:
+            self._parent[root_u] = root_v
+
+    def find(self, node):
+        parent = self._parent
+        root = node
+        while root in parent:
+            root = parent[root]
+        while node != root:  # path compression
+            parent[node], node = root, parent[node]
+        return root
+
+    def connected(self, u, v):
+        return self.find(u) == self.find(v)
+
+
+class InstantTopologyBatch:
+    """Instant topologies of many external phase trials, one boolean edge mask row per trial.
+
+    Row `t` is trial number `first_trial + t`, the index its `TrialStreams` are keyed by.
+    """
+
+    def __init__(self, topology, masks, first_trial=0):
+        self.topology = topology
+        self.masks = masks
+        self.first_trial = first_trial
+
+    @property
+    def nodes(self):
+        return self.topology.labels
+
+    @property
+    def edges(self):
+        return self.topology.edges
+
+    @property
+    def number_of_trials(self):
+        return self.masks.shape[0]
+
+    def number_of_edges(self, trial=None):
+        if trial is None:
+            return self.masks.sum(axis=1)
+        return int(self.masks[trial].sum())
+
+    def edges_of(self, trial):
+        return self.topology.edge_labels(self.masks[trial])
+
+    def to_graph(self, trial):
+        return self.topology.to_graph(self.masks[trial])
+
+    def adjacency(self, trial):
+        # CSR form of the trial over node indices: neighbours of `self.nodes[i]` are `indices[indptr[i]:indptr[i + 1]]`
+        indptr, indices, _ = csr_from_edges(len(self.nodes), self.edges[self.masks[trial]])
+        return indptr, indices
+
+
+def external_phase_batch(physical_topology, p, trials, rng=None, profiler=None, streams=None, first_trial=0):
+    """`external_phase` for many trials at once, on a `Topology` or a graph (converted to a `Topology` first).
+
+    With `streams`, a `TrialStreams`, trial number `first_trial + t` draws its links from its own stream instead of
+    `rng`, so its instant topology does not depend on the other trials of the batch.
+    """
+    topology = Topology.of(physical_topology)
+    with stage(profiler, 'external_phase_batch'):
+        # same Bernoulli(p) per edge as `external_phase`, drawn for all trials at once
+        if streams is None:
+            if rng is None:
+                rng = np.random.default_rng()
+            masks = rng.random((trials, topology.number_of_edges)) < p
+        else:
+            masks = np.empty((trials, topology.number_of_edges), dtype=bool)
+            for t in range(trials):
+                masks[t] = streams.at(first_trial + t, TrialStreams.EXTERNAL_PHASE).random(topology.number_of_edges) < p
+    if profiler is not None:
+        profiler.count('rng_draws', masks.size)
+    return InstantTopologyBatch(topology, masks, first_trial)
+
+
 # internal phase
-def internal_phase(instant_topology, source, target, q):
+def internal_phase(instant_topology, source, target, q, coherence_time=None, profiler=None, rng=random, prune=True,
+                   start_time=0, components=None):
+    """Greedy swapping from `source` until it shares a link with `target`, True when it does.
+
+    The phase starts at `start_time`, on the clock of the `created_at` stamps `external_phase` puts on links (links
+    without one were made at time 0), and every swap takes one time step. With a `coherence_time`, links older than
+    it are ignored when read.
+
+    With `prune`, a trial whose source and target are in different components of `instant_topology` fails before
+    the topology is copied. The components are read from `components`, the `InstantComponents` filled by the
+    `external_phase` that sampled `instant_topology`, without a search; otherwise a search runs from both ends and
+    stops as soon as one of them runs out of nodes, which at low p is much sooner than the copy. A `Profiler` counts
+    those trials as `pruned`.
+    """
     if (source == target
-            or nx.utils.graphs_equal(instant_topology, nx.empty_graph())):
+            or _is_empty_graph(instant_topology)):
         return None
-
-    copied_instant_topology = instant_topology.copy()
-    neighbours = list(nx.all_neighbors(copied_instant_topology, source))
-    while len(neighbours) > 0:
-        if target in neighbours:
-            return True
-        random_n = random.choice(neighbours)
-        n_neighbours = list(nx.all_neighbors(copied_instant_topology, random_n))
-        if n_neighbours == [source]:
-            return False
-        random_nn = random.choice(n_neighbours)
-        while random_nn == source:
-            random_nn = random.choice(n_neighbours)
-        for n in neighbours:
-            copied_instant_topology.remove_edge(source, n)
-        for nn in n_neighbours:
-            if nn != source:
-                copied_instant_topology.remove_edge(random_n, nn)
-        entanglement_swap_failure = random.random() >= q
-        if entanglement_swap_failure:
+    if prune:
+        with stage(profiler, 'internal_phase.prune'):
+            if components is not None:
+                connected = components.connected(source, target)
+            else:
+                connected = target in instant_topology and nx.has_path(instant_topology, source, target)
+        if not connected:
+            if profiler is not None:
+                profiler.count('pruned')
             return False
-        copied_instant_topology.add_edge(source, random_nn)
-        neighbours = list(nx.all_neighbors(copied_instant_topology, source))
+
+    now = start_time
+    with stage(profiler, 'internal_phase.copy'):
+        copied_instant_topology = instant_topology.copy()
+    with stage(profiler, 'internal_phase.routing'):
+        neighbours = _coherent_neighbours(copied_instant_topology, source, now, coherence_time)
+        if profiler is not None:
+            profiler.count('neighbour_rebuilds')
+        while len(neighbours) > 0:
+            if target in neighbours:
+                return True
+            random_n = _choice(rng, neighbours)
+            n_neighbours = _coherent_neighbours(copied_instant_topology, random_n, now, coherence_time)
+            if profiler is not None:
+                profiler.count('neighbour_rebuilds')
+                profiler.count('rng_draws')
+            if n_neighbours == [source]:
+                return False
+            random_nn = _choice(rng, n_neighbours)
+            while random_nn == source:
+                random_nn = _choice(rng, n_neighbours)
+            # the swapped link is as old as the older of the two links it is made of
+            swapped_link_created_at = min(_created_at(copied_instant_topology, source, random_n),
+                                          _created_at(copied_instant_topology, random_n, random_nn))
+            for n in neighbours:
+                copied_instant_topology.remove_edge(source, n)
+            for nn in n_neighbours:
+                if nn != source:
+                    copied_instant_topology.remove_edge(random_n, nn)
+            entanglement_swap_failure = rng.random() >= q
+            if profiler is not None:
+                profiler.count('swaps')
+                profiler.count('rng_draws', 2)
+            if entanglement_swap_failure:
+                return False
+            copied_instant_topology.add_edge(source, random_nn, **{CreatedAtAttributeName: swapped_link_created_at})
+            now += 1
+            neighbours = _coherent_neighbours(copied_instant_topology, source, now, coherence_time)
+            if profiler is not None:
+                profiler.count('neighbour_rebuilds')
     return False
 
 
-def approx_mean_path_length_for_2d_lattice(graph, source, target, check_is_lattice=True):
-    if check_is_lattice and not is_2d_lattice_graph(graph):
-        raise ValueError("Graph is not a 2D lattice")
+def _is_empty_graph(graph):
+    # same as `nx.utils.graphs_equal(graph, nx.empty_graph())`, which copies the whole adjacency to compare it
+    return graph.number_of_nodes() == 0 and not graph.graph
 
-    x_s, y_s = source
-    x_t, y_t = target
-    l1_distance = abs(x_s - x_t) + abs(y_s - y_t)  # this is also the shortest path length in 2D lattice
-    all_simple_paths = list(nx.all_simple_edge_paths(graph, source=source, target=target))
-    m_to_paths = {}
-    for path in all_simple_paths:
-        m_for_path = ((len(path) - l1_distance) / 2) + 1
-        if m_for_path in m_to_paths:
-            m_to_paths[m_for_path].append(path)
+
+def _choice(rng, sequence):
+    # `random.choice` for any `rng` with a `random()` method, numpy generators included
+    return sequence[int(rng.random() * len(sequence))]
+
+
+def _coherent_neighbours(instant_topology, node, now, coherence_time):
+    if coherence_time is None:
+        return list(nx.all_neighbors(instant_topology, node))
+    return [neighbour for neighbour in nx.all_neighbors(instant_topology, node)
+            if now - _created_at(instant_topology, node, neighbour) <= coherence_time]
+
+
+def _created_at(instant_topology, u, v):
+    return instant_topology.edges[u, v].get(CreatedAtAttributeName, 0)
+
+
+def internal_phase_array(instant_topology, source, target, q, rng=random, coherence_time=None):
+    instant_topology = Topology.of(instant_topology)
+    if source == target or instant_topology.number_of_nodes == 0:
+        return None
+    return InternalPhaseEngine(instant_topology).run(source, target, q, rng=rng, coherence_time=coherence_time)
+
+
+class InternalPhaseEngine:
+    """Same greedy swap protocol as `internal_phase`, run on CSR arrays instead of a mutated networkx copy.
+
+    Instead of removing edges, a trial stamps nodes whose edges are gone (the source and every node swapped
+    through), so the topology arrays are shared by all trials and only the scratch buffers are written.
+    """
+
+    def __init__(self, topology):
+        self.topology = topology
+        self.nodes = topology.labels
+        self.number_of_edges = topology.number_of_edges
+        if topology.indices.flags.writeable:
+            # plain lists, scalar access on them is much faster than on NumPy arrays
+            self._indptr = topology.indptr.tolist()
+            self._indices = topology.indices.tolist()
+            self._edge_ids = topology.edge_ids.tolist()
         else:
-            m_to_paths[m_for_path] = [path]
+            # read-only arrays, as attached from shared memory, are read in place rather than copied in every
+            # process: through memoryviews, slower than lists but still far faster than NumPy scalar access
+            self._indptr = memoryview(topology.indptr)
+            self._indices = memoryview(topology.indices)
+            self._edge_ids = memoryview(topology.edge_ids)
+        # scratch buffers shared by all trials
+        self._removed_stamp = [0] * topology.number_of_nodes
+        self._candidates = [0] * int(np.diff(topology.indptr).max(initial=1))
+        self._stamp = 0
+        # running totals over every trial, for the profiler
+        self._swaps = 0
+        self._neighbour_rebuilds = 0
+
+    @classmethod
+    def from_graph(cls, graph):
+        return cls(Topology.from_graph(graph))
+
+    @classmethod
+    def from_batch(cls, batch):
+        return cls(batch.topology)
+
+    def run(self, source, target, q, edge_mask=None, rng=random, coherence_time=None):
+        """Run one trial between `source` and `target` on the edges selected by `edge_mask` (all edges if None).
+
+        All links are taken to be generated at time 0 and every swap to take one time step, as in `internal_phase`.
+        """
+        if source == target or not self.nodes:
+            return None
+        return self._run(self.topology.index_of(source), self.topology.index_of(target), q, edge_mask, rng,
+                         coherence_time)
+
+    def run_batch(self, batch, source, target, q, rng=random, coherence_time=None, profiler=None, streams=None):
+        """Runs one trial per row of `batch`. With `streams`, a `TrialStreams`, each trial swaps with its own stream
+        instead of `rng`, so its outcome only depends on the seed and its trial number."""
+        if source == target or not self.nodes:
+            return np.full(batch.number_of_trials, None)
+        source_index = self.topology.index_of(source)
+        target_index = self.topology.index_of(target)
+        totals = self._swaps, self._neighbour_rebuilds
+        with stage(profiler, 'engine.run_batch'):
+            successes = np.array([self._run(source_index, target_index, q, edge_mask,
+                                            rng if streams is None else
+                                            streams.at(batch.first_trial + t, TrialStreams.INTERNAL_PHASE),
+                                            coherence_time)
+                                  for t, edge_mask in enumerate(batch.masks)], dtype=bool)
+        if profiler is not None:
+            profiler.count('engine.trials', batch.number_of_trials)
+            self._count_work(profiler, totals)
+        return successes
+
+    def run_many(self, pairs, q, edge_mask=None, rng=random, coherence_time=None):
+        """Runs every (source, target) pair of `pairs` on the same instant topology, returns whether each succeeded.
+
+        Each pair routes on its own, none of them uses up links of the others.
+        """
+        pair_indices = self._pair_indices(pairs)
+        return np.array([self._run(source, target, q, edge_mask, rng, coherence_time)
+                         for source, target in pair_indices], dtype=bool)
+
+    def run_batch_many(self, batch, pairs, q, rng=random, coherence_time=None, profiler=None):
+        """`run_many` on every trial of `batch`: one row per trial, one column per pair."""
+        pair_indices = self._pair_indices(pairs)
+        successes = np.zeros((batch.number_of_trials, len(pair_indices)), dtype=bool)
+        totals = self._swaps, self._neighbour_rebuilds
+        with stage(profiler, 'engine.run_batch_many'):
+            for trial, edge_mask in enumerate(batch.masks):
+                for column, (source, target) in enumerate(pair_indices):
+                    successes[trial, column] = self._run(source, target, q, edge_mask, rng, coherence_time)
+        if profiler is not None:
+            profiler.count('engine.trials', successes.size)
+            self._count_work(profiler, totals)
+        return successes
+
+    def _count_work(self, profiler, totals):
+        # swaps and neighbour rebuilds since `totals` were taken, as `internal_phase` counts them
+        swaps, neighbour_rebuilds = totals
+        profiler.count('swaps', self._swaps - swaps)
+        profiler.count('neighbour_rebuilds', self._neighbour_rebuilds - neighbour_rebuilds)
+
+    def _pair_indices(self, pairs):
+        pair_indices = []
+        for source, target in pairs:
+            if source == target:
+                raise ValueError(f"Source and target must differ, got {source} twice")
+            pair_indices.append((self.topology.index_of(source), self.topology.index_of(target)))
+        return pair_indices
+
+    def _run(self, source, target, q, edge_mask, rng, coherence_time):
+        # Links are all generated at time 0 and a swapped link is as old as its oldest part, so after `swaps`
+        # swaps every link left is `swaps` old: the trial fails as soon as that exceeds the coherence time.
+        if coherence_time is None:
+            coherence_time = float('inf')
+        swaps = 0
+        self._stamp += 1
+        self._removed_stamp[source] = self._stamp
+        count = self._alive_neighbours(source, edge_mask)
+        if count == 0:
+            return False
+        for i in range(count):
+            if self._candidates[i] == target:
+                return True
+        current = self._candidates[int(rng.random() * count)]
+        while True:
+            self._removed_stamp[current] = self._stamp
+            count = self._alive_neighbours(current, edge_mask)
+            if count == 0:  # the only link left is the one to the source
+                return False
+            next_hop = self._candidates[int(rng.random() * count)]
+            self._swaps += 1
+            entanglement_swap_failure = rng.random() >= q
+            if entanglement_swap_failure:
+                return False
+            swaps += 1
+            if swaps > coherence_time:
+                return False
+            if next_hop == target:
+                return True
+            current = next_hop
+
+    def _alive_neighbours(self, node, edge_mask):
+        # fills `self._candidates` with neighbours still linked to `node` and returns how many there are
+        removed_stamp = self._removed_stamp
+        stamp = self._stamp
+        indices = self._indices
+        edge_ids = self._edge_ids
+        candidates = self._candidates
+        self._neighbour_rebuilds += 1
+        count = 0
+        for slot in range(self._indptr[node], self._indptr[node + 1]):
+            neighbour = indices[slot]
+            if removed_stamp[neighbour] != stamp and (edge_mask is None or edge_mask[edge_ids[slot]]):
+                candidates[count] = neighbour
+                count += 1
+        return count
+
+
+def approx_mean_path_length_for_2d_lattice(graph, source, target, check_is_lattice=True,
+                                           max_frontier_width=DEFAULT_MAX_FRONTIER_WIDTH):
+    """Mean length of the simple paths between `source` and `target`, counted by `path_counts_by_m_for_2d_lattice`.
+
+    Exact but exponential in the shorter side of the lattice: sides of `max_frontier_width` nodes or more (10 by
+    default) raise ValueError, see `count_simple_paths_by_length`.
+    """
+    path_counts = path_counts_by_m_for_2d_lattice(graph, source, target, check_is_lattice=check_is_lattice,
+                                                  max_frontier_width=max_frontier_width)
     numerator_sum = 0
     denominator_sum = 0
-    for m, paths in m_to_paths.items():
-        number_of_paths = len(paths)
-        path_length = len(paths[0])
+    for m, (path_length, number_of_paths) in path_counts.items():
         numerator_sum += number_of_paths * path_length
         denominator_sum += number_of_paths
 
     return numerator_sum / denominator_sum
 
 
+def path_counts_by_m_for_2d_lattice(graph, source, target, check_is_lattice=True,
+                                    max_frontier_width=DEFAULT_MAX_FRONTIER_WIDTH):
+    """Maps every `m` bucket of simple paths between `source` and `target` to (path length, number of paths)."""
+    embedding = lattice_2d_embedding(graph)
+    if embedding is None:
+        if check_is_lattice:
+            raise ValueError("Graph is not a 2D lattice")
+        # without the check, nodes are taken to be labelled by their (x, y) position as in `nx.grid_2d_graph`
+        coordinates = {node: node for node in graph.nodes}
+        rows = 1 + max((x for x, _ in graph.nodes), default=0)
+        cols = 1 + max((y for _, y in graph.nodes), default=0)
+    else:
+        coordinates = embedding.coordinates
+        rows, cols = embedding.shape
+
+    x_s, y_s = coordinates[source]
+    x_t, y_t = coordinates[target]
+    l1_distance = abs(x_s - x_t) + abs(y_s - y_t)  # this is also the shortest path length in 2D lattice
+    # sweeping along the longer side keeps the frontier as short as the shorter side
+    if rows >= cols:
+        node_order = sorted(graph.nodes, key=lambda node: coordinates[node])
+    else:
+        node_order = sorted(graph.nodes, key=lambda node: coordinates[node][::-1])
+    path_counts = count_simple_paths_by_length(graph, source, target, node_order,
+                                               max_frontier_width=max_frontier_width)
+    return {((path_length - l1_distance) / 2) + 1: (path_length, number_of_paths)
+            for path_length, number_of_paths in sorted(path_counts.items())}
+
+
+def approx_mean_path_length_for_2d_lattice_by_enumeration(graph, source, target, check_is_lattice=True):
+    # reference implementation visiting every simple path, only usable on small lattices
+    if check_is_lattice and not is_2d_lattice_graph(graph):
+        raise ValueError("Graph is not a 2D lattice")
+    return simple_path_length_histogram(graph, source, target).mean_length()
+
+
+class PathLengthHistogram:
+    """Number of simple paths by length in edges. `truncated` marks counts cut short by a time budget."""
+
+    def __init__(self, counts, truncated=False, cutoff=None):
+        self.counts = counts
+        self.truncated = truncated
+        self.cutoff = cutoff
+
+    def number_of_paths(self):
+        return sum(self.counts.values())
+
+    def mean_length(self):
+        return sum(length * count for length, count in self.counts.items()) / self.number_of_paths()
+
+    def __eq__(self, other):
+        return (self.counts == other.counts
+                and self.truncated == other.truncated
+                and self.cutoff == other.cutoff)
+
+    def __repr__(self):
+        return f'PathLengthHistogram(counts={self.counts}, truncated={self.truncated}, cutoff={self.cutoff})'
+
+
+def simple_path_length_histogram(graph, source, target, cutoff=None, time_budget=None):
+    """Streams simple paths between `source` and `target` and keeps only their count per length.
+
+    With `cutoff` only paths of at most `cutoff` edges are generated. When `time_budget` (in seconds) runs out,
+    the counts gathered so far are returned with `truncated` set. The budget is checked at every step of the search,
+    so it also holds when no path is found, for an unreachable target or a cutoff pruning every path.
+    """
+    for node, end in ((source, 'source'), (target, 'target')):
+        if node not in graph:
+            raise nx.NodeNotFound(f"{end} node {node} not in graph")
+    counts = {}
+    truncated = False
+    deadline = None if time_budget is None else time.monotonic() + time_budget
+    max_length = graph.number_of_nodes() - 1 if cutoff is None else cutoff
+    if source == target or max_length < 1:
+        return PathLengthHistogram(counts, truncated=truncated, cutoff=cutoff)
+    # depth-first search over simple paths from `source`, `path` holds its nodes and `stack` their unvisited neighbours
+    path = [source]
+    on_path = {source}
+    stack = [iter(graph[source])]
+    while stack:
+        if deadline is not None and time.monotonic() > deadline:
+            truncated = True
+            break
+        neighbour = next(stack[-1], None)
+        if neighbour is None:
+            stack.pop()
+            on_path.discard(path.pop())
+        elif neighbour == target:
+            counts[len(path)] = counts.get(len(path), 0) + 1
+        elif neighbour not in on_path and len(path) < max_length:
+            path.append(neighbour)
+            on_path.add(neighbour)
+            stack.append(iter(graph[neighbour]))
+    return PathLengthHistogram(counts, truncated=truncated, cutoff=cutoff)
+
+
+_UNTOUCHED = -1
+_INTERIOR = -2
+
+
+def count_simple_paths_by_length(graph, source, target, node_order=None,
+                                 max_frontier_width=DEFAULT_MAX_FRONTIER_WIDTH):
+    """Counts simple paths from `source` to `target` by their length in edges, without listing them.
+
+    Frontier-based dynamic programming: edges are decided one by one in `node_order`, and partial solutions are
+    merged whenever they look the same on the frontier (the visited nodes that still have undecided edges). For
+    every frontier node the state keeps whether it is untouched, interior to a path segment, or an end of a segment
+    together with the node at the other end. The cost grows with the frontier width, not with the number of paths,
+    so `node_order` should sweep the graph along its longest side (a lattice in row-major order over its shorter
+    side, for example).
+
+    The number of states still grows exponentially with the frontier width: a lattice sweep is width + 1 wide,
+    7 x 7 takes a fraction of a second, 9 x 9 about ten seconds and 10 x 10 more than a minute. Orders whose
+    frontier would be wider than `max_frontier_width` raise ValueError up front instead; None lifts the limit.
+    """
+    if source == target:
+        return {}
+    if node_order is None:
+        node_order = list(graph.nodes)
+    position = {node: i for i, node in enumerate(node_order)}
+    # a self loop is never on a simple path
+    edges = sorted(((min(position[u], position[v]), max(position[u], position[v])) for u, v in graph.edges()
+                    if u != v), key=lambda edge: (edge[1], edge[0]))
+    last_edge_of = {}
+    for k, (u, v) in enumerate(edges):
+        last_edge_of[u] = k
+        last_edge_of[v] = k
+    frontier_width = _max_frontier_width(edges, last_edge_of)
+    if max_frontier_width is not None and frontier_width > max_frontier_width:
+        raise ValueError(f"Counting paths needs a frontier of {frontier_width} nodes, more than "
+                         f"max_frontier_width={max_frontier_width}; the time grows exponentially with it")
+    s = position[source]
+    t = position[target]
+    terminals = (s, t)
+    # Path counts by length are packed into one integer as a polynomial evaluated at 2 ** shift, so merging two
+    # states is a single big integer addition and taking an edge is a shift. No coefficient can exceed the number
+    # of edge subsets, 2 ** len(edges), which makes len(edges) + 1 bits per coefficient enough.
+    shift = len(edges) + 1
+    frontier = []
+    states = {(): 1}
+    completed = 0
+    for k, (u, v) in enumerate(edges):
+        for w in (u, v):
+            if w not in frontier:
+                frontier.append(w)
+                states = {state + (_UNTOUCHED,): packed_counts for state, packed_counts in states.items()}
+        i_u = frontier.index(u)
+        i_v = frontier.index(v)
+        next_states = {}
+        for state, packed_counts in states.items():
+            next_states[state] = next_states.get(state, 0) + packed_counts  # edge not on the path
+            a = state[i_u]
+            b = state[i_v]
+            if a == _INTERIOR or b == _INTERIOR:
+                continue
+            if (u in terminals and a != _UNTOUCHED) or (v in terminals and b != _UNTOUCHED):
+                continue  # source and target take a single edge
+            end_u = u if a == _UNTOUCHED else a
+            end_v = v if b == _UNTOUCHED else b
+            if end_u == v:
+                continue  # u and v already end the same segment, the edge would close a cycle
+            next_state = list(state)
+            next_state[i_u] = end_v if a == _UNTOUCHED else _INTERIOR
+            next_state[i_v] = end_u if b == _UNTOUCHED else _INTERIOR
+            if end_u in frontier:
+                next_state[frontier.index(end_u)] = end_v
+            if end_v in frontier:
+                next_state[frontier.index(end_v)] = end_u
+            if end_u in terminals and end_v in terminals:
+                # the path is complete, any other open segment would be left disconnected
+                if all(value < 0 or frontier[i] in terminals for i, value in enumerate(next_state)):
+                    completed += packed_counts << shift
+                continue
+            next_state = tuple(next_state)
+            next_states[next_state] = next_states.get(next_state, 0) + (packed_counts << shift)
+        states = next_states
+
+        for w in (u, v):
+            if last_edge_of[w] != k:
+                continue
+            i_w = frontier.index(w)
+            frontier.pop(i_w)
+            next_states = {}
+            for state, packed_counts in states.items():
+                value = state[i_w]
+                # a node leaving the frontier can not take more edges: other nodes must be untouched or interior,
+                # a terminal must already be the end of a segment
+                if (value >= 0) if w not in terminals else (value < 0):
+                    continue
+                next_state = state[:i_w] + state[i_w + 1:]
+                next_states[next_state] = next_states.get(next_state, 0) + packed_counts
+            states = next_states
+
+    path_counts = {}
+    mask = (1 << shift) - 1
+    path_length = 0
+    while completed:
+        if completed & mask:
+            path_counts[path_length] = completed & mask
+        completed >>= shift
+        path_length += 1
+    return path_counts
+
+
+def _max_frontier_width(edges, last_edge_of):
+    # the frontier of `count_simple_paths_by_length` without its states: nodes join with their first edge and leave
+    # after their last one
+    frontier = set()
+    widest = 0
+    for k, (u, v) in enumerate(edges):
+        frontier.update((u, v))
+        widest = max(widest, len(frontier))
+        for w in (u, v):
+            if last_edge_of[w] == k:
+                frontier.discard(w)
+    return widest
+
+
 def is_2d_lattice_graph(graph) -> bool:
-    if nx.utils.graphs_equal(graph, nx.empty_graph()):
-        return True
-    degree_count = nx.degree_histogram(graph)
-    if degree_count == [1]:  # 1 x 1 lattice
-        return True
+    return lattice_2d_embedding(graph) is not None
+
+
+class Lattice2DEmbedding:
+    """Placement of a graph on a `rows` x `cols` lattice, `coordinates` maps every node to its (row, col)."""
+
+    def __init__(self, rows, cols, coordinates):
+        self.rows = rows
+        self.cols = cols
+        self.coordinates = coordinates
+
+    @property
+    def shape(self):
+        return self.rows, self.cols
+
+
+# embeddings found, cached per graph object together with the node and edge counts they were computed for
+_lattice_2d_embeddings = weakref.WeakKeyDictionary()
+
 
-    if len(degree_count) < 2:  # Lattice with more than 1 node will have at least 2 degrees
+def lattice_2d_embedding(graph, cached=True):
+    """Returns the `Lattice2DEmbedding` of `graph`, or None when it is not a 2D lattice.
+
+    An embedding found is cached on the graph object. Later calls check it still holds, every node placed and every
+    edge joining neighbouring positions, which is linear in the size of the graph but much cheaper than finding it
+    again, and find it again otherwise. `cached=False` always recomputes it. `graph` may also be a `Topology`,
+    checked on its arrays without building a networkx graph; topologies do not change, their embedding is reused as is.
+    """
+    if isinstance(graph, Topology):
+        signature = (graph.number_of_nodes, graph.number_of_edges)
+        find_embedding = _find_topology_lattice_2d_embedding
+    else:
+        signature = (graph.number_of_nodes(), graph.number_of_edges())
+        find_embedding = _find_lattice_2d_embedding
+    cached_embedding = _lattice_2d_embeddings.get(graph) if cached else None
+    if cached_embedding is not None and cached_embedding[0] == signature and (
+            isinstance(graph, Topology) or _still_embeds(graph, cached_embedding[1])):
+        return cached_embedding[1]
+    embedding = find_embedding(graph)
+    if embedding is not None:  # not being a lattice can not be checked cheaply, nothing to cache
+        _lattice_2d_embeddings[graph] = (signature, embedding)
+    else:
+        _lattice_2d_embeddings.pop(graph, None)
+    return embedding
+
+
+def _still_embeds(graph, embedding):
+    # with the same node and edge counts, every node placed and every edge joining neighbouring positions is still
+    # the lattice, as in `_find_lattice_2d_embedding`
+    coordinates = embedding.coordinates
+    if not all(node in coordinates for node in graph):
         return False
+    for u, v in graph.edges():
+        (row_u, col_u), (row_v, col_v) = coordinates[u], coordinates[v]
+        if abs(row_u - row_v) + abs(col_u - col_v) != 1:
+            return False
+    return True
 
+
+def _find_lattice_2d_embedding(graph):
     nodes_count = graph.number_of_nodes()
-    if degree_count[1] == 2:  # We are in a 1 x N lattice:
-        not_edge_nodes_count = nodes_count - 2
-        return (len(degree_count) == 2  # that is for 1 x 2 lattice
-                or (degree_count == [0, 2, not_edge_nodes_count]))  # that is for 1 x N lattice
-
-    if len(degree_count) == 3 or len(degree_count) == 4:  # We are in a 2 x N lattice:
-        not_corner_nodes_count = nodes_count - 4
-        return (degree_count == [0, 0, 4]  # that is for 2 x 2 lattice
-                or degree_count == [0, 0, 4, not_corner_nodes_count])  # that is for 2 x N lattice
-
-    if len(degree_count) == 5:  # We are potentially in N x M lattice:
-        has_four_corners = degree_count[:3] == [0, 0, 4]
-        if not has_four_corners:
-            return False
-        has_good_number_of_nodes = degree_count[3] + degree_count[4] == nodes_count - 4
-        if not has_good_number_of_nodes:
-            return False
-        decompositions = factor_decomposition(nodes_count)
-        for rows, cols in decompositions:
-            expected_number_of_degree_3_nodes = 2 * (cols - 2) + 2 * (rows - 2)
-            expected_number_of_degree_4_nodes = nodes_count - 4 - expected_number_of_degree_3_nodes
-            if degree_count == [0, 0, 4, expected_number_of_degree_3_nodes, expected_number_of_degree_4_nodes]:
-                return True
-    return False
+    if nodes_count == 0:
+        return Lattice2DEmbedding(0, 0, {})
+    degrees = graph.degree()
+    if graph.number_of_edges() == nodes_count - 1 and all(degree <= 2 for _, degree in degrees):
+        # 1 x N lattice, that is a path: distances from one of its ends are the columns
+        end = next(node for node, degree in degrees if degree <= 1)
+        distances = _bfs_distances(graph, end)
+        if len(distances) != nodes_count:
+            return None
+        return Lattice2DEmbedding(1, nodes_count, {node: (0, distance) for node, distance in distances.items()})
+
+    corners = [node for node, degree in degrees if degree == 2]
+    if not corners:
+        return None
+    # In a lattice the distance from corner (0, 0) is row + col, and from the corner (0, cols - 1) closest to it
+    # is row + (cols - 1 - col). Both distances together give back the coordinates of every node.
+    distances_from_corner = _bfs_distances(graph, corners[0])
+    if len(distances_from_corner) != nodes_count:
+        return None
+    next_corner = min(corners[1:], key=lambda node: distances_from_corner[node], default=None)
+    if next_corner is None:
+        return None
+    cols = distances_from_corner[next_corner] + 1
+    rows = nodes_count // cols
+    if rows * cols != nodes_count or graph.number_of_edges() != rows * (cols - 1) + cols * (rows - 1):
+        return None
+    distances_from_next_corner = _bfs_distances(graph, next_corner)
+    coordinates = {}
+    taken = set()
+    for node, distance in distances_from_corner.items():
+        doubled_row = distance + distances_from_next_corner[node] - (cols - 1)
+        row, col = doubled_row // 2, distance - doubled_row // 2
+        if doubled_row % 2 or not (0 <= row < rows and 0 <= col < cols) or (row, col) in taken:
+            return None
+        taken.add((row, col))
+        coordinates[node] = (row, col)
+    # every position is used once and there are exactly as many edges as in a lattice, so if all of them join
+    # neighbouring positions the graph is the lattice
+    for u, v in graph.edges():
+        (row_u, col_u), (row_v, col_v) = coordinates[u], coordinates[v]
+        if abs(row_u - row_v) + abs(col_u - col_v) != 1:
+            return None
+    return Lattice2DEmbedding(rows, cols, coordinates)
+
+
+def _find_topology_lattice_2d_embedding(topology):
+    # `_find_lattice_2d_embedding` on the CSR arrays: same corners, same checks, NumPy instead of loops over nodes
+    nodes_count = topology.number_of_nodes
+    if nodes_count == 0:
+        return Lattice2DEmbedding(0, 0, {})
+    degrees = np.diff(topology.indptr)
+    adjacency = csr_matrix((np.ones(len(topology.indices)), topology.indices, topology.indptr),
+                           shape=(nodes_count, nodes_count))
+
+    def distances_from(node):
+        distances = shortest_path(adjacency, unweighted=True, indices=int(node))
+        return None if np.isinf(distances).any() else distances.astype(np.intp)
+
+    if topology.number_of_edges == nodes_count - 1 and (degrees <= 2).all():
+        distances = distances_from(np.flatnonzero(degrees <= 1)[0])
+        if distances is None:
+            return None
+        return Lattice2DEmbedding(1, nodes_count, {label: (0, distance)
+                                                   for label, distance in zip(topology.labels, distances.tolist())})
+
+    corners = np.flatnonzero(degrees == 2)
+    if len(corners) < 2:
+        return None
+    distances_from_corner = distances_from(corners[0])
+    if distances_from_corner is None:
+        return None
+    next_corner = corners[1:][np.argmin(distances_from_corner[corners[1:]])]
+    cols = int(distances_from_corner[next_corner]) + 1
+    rows = nodes_count // cols
+    if rows * cols != nodes_count or topology.number_of_edges != rows * (cols - 1) + cols * (rows - 1):
+        return None
+    doubled_row = distances_from_corner + distances_from(next_corner) - (cols - 1)
+    row = doubled_row // 2
+    col = distances_from_corner - row
+    if (doubled_row % 2).any() or (row < 0).any() or (row >= rows).any() or (col < 0).any() or (col >= cols).any():
+        return None
+    if len(np.unique(row * cols + col)) != nodes_count:
+        return None
+    u, v = topology.edges[:, 0], topology.edges[:, 1]
+    if (np.abs(row[u] - row[v]) + np.abs(col[u] - col[v]) != 1).any():
+        return None
+    return Lattice2DEmbedding(rows, cols, dict(zip(topology.labels, zip(row.tolist(), col.tolist()))))
 
 
-def factor_decomposition(n):
-    factors = []
-    for i in range(1, int(n ** 0.5) + 1):
-        if n % i == 0:
-            factors.append((i, n // i))
-    return factors
+def _bfs_distances(graph, source):
+    distances = {source: 0}
+    frontier = [source]
+    while frontier:
+        next_frontier = []
+        for node in frontier:
+            for neighbour in graph[node]:
+                if neighbour not in distances:
+                    distances[neighbour] = distances[node] + 1
+                    next_frontier.append(neighbour)
+        frontier = next_frontier
+    return distances
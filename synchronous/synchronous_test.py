@@ -1,10 +1,18 @@
 import math
 import random
+import time
 
 import pytest
 
-from synchronous import external_phase, internal_phase, is_2d_lattice_graph, approx_mean_path_length_for_2d_lattice
+from synchronous import external_phase, internal_phase, is_2d_lattice_graph, approx_mean_path_length_for_2d_lattice, \
+    external_phase_batch, internal_phase_array, InternalPhaseEngine, count_simple_paths_by_length, \
+    path_counts_by_m_for_2d_lattice, approx_mean_path_length_for_2d_lattice_by_enumeration, \
+    simple_path_length_histogram, lattice_2d_embedding, CreatedAtAttributeName, TrialStreams, InstantComponents
 import networkx as nx
+import numpy as np
+
+from profiling import Profiler
+from topology import Topology
 
 random.seed(100)  # set seed for reproducible tests
 
@@ -48,6 +56,118 @@ class TestExternalPhase:
         expected_number_of_edges = round(number_of_edges_physical * p_input)
         assert math.isclose(expected_number_of_edges, average_instant_edges, rel_tol=0.05)
 
+    def test_should_sample_links_of_topology(self):
+        topology = Topology.from_graph(nx.grid_2d_graph(7, 7))
+        assert nx.utils.graphs_equal(external_phase(topology, 1), nx.grid_2d_graph(7, 7))
+        assert nx.utils.graphs_equal(external_phase(topology, 0), nx.empty_graph())
+        instant_topology = external_phase(topology, 0.5, created_at=2, rng=np.random.default_rng(3))
+        assert set(instant_topology.nodes) == set(topology.labels)
+        assert set(instant_topology.edges) <= set(nx.grid_2d_graph(7, 7).edges)
+        assert set(nx.get_edge_attributes(instant_topology, CreatedAtAttributeName).values()) == {2}
+
+    @pytest.mark.parametrize("p_input", [0, 0.3, 0.6, 1])
+    @pytest.mark.parametrize("as_topology", [False, True])
+    def test_should_label_components_of_instant_topology(self, p_input, as_topology):
+        physical_topology = nx.grid_2d_graph(6, 6)
+        components = InstantComponents()
+        components.union((0, 0), (5, 5))  # left over from an earlier trial
+        instant_topology = external_phase(Topology.from_graph(physical_topology) if as_topology else physical_topology,
+                                          p_input, rng=np.random.default_rng(2), components=components)
+        component_of = {node: i for i, component in enumerate(nx.connected_components(instant_topology))
+                        for node in component}
+        for u in physical_topology:
+            for v in physical_topology:
+                expected = u == v or (u in component_of and component_of[u] == component_of.get(v))
+                assert components.connected(u, v) == expected
+
+
+class TestCoherenceTime:
+    def test_external_phase_should_stamp_links_with_creation_time(self):
+        instant_topology = external_phase(nx.grid_2d_graph(3, 3), 1, created_at=5)
+        assert set(nx.get_edge_attributes(instant_topology, CreatedAtAttributeName).values()) == {5}
+
+    def test_external_phase_should_not_stamp_links_by_default(self):
+        instant_topology = external_phase(nx.grid_2d_graph(3, 3), 1)
+        assert nx.get_edge_attributes(instant_topology, CreatedAtAttributeName) == {}
+
+    @pytest.mark.parametrize("internal_phase_function", [internal_phase, internal_phase_array])
+    @pytest.mark.parametrize("coherence_time, expected", [(None, True), (0, False), (1, False), (2, True)])
+    def test_should_fail_when_swaps_take_longer_than_coherence_time(self, internal_phase_function, coherence_time,
+                                                                    expected):
+        path = internal_phase_function(nx.path_graph(4), source=0, target=3, q=1, coherence_time=coherence_time)
+        assert path is expected
+
+    def test_should_ignore_links_older_than_coherence_time(self):
+        instant_topology = external_phase(nx.path_graph(3), 1, created_at=2)
+        assert internal_phase(instant_topology, source=0, target=1, q=1, coherence_time=2, start_time=5) is False
+        assert internal_phase(instant_topology, source=0, target=1, q=1, coherence_time=3, start_time=5) is True
+
+    def test_should_start_clock_at_time_0_by_default(self):
+        instant_topology = external_phase(nx.path_graph(3), 1, created_at=0)
+        assert internal_phase(instant_topology, source=0, target=2, q=1, coherence_time=1) is True
+        assert internal_phase(instant_topology, source=0, target=2, q=1, coherence_time=1, start_time=1) is False
+
+    def test_swapped_link_should_be_as_old_as_its_oldest_part(self):
+        instant_topology = nx.path_graph(3)
+        instant_topology.edges[0, 1][CreatedAtAttributeName] = 4
+        instant_topology.edges[1, 2][CreatedAtAttributeName] = 2
+        assert internal_phase(instant_topology, source=0, target=2, q=1, coherence_time=2, start_time=4) is False
+        assert internal_phase(instant_topology, source=0, target=2, q=1, coherence_time=3, start_time=4) is True
+
+    def test_engine_should_be_statistically_identical_to_internal_phase(self):
+        number_of_runs = 3000
+        batch = external_phase_batch(nx.grid_2d_graph(4, 4), 0.9, trials=number_of_runs, rng=np.random.default_rng(9))
+        engine = InternalPhaseEngine.from_batch(batch)
+        array_rate = engine.run_batch(batch, (0, 0), (2, 2), 0.9, rng=np.random.default_rng(10),
+                                      coherence_time=4).mean()
+        reference_rate = sum(bool(internal_phase(batch.to_graph(trial), (0, 0), (2, 2), 0.9, coherence_time=4))
+                             for trial in range(number_of_runs)) / number_of_runs
+        pooled_rate = (array_rate + reference_rate) / 2
+        assert abs(array_rate - reference_rate) <= 4 * math.sqrt(2 * pooled_rate * (1 - pooled_rate) / number_of_runs)
+
+
+class TestExternalPhaseBatch:
+    physical_topology = nx.grid_2d_graph(3, 3)
+
+    def test_should_return_mask_per_trial_and_edge(self):
+        batch = external_phase_batch(self.physical_topology, 0.5, trials=7, rng=np.random.default_rng(1))
+        assert batch.masks.shape == (7, self.physical_topology.number_of_edges())
+        assert batch.masks.dtype == bool
+        assert batch.number_of_trials == 7
+
+    def test_should_have_no_edges_when_p_is_0(self):
+        batch = external_phase_batch(self.physical_topology, 0, trials=5)
+        assert not batch.masks.any()
+        assert batch.to_graph(0).number_of_edges() == 0
+        assert set(batch.to_graph(0).nodes) == set(self.physical_topology.nodes)
+
+    def test_should_return_full_topology_when_p_is_1(self):
+        batch = external_phase_batch(self.physical_topology, 1, trials=5)
+        assert batch.masks.all()
+        assert nx.utils.graphs_equal(batch.to_graph(3), self.physical_topology)
+
+    def test_should_return_empty_batch_on_empty_physical_topology(self):
+        batch = external_phase_batch(nx.empty_graph(), 0.5, trials=3)
+        assert batch.masks.shape == (3, 0)
+        assert nx.utils.graphs_equal(batch.to_graph(0), nx.empty_graph())
+
+    def test_adjacency_should_match_graph_view_of_trial(self):
+        batch = external_phase_batch(nx.grid_2d_graph(5, 5), 0.5, trials=4, rng=np.random.default_rng(2))
+        for trial in range(batch.number_of_trials):
+            instant_topology = batch.to_graph(trial)
+            indptr, indices = batch.adjacency(trial)
+            for i, node in enumerate(batch.nodes):
+                actual_neighbours = {batch.nodes[j] for j in indices[indptr[i]:indptr[i + 1]]}
+                assert actual_neighbours == set(nx.all_neighbors(instant_topology, node))
+
+    @pytest.mark.parametrize("p_input", [x * 0.1 for x in range(0, 11)])
+    def test_on_average_instant_topology_should_edges_proportional_to_success_probability(self, p_input):
+        big_test_topology = nx.grid_2d_graph(7, 7)
+        batch = external_phase_batch(big_test_topology, p_input, trials=1000, rng=np.random.default_rng(100))
+        average_instant_edges = batch.number_of_edges().mean()
+        expected_number_of_edges = big_test_topology.number_of_edges() * p_input
+        assert math.isclose(expected_number_of_edges, average_instant_edges, rel_tol=0.02, abs_tol=0.1)
+
 
 class TestInternalPhase:
     source = (0, 0)  # upper left corner
@@ -82,6 +202,204 @@ class TestInternalPhase:
         result = internal_phase(disconnected_instant_topology, source=0, target=3, q=1)
         assert result is False
 
+    @pytest.mark.parametrize("prune", [True, False])
+    def test_should_fail_without_path_whether_pruning_or_not(self, prune):
+        disconnected_instant_topology = nx.Graph([(0, 1), (1, 2), (3, 4)])
+        assert internal_phase(disconnected_instant_topology, source=0, target=4, q=1, prune=prune) is False
+        assert internal_phase(disconnected_instant_topology, source=0, target=5, q=1, prune=prune) is False
+
+    def test_should_prune_with_components_labelled_while_sampling(self):
+        profiler = Profiler()
+        components = InstantComponents()
+        instant_topology = external_phase(nx.path_graph(4), 0.5, rng=random.Random(1), components=components)
+        instant_topology.remove_edges_from(list(instant_topology.edges))
+        instant_topology.add_edges_from([(0, 1), (1, 2), (2, 3)])
+        # the labels are those of the sampling: the links added afterwards are not looked at
+        assert not components.connected(0, 3)
+        assert internal_phase(instant_topology, 0, 3, q=1, profiler=profiler, components=components) is False
+        assert internal_phase(instant_topology, 0, 3, q=1, profiler=profiler) is True
+        assert profiler.counts['pruned'] == 1
+
+    def test_pruning_should_not_change_success_rate(self):
+        physical_topology = nx.grid_2d_graph(4, 4)
+        rates = []
+        components = InstantComponents()
+        for prune in (True, False):
+            rng = np.random.default_rng(4)
+            rates.append(np.mean([internal_phase(external_phase(physical_topology, 0.5, rng=rng, components=components),
+                                                 (0, 0), (3, 3), 0.9, rng=rng, prune=prune, components=components)
+                                  for _ in range(4000)]))
+        assert rates[0] == pytest.approx(rates[1], abs=0.03)
+
+
+class TestProfiling:
+    def test_internal_phase_should_count_swaps_and_neighbour_rebuilds(self):
+        profiler = Profiler()
+        assert internal_phase(nx.path_graph(4), 0, 3, q=1, profiler=profiler) is True
+        assert profiler.counts['swaps'] == 2
+        assert profiler.counts['neighbour_rebuilds'] == 5
+        assert profiler.stage_calls == {'internal_phase.prune': 1, 'internal_phase.copy': 1,
+                                         'internal_phase.routing': 1}
+
+    def test_internal_phase_should_count_pruned_trials(self):
+        profiler = Profiler()
+        disconnected_instant_topology = nx.Graph([(0, 1), (2, 3)])
+        assert internal_phase(disconnected_instant_topology, 0, 3, q=1, profiler=profiler) is False
+        assert profiler.counts['pruned'] == 1
+        assert profiler.stage_calls == {'internal_phase.prune': 1}
+
+    def test_external_phase_should_time_copy_and_sampling(self):
+        profiler = Profiler()
+        external_phase(nx.grid_2d_graph(3, 3), 0.5, profiler=profiler)
+        assert profiler.stage_calls == {'external_phase.copy': 1, 'external_phase.sampling': 1}
+        assert profiler.counts['rng_draws'] == 12
+
+    def test_engine_should_count_trials(self):
+        profiler = Profiler()
+        batch = external_phase_batch(nx.path_graph(3), 1.0, trials=7, profiler=profiler)
+        InternalPhaseEngine.from_batch(batch).run_batch(batch, 0, 2, q=1, profiler=profiler)
+        assert profiler.counts['engine.trials'] == 7
+        assert set(profiler.stage_calls) == {'external_phase_batch', 'engine.run_batch'}
+
+    def test_engine_should_count_swaps_and_neighbour_rebuilds(self):
+        profiler = Profiler()
+        batch = external_phase_batch(nx.path_graph(4), 1.0, trials=3)
+        engine = InternalPhaseEngine.from_batch(batch)
+        assert engine.run_batch(batch, 0, 3, q=1, profiler=profiler).all()
+        # per trial: neighbours of 0, 1 and 2 are read, 1 swaps with 2 and 2 with 3
+        assert profiler.counts['swaps'] == 3 * 2
+        assert profiler.counts['neighbour_rebuilds'] == 3 * 3
+        engine.run_batch_many(batch, [(0, 3), (3, 0)], q=1, profiler=profiler)
+        assert profiler.counts['swaps'] == 3 * 2 + 6 * 2
+
+
+class TestRandomStreams:
+    physical_topology = nx.grid_2d_graph(4, 4)
+
+    def test_phases_should_be_reproducible_with_injected_generator(self):
+        instant_topologies = [external_phase(self.physical_topology, 0.6, rng=np.random.default_rng(3))
+                              for _ in range(2)]
+        assert list(instant_topologies[0].edges()) == list(instant_topologies[1].edges())
+        outcomes = [internal_phase(instant_topologies[0], (0, 0), (3, 3), 0.8, rng=np.random.default_rng(5))
+                    for _ in range(2)]
+        assert outcomes[0] == outcomes[1]
+
+    def test_should_replay_any_trial_on_its_own(self):
+        engine = InternalPhaseEngine.from_graph(self.physical_topology)
+        batch = external_phase_batch(self.physical_topology, 0.7, trials=50, streams=TrialStreams(11))
+        successes = engine.run_batch(batch, (0, 0), (3, 3), 0.8, streams=TrialStreams(11))
+        for trial in (0, 17, 49):
+            replay = external_phase_batch(self.physical_topology, 0.7, trials=1, streams=TrialStreams(11),
+                                          first_trial=trial)
+            assert np.array_equal(replay.masks[0], batch.masks[trial])
+            assert engine.run_batch(replay, (0, 0), (3, 3), 0.8, streams=TrialStreams(11))[0] == successes[trial]
+
+    def test_trials_should_not_depend_on_how_they_are_split_into_batches(self):
+        streams = TrialStreams(2)
+        whole = external_phase_batch(self.physical_topology, 0.5, trials=30, streams=streams)
+        parts = [external_phase_batch(self.physical_topology, 0.5, trials=10, streams=streams, first_trial=first)
+                 for first in (20, 0, 10)]
+        assert np.array_equal(whole.masks, np.concatenate([parts[1].masks, parts[2].masks, parts[0].masks]))
+
+    def test_streams_should_differ_between_seeds_trials_and_phases(self):
+        draws = {tuple(TrialStreams(seed).at(trial, phase).random(4))
+                 for seed in (0, 1) for trial in (0, 1) for phase in (TrialStreams.EXTERNAL_PHASE,
+                                                                      TrialStreams.INTERNAL_PHASE)}
+        assert len(draws) == 8
+
+    def test_trial_streams_should_keep_link_probability(self):
+        batch = external_phase_batch(self.physical_topology, 0.3, trials=2000, streams=TrialStreams(0))
+        assert batch.masks.mean() == pytest.approx(0.3, abs=0.01)
+
+
+class TestInternalPhaseArray:
+    source = (0, 0)
+    target = (2, 2)
+    full_instant_topology = nx.grid_2d_graph(5, 5)
+
+    def test_should_return_none_when_instant_topology_is_empty(self):
+        assert internal_phase_array(nx.empty_graph(), source=self.source, target=self.target, q=1.0) is None
+
+    def test_should_return_none_when_source_is_target(self):
+        assert internal_phase_array(self.full_instant_topology, source=self.source, target=self.source, q=1.0) is None
+
+    def test_should_return_false_when_q_is_0(self):
+        assert internal_phase_array(self.full_instant_topology, source=self.source, target=self.target, q=0) is False
+
+    def test_should_return_true_when_q_is_0_but_there_is_no_swap_to_happen(self):
+        assert internal_phase_array(nx.path_graph(2), source=0, target=1, q=0) is True
+
+    def test_should_return_true_when_q_is_1_on_simple_topology(self):
+        assert internal_phase_array(nx.path_graph(3), source=0, target=2, q=1) is True
+
+    def test_should_return_false_where_there_is_no_path(self):
+        disconnected_instant_topology = nx.path_graph(3)
+        disconnected_instant_topology.add_node(3)
+        assert internal_phase_array(disconnected_instant_topology, source=0, target=3, q=1) is False
+
+    def test_engine_should_not_modify_topology_between_trials(self):
+        engine = InternalPhaseEngine.from_graph(nx.path_graph(4))
+        assert [engine.run(0, 3, q=1) for _ in range(3)] == [True, True, True]
+
+    def test_run_many_should_route_every_pair_on_the_same_instant_topology(self):
+        engine = InternalPhaseEngine.from_graph(nx.path_graph(5))
+        edge_mask = np.array([True, True, False, True])  # 0 -- 1 -- 2    3 -- 4
+        assert engine.run_many([(0, 2), (1, 0), (0, 4), (3, 4)], q=1, edge_mask=edge_mask).tolist() == [
+            True, True, False, True]
+
+    def test_run_many_should_reject_pair_with_same_source_and_target(self):
+        with pytest.raises(ValueError):
+            InternalPhaseEngine.from_graph(nx.path_graph(3)).run_many([(0, 2), (1, 1)], q=1)
+
+    def test_run_batch_many_should_match_single_pair_rates(self):
+        number_of_runs = 3000
+        pairs = [((0, 0), (2, 3)), ((3, 3), (1, 0)), ((1, 1), (1, 2))]
+        batch = external_phase_batch(nx.grid_2d_graph(4, 4), 0.8, trials=number_of_runs, rng=np.random.default_rng(3))
+        engine = InternalPhaseEngine.from_batch(batch)
+        successes = engine.run_batch_many(batch, pairs, 0.9, rng=np.random.default_rng(4))
+        assert successes.shape == (number_of_runs, len(pairs))
+        for column, (source, target) in enumerate(pairs):
+            single_rate = engine.run_batch(batch, source, target, 0.9, rng=np.random.default_rng(5)).mean()
+            many_rate = successes[:, column].mean()
+            pooled_rate = (single_rate + many_rate) / 2
+            assert abs(single_rate - many_rate) <= 4 * math.sqrt(2 * pooled_rate * (1 - pooled_rate) / number_of_runs)
+
+    def test_should_accept_topology_in_place_of_graph(self):
+        topology = Topology.from_graph(nx.path_graph(5))
+        batch = external_phase_batch(topology, 1.0, trials=3)
+        assert batch.topology is topology
+        assert InternalPhaseEngine(topology).run_batch(batch, 0, 4, q=1).all()
+        assert internal_phase_array(topology, 0, 4, q=1) is True
+
+    def test_should_run_in_place_on_read_only_topology(self):
+        topology = Topology.from_graph(nx.grid_2d_graph(5, 5))
+        arrays = []
+        for array in (topology.edges, topology.indptr, topology.indices, topology.edge_ids):
+            array = array.copy()
+            array.flags.writeable = False  # as attached from shared memory
+            arrays.append(array)
+        read_only = Topology(topology.labels, *arrays)
+        batch = external_phase_batch(topology, 0.8, trials=300, rng=np.random.default_rng(1))
+        expected = InternalPhaseEngine(topology).run_batch(batch, (0, 0), (4, 4), 0.9, rng=np.random.default_rng(2))
+        engine = InternalPhaseEngine(read_only)
+        assert isinstance(engine._indices, memoryview)
+        assert np.array_equal(engine.run_batch(batch, (0, 0), (4, 4), 0.9, rng=np.random.default_rng(2)), expected)
+
+    @pytest.mark.parametrize("p, q", [(1.0, 0.9), (0.8, 0.8), (0.6, 1.0)])
+    def test_should_be_statistically_identical_to_internal_phase(self, p, q):
+        number_of_runs = 4000
+        physical_topology = nx.grid_2d_graph(4, 4)
+        source, target = (0, 0), (2, 3)
+        batch = external_phase_batch(physical_topology, p, trials=number_of_runs, rng=np.random.default_rng(7))
+        engine = InternalPhaseEngine.from_batch(batch)
+        rng = np.random.default_rng(8)
+        array_rate = engine.run_batch(batch, source, target, q, rng=rng).mean()
+        reference_rate = sum(bool(internal_phase(batch.to_graph(trial), source, target, q))
+                             for trial in range(number_of_runs)) / number_of_runs
+        pooled_rate = (array_rate + reference_rate) / 2
+        standard_error = math.sqrt(2 * pooled_rate * (1 - pooled_rate) / number_of_runs)
+        assert abs(array_rate - reference_rate) <= 4 * standard_error
+
 
 class TestUtils:
     def test_should_return_true_for_empty_graph(self):
@@ -105,6 +423,187 @@ class TestUtils:
         g = nx.grid_2d_graph(n, m)
         assert is_2d_lattice_graph(g)
 
+    def test_should_return_false_for_graph_with_lattice_degrees(self):
+        g = nx.disjoint_union(nx.path_graph(3), nx.cycle_graph(3))  # same degrees as a 1 x 6 lattice
+        assert not is_2d_lattice_graph(g)
+
+    def test_should_return_false_for_rewired_lattice(self):
+        g = nx.grid_2d_graph(4, 4)
+        nx.double_edge_swap(g, nswap=2, seed=3)  # keeps every degree
+        assert nx.is_connected(g)
+        assert not is_2d_lattice_graph(g)
+
+    def test_should_return_false_for_cycle(self):
+        assert not is_2d_lattice_graph(nx.cycle_graph(6))
+
+    @pytest.mark.parametrize("n,m", [(1, 1), (1, 5), (2, 2), (3, 6), (7, 4)])
+    def test_embedding_should_recover_dimensions_and_coordinates(self, n, m):
+        g = nx.grid_2d_graph(n, m)
+        embedding = lattice_2d_embedding(g)
+        assert sorted(embedding.shape) == sorted((n, m))
+        assert sorted(embedding.coordinates.values()) == sorted(
+            (row, col) for row in range(embedding.rows) for col in range(embedding.cols))
+        for u, v in g.edges():
+            (row_u, col_u), (row_v, col_v) = embedding.coordinates[u], embedding.coordinates[v]
+            assert abs(row_u - row_v) + abs(col_u - col_v) == 1
+
+    def test_should_recognise_relabelled_lattice(self):
+        g = nx.convert_node_labels_to_integers(nx.grid_2d_graph(5, 3), ordering="sorted")
+        nx.relabel_nodes(g, {node: f"node {(7 * node) % 15}" for node in g.nodes}, copy=False)
+        assert lattice_2d_embedding(g).shape in [(5, 3), (3, 5)]
+
+    @pytest.mark.parametrize("graph", [nx.grid_2d_graph(1, 1), nx.grid_2d_graph(1, 6), nx.grid_2d_graph(5, 3),
+                                       nx.grid_2d_graph(4, 4, periodic=True), nx.cycle_graph(6),
+                                       nx.disjoint_union(nx.path_graph(3), nx.cycle_graph(3))])
+    def test_topology_embedding_should_match_graph_embedding(self, graph):
+        expected = lattice_2d_embedding(graph, cached=False)
+        embedding = lattice_2d_embedding(Topology.from_graph(graph))
+        if expected is None:
+            assert embedding is None
+        else:
+            assert embedding.shape == expected.shape and embedding.coordinates == expected.coordinates
+
+    def test_embedding_should_be_cached_on_graph(self):
+        g = nx.grid_2d_graph(4, 4)
+        assert lattice_2d_embedding(g) is lattice_2d_embedding(g)
+
+    def test_embedding_cache_should_notice_rewired_edge(self):
+        g = nx.grid_2d_graph(3, 3)
+        assert is_2d_lattice_graph(g)
+        g.remove_edge((0, 0), (0, 1))
+        g.add_edge((0, 0), (2, 2))  # same node and edge counts
+        assert not is_2d_lattice_graph(g)
+        g.remove_edge((0, 0), (2, 2))
+        g.add_edge((0, 0), (0, 1))
+        assert is_2d_lattice_graph(g)
+
+    def test_embedding_cache_should_notice_added_nodes(self):
+        g = nx.grid_2d_graph(2, 2)
+        assert is_2d_lattice_graph(g)
+        g.add_edge((1, 1), (1, 2))
+        assert not is_2d_lattice_graph(g)
+        g.add_edge((0, 1), (0, 2))
+        g.add_edge((0, 2), (1, 2))
+        assert lattice_2d_embedding(g).shape in [(2, 3), (3, 2)]
+
+
+class TestPathLengths:
+    @pytest.mark.parametrize("n,m,source,target", [(1, 3, (0, 0), (0, 2)), (2, 2, (0, 0), (1, 1)),
+                                                   (3, 3, (0, 0), (2, 2)), (3, 3, (1, 1), (0, 2)),
+                                                   (4, 3, (0, 1), (3, 2)), (2, 5, (1, 4), (0, 0)),
+                                                   (4, 4, (1, 1), (2, 2))])
+    def test_mean_path_length_should_match_enumeration(self, n, m, source, target):
+        g = nx.grid_2d_graph(n, m)
+        expected = approx_mean_path_length_for_2d_lattice_by_enumeration(g, source, target)
+        assert math.isclose(approx_mean_path_length_for_2d_lattice(g, source, target), expected)
+
+    def test_path_counts_by_m_should_match_enumeration(self):
+        g = nx.grid_2d_graph(3, 4)
+        source, target = (0, 0), (2, 1)
+        expected = {}
+        for path in nx.all_simple_edge_paths(g, source, target):
+            m = ((len(path) - 3) / 2) + 1
+            expected[m] = (len(path), expected.get(m, (0, 0))[1] + 1)
+        assert path_counts_by_m_for_2d_lattice(g, source, target) == expected
+
+    @pytest.mark.parametrize("n,expected_number_of_paths", [(2, 2), (3, 12), (4, 184), (5, 8512), (6, 1262816),
+                                                            (7, 575780564)])
+    def test_should_count_corner_to_corner_paths_without_listing_them(self, n, expected_number_of_paths):
+        g = nx.grid_2d_graph(n, n)
+        path_counts = count_simple_paths_by_length(g, (0, 0), (n - 1, n - 1), sorted(g.nodes))
+        assert sum(path_counts.values()) == expected_number_of_paths
+        assert min(path_counts) == 2 * (n - 1)
+
+    def test_should_refuse_frontier_wider_than_limit_up_front(self):
+        start = time.monotonic()
+        with pytest.raises(ValueError):
+            approx_mean_path_length_for_2d_lattice(nx.grid_2d_graph(12, 12), (0, 0), (11, 11))
+        assert time.monotonic() - start < 1
+        g = nx.grid_2d_graph(4, 4)
+        with pytest.raises(ValueError):
+            count_simple_paths_by_length(g, (0, 0), (3, 3), sorted(g.nodes), max_frontier_width=4)
+        assert count_simple_paths_by_length(g, (0, 0), (3, 3), sorted(g.nodes), max_frontier_width=None) \
+            == count_simple_paths_by_length(g, (0, 0), (3, 3), sorted(g.nodes))
+
+    def test_frontier_limit_should_follow_shorter_side(self):
+        g = nx.grid_2d_graph(3, 40)  # swept along its 40 rows, the frontier is as narrow as for 3 x 3
+        assert approx_mean_path_length_for_2d_lattice(g, (0, 0), (2, 1), max_frontier_width=4) > 0
+
+    @pytest.mark.parametrize("seed", range(5))
+    def test_should_count_paths_on_any_graph(self, seed):
+        g = nx.gnp_random_graph(9, 0.4, seed=seed)
+        expected = {}
+        for path in nx.all_simple_edge_paths(g, 0, 8):
+            expected[len(path)] = expected.get(len(path), 0) + 1
+        assert count_simple_paths_by_length(g, 0, 8) == expected
+
+    @pytest.mark.parametrize("seed", range(3))
+    def test_should_ignore_self_loops(self, seed):
+        g = nx.gnp_random_graph(8, 0.45, seed=seed)
+        g.add_edges_from([(2, 2), (0, 0)])
+        node_order = list(g.nodes)
+        random.Random(seed).shuffle(node_order)
+        expected = simple_path_length_histogram(g, 0, 7).counts
+        assert count_simple_paths_by_length(g, 0, 7, node_order) == expected
+        assert count_simple_paths_by_length(nx.Graph([(0, 1), (1, 2), (1, 1)]), 0, 2) == {2: 1}
+
+    def test_should_count_no_paths_from_node_to_itself(self):
+        assert count_simple_paths_by_length(nx.grid_2d_graph(3, 3), (1, 1), (1, 1)) == {}
+
+    def test_mean_path_length_should_not_depend_on_node_labels(self):
+        g = nx.grid_2d_graph(4, 3)
+        relabelled = nx.relabel_nodes(g, {(x, y): x * 3 + y for x, y in g.nodes})
+        expected = approx_mean_path_length_for_2d_lattice(g, (0, 0), (3, 1))
+        assert math.isclose(approx_mean_path_length_for_2d_lattice(relabelled, 0, 10), expected)
+
+    def test_should_raise_value_error_for_non_lattice(self):
+        with pytest.raises(ValueError):
+            approx_mean_path_length_for_2d_lattice(nx.complete_graph(4), 0, 3)
+
+
+class TestSimplePathLengthHistogram:
+    def test_should_count_paths_by_length(self):
+        histogram = simple_path_length_histogram(nx.grid_2d_graph(3, 3), (0, 0), (2, 2))
+        assert histogram.counts == {4: 6, 6: 4, 8: 2}
+        assert histogram.number_of_paths() == 12
+        assert not histogram.truncated
+
+    def test_should_only_count_paths_up_to_cutoff(self):
+        histogram = simple_path_length_histogram(nx.grid_2d_graph(3, 3), (0, 0), (2, 2), cutoff=6)
+        assert histogram.counts == {4: 6, 6: 4}
+        assert histogram.cutoff == 6
+        assert not histogram.truncated
+
+    def test_should_return_partial_counts_when_time_budget_runs_out(self):
+        histogram = simple_path_length_histogram(nx.grid_2d_graph(6, 6), (0, 0), (5, 5), time_budget=0.05)
+        assert histogram.truncated
+        assert 0 < histogram.number_of_paths() < 1262816
+
+    def test_should_return_mean_length(self):
+        histogram = simple_path_length_histogram(nx.path_graph(4), 0, 3)
+        assert histogram.mean_length() == 3
+
+    def test_should_return_empty_counts_when_there_is_no_path(self):
+        g = nx.path_graph(3)
+        g.add_node(3)
+        assert simple_path_length_histogram(g, 0, 3).counts == {}
+
+    def test_time_budget_should_hold_when_target_is_unreachable(self):
+        g = nx.grid_2d_graph(8, 8)
+        g.add_node('isolated')
+        start = time.monotonic()
+        histogram = simple_path_length_histogram(g, (0, 0), 'isolated', time_budget=0.05)
+        assert time.monotonic() - start < 1
+        assert histogram.truncated and histogram.counts == {}
+
+    @pytest.mark.parametrize("cutoff", [None, 0, 1, 3, 5])
+    def test_should_count_the_same_paths_as_networkx(self, cutoff):
+        g = nx.gnp_random_graph(9, 0.4, seed=7)
+        expected = {}
+        for path in nx.all_simple_edge_paths(g, 0, 8, cutoff=cutoff):
+            expected[len(path)] = expected.get(len(path), 0) + 1
+        assert simple_path_length_histogram(g, 0, 8, cutoff=cutoff).counts == expected
+
 
 class TestExternalInternalPhases:
     @pytest.mark.skip(reason="For local play")
@@ -0,0 +1,88 @@
+import math
+
+import numpy as np
+from scipy.spatial import ConvexHull, QhullError, cKDTree
+
+from topology import Topology
+
+
+def grid_topology(rows, cols, periodic=False):
+    """`Topology.from_graph(nx.grid_2d_graph(rows, cols, periodic))`, built from index arithmetic instead of a graph.
+
+    Nodes are labelled (row, col), which is also their row of `coordinates`. As in networkx, `periodic` wraps the
+    rows and the columns into a torus, each only when it is longer than 2.
+    """
+    node = np.arange(rows * cols).reshape(rows, cols)
+    # links in the order `nx.grid_2d_graph` adds them: along columns, along rows, then the wrap-around ones
+    heads = [node[1:, :].ravel(), node[:, 1:].ravel()]
+    tails = [node[:-1, :].ravel(), node[:, :-1].ravel()]
+    if periodic and rows > 2:
+        heads.append(node[0, :])
+        tails.append(node[-1, :])
+    if periodic and cols > 2:
+        heads.append(node[:, 0])
+        tails.append(node[:, -1])
+    row, col = np.divmod(np.arange(rows * cols), cols)
+    labels = list(zip(row.tolist(), col.tolist()))
+    return Topology.from_edges(labels, np.concatenate(heads), np.concatenate(tails),
+                               coordinates=np.stack((row, col), axis=1).astype(float))
+
+
+def torus_topology(rows, cols):
+    return grid_topology(rows, cols, periodic=True)
+
+
+def random_geometric_topology(n, radius, dim=2, seed=None):
+    """Nodes `0..n-1` at uniform random positions in the unit cube, linked when closer than `radius`.
+
+    Same model as `nx.random_geometric_graph`, with the close pairs found by a k-d tree instead of over every pair.
+    """
+    rng = np.random.default_rng(seed)
+    coordinates = rng.random((n, dim))
+    pairs = cKDTree(coordinates).query_pairs(radius, output_type='ndarray')
+    return _from_pairs(n, pairs, coordinates)
+
+
+def waxman_topology(n, beta=0.4, alpha=0.1, domain=(0, 0, 1, 1), seed=None, min_probability=1e-9,
+                    chunk_size=1024):
+    """Waxman graph: nodes `0..n-1` uniform in `domain` = (xmin, ymin, xmax, ymax), linked with probability
+    `beta * exp(-d / (alpha * L))`, `L` the largest distance between two nodes, as in `nx.waxman_graph`.
+
+    Only pairs close enough to be linked with probability at least `min_probability` are drawn, instead of all n^2
+    pairs. A k-d tree finds them for `chunk_size` nodes at a time, which bounds the memory taken by the candidates.
+    """
+    rng = np.random.default_rng(seed)
+    xmin, ymin, xmax, ymax = domain
+    coordinates = rng.uniform((xmin, ymin), (xmax, ymax), size=(n, 2))
+    if n < 2 or beta <= min_probability:
+        return _from_pairs(n, np.empty((0, 2), dtype=np.intp), coordinates)
+    L = _diameter(coordinates)
+    cutoff = alpha * L * math.log(beta / min_probability)
+    tree = cKDTree(coordinates)
+    linked_pairs = []
+    for start in range(0, n, chunk_size):
+        chunk = cKDTree(coordinates[start:start + chunk_size])
+        close = chunk.sparse_distance_matrix(tree, cutoff, output_type='ndarray')
+        heads = close['i'] + start
+        lower = heads < close['j']  # every pair once, from its lower end
+        heads, tails, distances = heads[lower], close['j'][lower], close['v'][lower]
+        linked = rng.random(len(heads)) < beta * np.exp(-distances / (alpha * L))
+        linked_pairs.append(np.stack((heads[linked], tails[linked]), axis=1))
+    return _from_pairs(n, np.concatenate(linked_pairs).astype(np.intp), coordinates)
+
+
+def _from_pairs(n, pairs, coordinates):
+    # the k-d tree gives pairs in no particular order, sorting them makes the topology depend on the seed only
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    return Topology.from_edges(list(range(n)), pairs[:, 0], pairs[:, 1], coordinates=coordinates)
+
+
+def _diameter(points):
+    # the two points furthest apart are both on the convex hull
+    if len(points) > 3:
+        try:
+            points = points[ConvexHull(points).vertices]
+        except QhullError:  # all points on a line, the hull is not defined
+            pass
+    differences = points[:, None, :] - points[None, :, :]
+    return float(np.sqrt((differences ** 2).sum(axis=-1)).max())
@@ -0,0 +1,72 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from generators import grid_topology, torus_topology, random_geometric_topology, waxman_topology
+from topology import Topology
+
+
+def _same_topology(topology, expected):
+    return (topology.labels == expected.labels and np.array_equal(topology.edges, expected.edges)
+            and np.array_equal(topology.indptr, expected.indptr) and np.array_equal(topology.indices, expected.indices)
+            and np.array_equal(topology.edge_ids, expected.edge_ids))
+
+
+class TestGridTopology:
+    @pytest.mark.parametrize("rows, cols", [(1, 1), (1, 5), (2, 2), (3, 4), (7, 5)])
+    @pytest.mark.parametrize("periodic", [False, True])
+    def test_should_match_topology_of_networkx_grid(self, rows, cols, periodic):
+        assert _same_topology(grid_topology(rows, cols, periodic=periodic),
+                              Topology.from_graph(nx.grid_2d_graph(rows, cols, periodic=periodic)))
+
+    def test_torus_should_wrap_both_sides(self):
+        topology = torus_topology(4, 5)
+        assert topology.number_of_edges == 2 * 4 * 5
+        assert (np.diff(topology.indptr) == 4).all()
+
+    def test_coordinates_should_be_row_and_column_of_labels(self):
+        topology = grid_topology(3, 4)
+        assert topology.coordinates.tolist() == [list(label) for label in topology.labels]
+
+
+class TestFromEdges:
+    @pytest.mark.parametrize("graph", [nx.gnp_random_graph(30, 0.2, seed=4), nx.barabasi_albert_graph(40, 3, seed=5),
+                                       nx.Graph([(0, 0), (0, 1), (2, 1)])])
+    def test_should_match_graph_built_from_same_edges(self, graph):
+        edges = np.array([(u, v) for u, v in graph.edges], dtype=np.intp)
+        expected = nx.Graph()
+        expected.add_nodes_from(range(graph.number_of_nodes()))
+        expected.add_edges_from(edges.tolist())
+        assert _same_topology(Topology.from_edges(list(expected), edges[:, 0], edges[:, 1]),
+                              Topology.from_graph(expected))
+
+
+class TestRandomGeometricTopology:
+    def test_should_link_nodes_closer_than_radius(self):
+        radius = 0.15
+        topology = random_geometric_topology(300, radius, seed=1)
+        expected = nx.random_geometric_graph(300, radius, pos=dict(enumerate(topology.coordinates.tolist())))
+        assert sorted(map(tuple, topology.edges.tolist())) == sorted(expected.edges)
+
+    def test_should_depend_on_seed_only(self):
+        assert _same_topology(random_geometric_topology(200, 0.1, seed=2), random_geometric_topology(200, 0.1, seed=2))
+
+
+class TestWaxmanTopology:
+    def test_should_have_as_many_links_as_networkx_waxman_graph(self):
+        n, beta, alpha = 200, 0.4, 0.1
+        edges = [waxman_topology(n, beta, alpha, seed=seed).number_of_edges for seed in range(20)]
+        expected = [nx.waxman_graph(n, beta, alpha, seed=seed).number_of_edges() for seed in range(20)]
+        assert np.mean(edges) == pytest.approx(np.mean(expected), rel=0.05)
+
+    def test_should_link_only_pairs_within_cutoff_with_small_chunks(self):
+        topology = waxman_topology(300, beta=1.0, alpha=0.05, seed=3, min_probability=0.01, chunk_size=7)
+        heads, tails = topology.coordinates[topology.edges[:, 0]], topology.coordinates[topology.edges[:, 1]]
+        lengths = np.linalg.norm(heads - tails, axis=1)
+        assert topology.number_of_edges > 0
+        assert (lengths <= 0.05 * np.sqrt(2) * np.log(100)).all()
+        assert (topology.edges[:, 0] < topology.edges[:, 1]).all()
+
+    def test_should_keep_nodes_in_domain(self):
+        topology = waxman_topology(100, domain=(2, 3, 4, 7), seed=4)
+        assert (topology.coordinates >= (2, 3)).all() and (topology.coordinates <= (4, 7)).all()
@@ -0,0 +1,244 @@
+import hashlib
+import pickle
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+
+import networkx as nx
+import numpy as np
+
+
+class Topology:
+    """Physical topology over dense integer ids, built once and shared by every trial run on it.
+
+    Node `i` is labelled `labels[i]` and edge `e` joins nodes `edges[e, 0]` and `edges[e, 1]`. Neighbours of node `i`
+    are `indices[indptr[i]:indptr[i + 1]]` and `edge_ids` holds the edge of each of those slots. Built from a graph,
+    nodes, edges and neighbours keep the graph's order, so results that depend on adjacency order do not change.
+    Labels only come back at the API boundary, through `labels` and `index_of`. Generated topologies also have the
+    position of every node as a row of `coordinates`.
+    """
+
+    def __init__(self, labels, edges, indptr=None, indices=None, edge_ids=None, coordinates=None):
+        self.labels = labels
+        self.edges = edges
+        if indptr is None:
+            indptr, indices, edge_ids = csr_from_edges(len(labels), edges)
+        self.indptr = indptr
+        self.indices = indices
+        self.edge_ids = edge_ids
+        self.coordinates = coordinates
+        self._node_index = None
+        self._fingerprint = None
+
+    @classmethod
+    def from_graph(cls, graph: nx.Graph):
+        labels = list(graph.nodes())
+        node_index = {label: i for i, label in enumerate(labels)}
+        edges = []
+        edge_of_pair = {}
+        indptr = np.zeros(len(labels) + 1, dtype=np.intp)
+        indices = []
+        edge_ids = []
+        for i, (_, neighbours) in enumerate(graph.adjacency()):
+            for neighbour in neighbours:
+                j = node_index[neighbour]
+                pair = (i, j) if i <= j else (j, i)
+                edge = edge_of_pair.get(pair)
+                if edge is None:  # first seen from its lower end, which is also the order of `graph.edges()`
+                    edge = edge_of_pair[pair] = len(edges)
+                    edges.append(pair)
+                indices.append(j)
+                edge_ids.append(edge)
+            indptr[i + 1] = len(indices)
+        topology = cls(labels, np.array(edges, dtype=np.intp).reshape(-1, 2), indptr,
+                       np.array(indices, dtype=np.intp), np.array(edge_ids, dtype=np.intp))
+        topology._node_index = node_index
+        return topology
+
+    @classmethod
+    def from_edges(cls, labels, heads, tails, coordinates=None):
+        """Topology of the graph made by adding links `heads[k]`-`tails[k]` (node indices) one after the other.
+
+        Gives the same arrays as `from_graph` on that graph, without building it: neighbours come in the order their
+        link was added and edges are numbered as `from_graph` numbers them.
+        """
+        heads = np.asarray(heads, dtype=np.intp)
+        tails = np.asarray(tails, dtype=np.intp)
+        slot_heads = np.stack((heads, tails), axis=1).ravel()
+        slot_tails = np.stack((tails, heads), axis=1).ravel()
+        links = np.repeat(np.arange(len(heads)), 2)
+        single = np.ones(len(slot_heads), dtype=bool)
+        single[1::2] = heads != tails  # a self loop is a single neighbour slot
+        order = np.argsort(slot_heads[single], kind='stable')
+        slot_heads, indices, links = slot_heads[single][order], slot_tails[single][order], links[single][order]
+        indptr = np.zeros(len(labels) + 1, dtype=np.intp)
+        np.cumsum(np.bincount(slot_heads, minlength=len(labels)), out=indptr[1:])
+        # `from_graph` numbers an edge when it first meets it, which is from its lower end
+        first_seen = indices >= slot_heads
+        edge_of_link = np.empty(len(heads), dtype=np.intp)
+        edge_of_link[links[first_seen]] = np.arange(np.count_nonzero(first_seen))
+        edges = np.stack((slot_heads[first_seen], indices[first_seen]), axis=1).reshape(-1, 2)
+        return cls(labels, edges, indptr, indices, edge_of_link[links], coordinates)
+
+    @classmethod
+    def of(cls, physical_topology):
+        """Returns `physical_topology` if it already is a `Topology`, builds one from the graph otherwise."""
+        if isinstance(physical_topology, cls):
+            return physical_topology
+        return cls.from_graph(physical_topology)
+
+    @property
+    def number_of_nodes(self):
+        return len(self.labels)
+
+    @property
+    def number_of_edges(self):
+        return len(self.edges)
+
+    @property
+    def nbytes(self):
+        return self.edges.nbytes + self.indptr.nbytes + self.indices.nbytes + self.edge_ids.nbytes
+
+    def fingerprint(self):
+        """Digest of the labels, edges and CSR arrays, the same for topologies with the same nodes, links and order of
+        neighbours, which decides the parents of a DODAG.
+
+        Computed once, a topology is not meant to change after it is built.
+        """
+        if self._fingerprint is None:
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(repr(self.labels).encode())
+            for array in (self.edges, self.indptr, self.indices, self.edge_ids):
+                digest.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def index_of(self, label):
+        if isinstance(self.labels, range):  # nodes labelled by their index, as attached without labels
+            return self.labels.index(label)
+        if self._node_index is None:  # only built when nodes are looked up by label
+            self._node_index = {label: i for i, label in enumerate(self.labels)}
+        return self._node_index[label]
+
+    def neighbours(self, index):
+        return self.indices[self.indptr[index]:self.indptr[index + 1]]
+
+    def edge_labels(self, edge_mask=None):
+        edges = self.edges if edge_mask is None else self.edges[edge_mask]
+        return [(self.labels[u], self.labels[v]) for u, v in edges.tolist()]
+
+    def to_graph(self, edge_mask=None):
+        graph = nx.Graph()
+        graph.add_nodes_from(self.labels)
+        graph.add_edges_from(self.edge_labels(edge_mask))
+        return graph
+
+
+def csr_from_edges(number_of_nodes, edges):
+    # both directions of every edge, grouped by head node; `edge_ids` maps each CSR slot back to its row in `edges`
+    heads = np.concatenate((edges[:, 0], edges[:, 1]))
+    tails = np.concatenate((edges[:, 1], edges[:, 0]))
+    order = np.argsort(heads, kind='stable')
+    indptr = np.zeros(number_of_nodes + 1, dtype=np.intp)
+    np.cumsum(np.bincount(heads, minlength=number_of_nodes), out=indptr[1:])
+    edge_ids = np.concatenate((np.arange(len(edges)), np.arange(len(edges))))[order]
+    return indptr, tails[order], edge_ids
+
+
+@dataclass(frozen=True)
+class SharedTopologyHandle:
+    """What a process needs to attach to a `SharedTopology`: a few integers, whatever the size of the topology."""
+    name: str
+    number_of_nodes: int
+    number_of_edges: int
+    number_of_slots: int  # neighbour slots of the CSR arrays, twice the number of edges without self loops
+    labels_size: int
+
+
+class SharedTopology:
+    """A `Topology` published once in a `multiprocessing.shared_memory` block for other processes to attach to.
+
+    The block holds the edge and CSR arrays, followed by the pickled labels. Send `handle` to the workers instead of
+    the graph or the topology and have them call `attach_topology`; close the `SharedTopology` (or leave its `with`
+    block) once they are done, which frees the block.
+    """
+
+    def __init__(self, topology):
+        topology = Topology.of(topology)
+        labels = pickle.dumps(topology.labels, protocol=pickle.HIGHEST_PROTOCOL)
+        layout = _shared_layout(topology.number_of_nodes, topology.number_of_edges, len(topology.indices))
+        size = layout[-1][1] + len(labels)
+        self._shared_memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for (name, offset, shape), array in zip(layout[:-1], (topology.edges, topology.indptr, topology.indices,
+                                                               topology.edge_ids)):
+            np.ndarray(shape, dtype=np.intp, buffer=self._shared_memory.buf, offset=offset)[...] = array
+        labels_offset = layout[-1][1]
+        self._shared_memory.buf[labels_offset:labels_offset + len(labels)] = labels
+        self.handle = SharedTopologyHandle(self._shared_memory.name, topology.number_of_nodes,
+                                           topology.number_of_edges, len(topology.indices), len(labels))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self._shared_memory is not None:
+            self._shared_memory.close()
+            self._shared_memory.unlink()
+            self._shared_memory = None
+
+
+# topologies this process attached to, by block name and whether labels were loaded: attaching again is free and
+# keeps the block mapped until `detach_topology`
+_attached_topologies = {}
+
+
+def attach_topology(handle, labels=True):
+    """The `Topology` published under `handle`, its arrays read-only views of the shared block, nothing copied.
+
+    Labels are unpickled once per process. With `labels=False` they are not loaded at all and node `i` is labelled
+    `i`, for workers that are sent node indices. `Topology.to_graph` rebuilds a networkx graph from it where one is
+    needed.
+    """
+    key = (handle.name, labels)
+    attached = _attached_topologies.get(key)
+    if attached is None:
+        block = shared_memory.SharedMemory(name=handle.name)
+        layout = _shared_layout(handle.number_of_nodes, handle.number_of_edges, handle.number_of_slots)
+        arrays = []
+        for _, offset, shape in layout[:-1]:
+            array = np.ndarray(shape, dtype=np.intp, buffer=block.buf, offset=offset)
+            array.flags.writeable = False
+            arrays.append(array)
+        if labels:
+            labels_offset = layout[-1][1]
+            node_labels = pickle.loads(block.buf[labels_offset:labels_offset + handle.labels_size])
+        else:
+            node_labels = range(handle.number_of_nodes)
+        attached = _attached_topologies[key] = (block, Topology(node_labels, *arrays))
+    return attached[1]
+
+
+def detach_topology(handle):
+    """Unmaps the block of `handle` from this process, the opposite of `attach_topology`.
+
+    Every topology attached from it, and whatever still reads its arrays, has to be dropped first: a block can not
+    be unmapped under live views. The block itself stays until the `SharedTopology` that published it is closed.
+    """
+    for key in ((handle.name, True), (handle.name, False)):
+        if key in _attached_topologies:
+            block = _attached_topologies.pop(key)[0]
+            block.close()
+
+
+def _shared_layout(number_of_nodes, number_of_edges, number_of_slots):
+    # (name, byte offset, shape) of every array in the block, then where the labels start
+    layout = []
+    offset = 0
+    for name, shape in (('edges', (number_of_edges, 2)), ('indptr', (number_of_nodes + 1,)),
+                        ('indices', (number_of_slots,)), ('edge_ids', (number_of_slots,))):
+        layout.append((name, offset, shape))
+        offset += int(np.prod(shape)) * np.dtype(np.intp).itemsize
+    layout.append(('labels', offset, None))
+    return layout
@@ -0,0 +1,119 @@
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import networkx as nx
+import numpy as np
+import pytest
+
+from topology import Topology, csr_from_edges, SharedTopology, attach_topology, detach_topology
+
+
+class TestTopology:
+    @pytest.mark.parametrize("graph_factory", [lambda: nx.grid_2d_graph(4, 3),
+                                               lambda: nx.gnp_random_graph(30, 0.2, seed=4),
+                                               lambda: nx.barabasi_albert_graph(40, 3, seed=5)])
+    def test_should_keep_graph_order_of_nodes_edges_and_neighbours(self, graph_factory):
+        graph = graph_factory()
+        topology = Topology.from_graph(graph)
+        assert topology.labels == list(graph.nodes)
+        assert topology.edge_labels() == list(graph.edges)
+        for i, label in enumerate(topology.labels):
+            assert [topology.labels[j] for j in topology.neighbours(i)] == list(graph[label])
+
+    def test_edge_ids_should_point_to_edge_of_each_neighbour_slot(self):
+        topology = Topology.from_graph(nx.grid_2d_graph(5, 5))
+        for i in range(topology.number_of_nodes):
+            for slot in range(topology.indptr[i], topology.indptr[i + 1]):
+                assert sorted(topology.edges[topology.edge_ids[slot]]) == sorted((i, topology.indices[slot]))
+
+    def test_should_build_neighbours_from_edges_alone(self):
+        graph = nx.gnp_random_graph(25, 0.3, seed=6)
+        from_graph = Topology.from_graph(graph)
+        from_edges = Topology(from_graph.labels, from_graph.edges)
+        for i in range(from_graph.number_of_nodes):
+            assert sorted(from_edges.neighbours(i)) == sorted(from_graph.neighbours(i))
+
+    def test_should_translate_labels_at_the_boundary(self):
+        topology = Topology.from_graph(nx.grid_2d_graph(3, 3))
+        assert topology.labels[topology.index_of((2, 1))] == (2, 1)
+        assert Topology(topology.labels, topology.edges).index_of((1, 2)) == topology.index_of((1, 2))
+
+    def test_should_convert_back_to_graph(self):
+        graph = nx.grid_2d_graph(4, 4)
+        topology = Topology.from_graph(graph)
+        assert nx.utils.graphs_equal(topology.to_graph(), graph)
+        edge_mask = np.arange(topology.number_of_edges) % 2 == 0
+        assert topology.to_graph(edge_mask).number_of_edges() == edge_mask.sum()
+        assert topology.to_graph(edge_mask).number_of_nodes() == 16
+
+    def test_fingerprint_should_only_depend_on_nodes_and_links(self):
+        fingerprint = Topology.from_graph(nx.grid_2d_graph(3, 3)).fingerprint()
+        assert Topology.from_graph(nx.grid_2d_graph(3, 3)).fingerprint() == fingerprint
+        other_graph = nx.grid_2d_graph(3, 3)
+        other_graph.remove_edge((0, 0), (0, 1))
+        assert Topology.from_graph(other_graph).fingerprint() != fingerprint
+        assert Topology.from_graph(nx.path_graph(9)).fingerprint() != fingerprint
+
+    def test_of_should_not_rebuild_topology(self):
+        topology = Topology.from_graph(nx.path_graph(3))
+        assert Topology.of(topology) is topology
+
+    def test_should_handle_empty_graph(self):
+        topology = Topology.from_graph(nx.empty_graph())
+        assert topology.number_of_nodes == 0
+        assert topology.edges.shape == (0, 2)
+
+
+def _attached_summary(handle):
+    topology = attach_topology(handle)
+    return topology.fingerprint(), topology.labels[:3], topology.neighbours(4).tolist()
+
+
+class TestSharedTopology:
+    @pytest.mark.parametrize("graph_factory", [lambda: nx.grid_2d_graph(5, 4), lambda: nx.empty_graph(),
+                                               lambda: nx.Graph([(0, 0), (0, 1), (1, 2)])])
+    def test_attached_topology_should_match_published_one(self, graph_factory):
+        topology = Topology.from_graph(graph_factory())
+        with SharedTopology(topology) as shared_topology:
+            attached = attach_topology(shared_topology.handle)
+            assert attached.labels == topology.labels
+            for name in ('edges', 'indptr', 'indices', 'edge_ids'):
+                assert np.array_equal(getattr(attached, name), getattr(topology, name))
+            assert attached.fingerprint() == topology.fingerprint()
+
+    def test_attached_arrays_should_be_read_only_and_attached_once(self):
+        with SharedTopology(nx.path_graph(5)) as shared_topology:
+            attached = attach_topology(shared_topology.handle)
+            assert attach_topology(shared_topology.handle) is attached
+            with pytest.raises(ValueError):
+                attached.indices[0] = 3
+
+    def test_should_attach_without_labels_and_detach(self):
+        topology = Topology.from_graph(nx.grid_2d_graph(3, 3))
+        with SharedTopology(topology) as shared_topology:
+            attached = attach_topology(shared_topology.handle, labels=False)
+            assert attached.labels == range(9)
+            assert attached.index_of(4) == 4
+            assert attached.neighbours(4).tolist() == topology.neighbours(4).tolist()
+            del attached
+            detach_topology(shared_topology.handle)
+            assert attach_topology(shared_topology.handle).labels == topology.labels  # mapped again
+            detach_topology(shared_topology.handle)
+
+    def test_handle_should_not_grow_with_topology(self):
+        with SharedTopology(nx.grid_2d_graph(3, 3)) as small, SharedTopology(nx.grid_2d_graph(60, 60)) as large:
+            assert len(pickle.dumps(large.handle)) - len(pickle.dumps(small.handle)) < 16
+
+    def test_workers_should_attach_to_published_topology(self):
+        topology = Topology.from_graph(nx.grid_2d_graph(6, 6))
+        with SharedTopology(topology) as shared_topology, ProcessPoolExecutor(max_workers=2) as executor:
+            summaries = list(executor.map(_attached_summary, [shared_topology.handle] * 4))
+        assert summaries == [(topology.fingerprint(), topology.labels[:3], topology.neighbours(4).tolist())] * 4
+
+
+class TestCsrFromEdges:
+    def test_should_list_both_directions_of_every_edge(self):
+        indptr, indices, edge_ids = csr_from_edges(3, np.array([[0, 1], [1, 2]]))
+        assert indptr.tolist() == [0, 1, 3, 4]
+        assert indices.tolist() == [1, 2, 0, 1]
+        assert edge_ids.tolist() == [0, 1, 0, 1]